@@ -3,6 +3,8 @@
 #
 #2023/12/19: 何故か前回に読み込んだIDを削除する挙動があったため, 削除の確認ボタンを追加
 #2023/12/21: 全体の記録をとっていなかったのでとる
+#2025: タッチはローカルのジャーナルに記録し, 送信は別スレッドで行う (ネットワーク停止で読み取りが止まらないように)
+#2025: List は起動時に1度だけ読み込み, 変更は List.journal への追記で記録する (roster.py)
 #
 
 # {{{ Librarlies
@@ -12,24 +14,26 @@ from tkinter import font
 import nfc
 import time
 import threading
-import json
-import requests
-from ID_handelr import remove_register
-from ID_handelr import add_entry
-from ID_handelr import update_entry
-from ID_handelr import read_entry
+from roster import RosterStore
+from tap_journal import TapJournal
+from tap_journal import TapSyncWorker
 #}}}
 
 # {{{ global 変数の用意
 key_id = None
 file_path = "List"
 record_path = "Record"
-entry_number = None
+journal_path = "Journal.db"
+# 出席管理サーバーのURL (None の場合はサーバーへ送信しない)
+server_url = None
+webhook_address = "https://ryu365.webhook.office.com/webhookb2/585cc2b0-ed47-41cd-8bd1-39b5befc07b2@23b65fdf-a4e3-4a19-b03d-12b1d57ad76e/IncomingWebhook/7184503f4b0d40789d95ea5f971d3c4d/3662ba78-b3f0-47e3-9820-376798dc17d5/V2eyRuG9PZKe50zaNYR8D7Ts520qNvuQzZFBrfrcx-ibY1"
 entry_name = None
 # 登録名入力待ちの判定
 on_going_register = False
 # Debug 用の停止命令
 close_order = False
+# 登録者名簿 (カードIDで引けるようにメモリ上に保持)
+roster = RosterStore(file_path)
 # }}}
 
 #{{{ Tkinter ウィンドウの作成と準備
@@ -81,7 +85,6 @@ entry = tk.Entry(root, width=entry_width)
 #{{{ def register_entry():
 def register_entry():
 	# Entry登録追加ボタンの処理
-	global file_path
 	entry_name = entry.get()
 	if entry_name == "":
 		system_message1.set("システム: エラー: 登録名が確認できませんでした")
@@ -91,7 +94,7 @@ def register_entry():
 		register_button.grid_remove()
 		root.after(2500,message_register_mode)
 	else:
-		add_entry(file_path, key_id, entry_name)
+		roster.add(key_id, entry_name)
 		message = "システム: " +  entry_name + " さんを登録しました"
 		system_message2.set(message)
 		entry.delete(0, tk.END)
@@ -128,15 +131,13 @@ def delete_cancel():
 
 #{{{ def delete_register()
 def delete_register():
-	global file_path
 	global entry_name
-	global entry_number
 
 	# ボタン削除
 	delete_button.grid_remove()
 	cancel_button.grid_remove()
 
-	remove_register(file_path,entry_number)
+	roster.remove(key_id)
 
 	message = "システム: " +  entry_name + " さんの登録を削除しました"
 	system_message2.set(message)
@@ -154,19 +155,21 @@ def delete_register():
 def window_close():
 	global close_order
 	close_order = True
+	sync_worker.stop(timeout=5)
+	roster.close()
 	root.destroy()
 #}}}
 
-# {{{ def webhook_post():
-def webhook_post(webhook_title, webhook_message):
-	webhook_address = "https://ryu365.webhook.office.com/webhookb2/585cc2b0-ed47-41cd-8bd1-39b5befc07b2@23b65fdf-a4e3-4a19-b03d-12b1d57ad76e/IncomingWebhook/7184503f4b0d40789d95ea5f971d3c4d/3662ba78-b3f0-47e3-9820-376798dc17d5/V2eyRuG9PZKe50zaNYR8D7Ts520qNvuQzZFBrfrcx-ibY1"
-	payload={"text": webhook_title + ":" + webhook_message}
-	response=requests.post(webhook_address, headers={"Content-Type": "application/json"}, data=json.dumps(payload))
+# {{{ タッチのジャーナルと送信スレッド
+# タッチは journal に即座に記録し, サーバー/Webhook への送信は sync_worker がまとめて行う
+journal = TapJournal(journal_path)
+sync_worker = TapSyncWorker(journal, server_url=server_url, webhook_url=webhook_address)
+sync_worker.start()
 
-	if response.status_code == 200:
-		print("Sucessful post")
-	else:
-		print(response.text)
+def record_tap(card_id, name, status, webhook_title, webhook_message):
+	# ネットワークを待たずに記録して送信スレッドを起こす
+	journal.append(card_id, name, status, webhook_title, webhook_message)
+	sync_worker.wake()
 #}}}
 
 # {{{ Tkinter Windowの設置
@@ -228,7 +231,6 @@ def nfc_register():
 	global current_mode
 	global on_going_register
 	global close_order
-	global entry_number
 	global entry_name
 
 	# nfc カードの読み込み用意
@@ -238,16 +240,15 @@ def nfc_register():
 	# terminate を指定しないと, 読み取りを中断できない
 	clf.connect(rdwr={'on-connect': on_connect}, terminate=lambda: close_order)
 
-	# List から該当のidがあるか判定
-	# entry_number は該当がなければ-1, あれば行数-1をかえす
-	# entry_name は該当があれば登録名を返す
-	entry_number, entry_name = read_entry(file_path, key_id)
+	# 名簿から該当のidがあるか判定
+	# entry_name は該当があれば登録名, なければ None を返す
+	entry_name = roster.lookup(key_id)
 
 	# 入退室記録モードの場合
 	if current_mode.get() == "Log":
 
 		# 登録がない場合の処理
-		if entry_number == -1:
+		if entry_name is None:
 			# メッセージを表示して読み取り再開
 			system_message1.set("システム: 登録のない学生証が読みこまれました")
 			system_message2.set("システム: 入退室情報を記録するためには，まず登録をしてください")
@@ -261,7 +262,7 @@ def nfc_register():
 			# status[0]: 1 : 入室 : 0 : 退室
 			# status[1]: 在室時間の時間数 : 入室時は0となっている
 			# status[2]: 在室時間の分数 : 入室時は0となっている
-			status = update_entry(file_path, key_id)
+			status = roster.toggle(key_id)
 			# add_record(record_path, entry_name, status[0])
 
 			if status[0]:
@@ -269,7 +270,7 @@ def nfc_register():
 				system_message2.set(message)
 				webhook_title = entry_name
 				webhook_message = "入室"
-				webhook_post(webhook_title, webhook_message)
+				record_tap(key_id, entry_name, "入室", webhook_title, webhook_message)
 
 				# 入室時は多分メッセージを読まないので，１秒
 				root.after(1000,message_timelog_mode)
@@ -278,7 +279,7 @@ def nfc_register():
 				system_message2.set(message)
 				webhook_title = entry_name
 				webhook_message = "退室: 在室時間は" + str(status[1]) + "時間" + str(status[2]) + "分"
-				webhook_post(webhook_title, webhook_message)
+				record_tap(key_id, entry_name, "退室", webhook_title, webhook_message)
 				root.after(2500,message_timelog_mode)
 
 	# 登録モードの場合
@@ -288,7 +289,7 @@ def nfc_register():
 		on_going_register = True
 
 		# 登録があるか調べる
-		if entry_number == -1:
+		if entry_name is None:
 
 			# 氏名入力中にモード変更させない
 			radio_button1.grid_remove()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+# 登録者名簿 (List) のインメモリストア
+#
+# 起動時に List を1度だけ読み込み, カードIDをキーとする dict で保持する.
+# 変更は List.journal への1行の追記として記録し, 一定回数ごとに List へまとめて書き戻す (compaction).
+# List の形式 (タブ区切り) は ID_handelr.py と同じなので既存のファイルをそのまま使える.
+#
+# 各行の列
+# 0: ID
+# 1: Name
+# 2: Status (1: 在室, 0: 不在)
+# 3: Time (入室時刻, 不在時は 0)
+# 4: Core day of week
+# 5: Core lecture time
+# 6: Core day of week
+# 7: Core lecture time
+#
+
+# {{{ Librarlies
+import os
+import threading
+from datetime import datetime
+#}}}
+
+FIELD_COUNT = 8
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+#{{{ class RosterStore:
+class RosterStore:
+
+    def __init__(self, file_path="List", journal_path=None, compact_every=200):
+        self.file_path = file_path
+        self.journal_path = journal_path or file_path + ".journal"
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.journal_lines = 0
+
+        self._load()
+        self.journal = open(self.journal_path, 'a', encoding='UTF-8')
+
+    # {{{ 読み込み
+    def _load(self):
+        # List を読み込んでからジャーナルを再生する
+        if os.path.exists(self.file_path):
+            with open(self.file_path, 'r', encoding='UTF-8') as file:
+                for line in file:
+                    row = line.rstrip('\n').split('\t')
+                    if row[0] == "":
+                        continue
+                    self.entries[row[0]] = self._pad(row)
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='UTF-8') as file:
+                for line in file:
+                    # 書き込み途中で止まった最後の行は無視する
+                    if not line.endswith('\n'):
+                        break
+                    op, _, payload = line.rstrip('\n').partition('\t')
+                    if op == "set":
+                        row = self._pad(payload.split('\t'))
+                        self.entries[row[0]] = row
+                    elif op == "del":
+                        self.entries.pop(payload, None)
+                    self.journal_lines += 1
+
+    @staticmethod
+    def _pad(row):
+        return row + ["0"] * (FIELD_COUNT - len(row))
+    # }}}
+
+    # {{{ 永続化
+    def _append(self, op, payload):
+        # 1回の変更につき1行だけ追記する
+        self.journal.write(op + '\t' + payload + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_lines += 1
+        if self.journal_lines >= self.compact_every:
+            self._compact()
+
+    def _compact(self):
+        # 現在の内容で List を書き直し (一時ファイルから置き換え), ジャーナルを空にする
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='UTF-8') as file:
+            file.writelines('\t'.join(row) + '\n' for row in self.entries.values())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.file_path)
+        self.journal.truncate(0)
+        self.journal.seek(0)
+        self.journal_lines = 0
+
+    def compact(self):
+        with self.lock:
+            self._compact()
+
+    def close(self):
+        with self.lock:
+            self._compact()
+            self.journal.close()
+    # }}}
+
+    # {{{ 参照と更新
+    def lookup(self, key_id):
+        # 登録名を返す. 登録がなければ None
+        with self.lock:
+            row = self.entries.get(str(key_id))
+            return row[1] if row else None
+
+    def add(self, key_id, key_name):
+        with self.lock:
+            row = [str(key_id), key_name] + ["0"] * (FIELD_COUNT - 2)
+            self.entries[row[0]] = row
+            self._append("set", '\t'.join(row))
+
+    def remove(self, key_id):
+        with self.lock:
+            if self.entries.pop(str(key_id), None) is not None:
+                self._append("del", str(key_id))
+
+    def toggle(self, key_id):
+        # 在室/不在を切り替える (ID_handelr.update_entry と同じ戻り値)
+        # return: -1 0 0 登録なし
+        # return: 1 0 0 入室
+        # return: 0 hours minutes 退室 滞在時間 滞在分
+        with self.lock:
+            row = self.entries.get(str(key_id))
+            if row is None:
+                return -1, 0, 0
+
+            now = datetime.now()
+            row = list(row)
+            if row[2] == "0":
+                row[2] = "1"
+                row[3] = now.strftime(DATE_FORMAT)
+                hours = 0
+                minutes = 0
+            else:
+                row[2] = "0"
+                try:
+                    entry_time = datetime.strptime(row[3], DATE_FORMAT)
+                except ValueError:
+                    # 入室時刻が壊れている場合は滞在時間0として退室させる
+                    entry_time = now
+                row[3] = "0"
+                # 滞在時間の計算
+                stay_time = now - entry_time
+                hours, remainder = divmod(stay_time.seconds, 3600)
+                minutes, _ = divmod(remainder, 60)
+
+            self.entries[row[0]] = row
+            self._append("set", '\t'.join(row))
+            return int(row[2]), hours, minutes
+    # }}}
+#}}}
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# 入退室タッチのローカルジャーナルと送信スレッド
+#
+# タッチはまずローカルの SQLite (Journal.db) に記録してすぐに画面へ反映し,
+# ネットワークへの送信は TapSyncWorker が別スレッドでまとめて行う.
+# サーバーやネットワークが止まっていてもカード読み取りは止まらない.
+#
+# event_id はカードIDとタッチ時刻から決まるので, 同じタッチを何度記録・送信しても1件になる
+# (サーバーも同じ学生・時刻の記録を duplicate として無視する).
+#
+
+# {{{ Librarlies
+import sqlite3
+import threading
+import uuid
+import json
+from datetime import datetime
+import requests
+#}}}
+
+# event_id を作るための名前空間 (値は固定. 変えると既存のジャーナルと id が一致しなくなる)
+EVENT_NAMESPACE = uuid.UUID("5f0c6f3e-8f7a-4d8b-9a35-2c1d0c7e4b21")
+
+# pushed の値
+PUSH_PENDING = 0   # 未送信 (サーバーが error を返したものも max_push_attempts 回までは再送する)
+PUSH_DONE = 1      # 送信済み (duplicate を含む)
+PUSH_FAILED = 2    # 再送を諦めた (retry_failed で未送信に戻せる)
+
+def make_event_id(card_id, tap_time):
+    # 同じカード・同じ時刻のタッチは同じ id になる
+    return uuid.uuid5(EVENT_NAMESPACE, str(card_id) + "|" + tap_time.isoformat()).hex
+
+#{{{ class TapJournal:
+class TapJournal:
+    # 追記のみのタッチ記録キュー
+    # pushed        : サーバー (/api/attendance/batch) への送信状態 (PUSH_PENDING / PUSH_DONE / PUSH_FAILED)
+    # push_attempts : サーバーが error を返した回数
+    # last_error    : 最後に返された error の内容
+    # notified      : Webhook へ通知済みか
+
+    def __init__(self, path="Journal.db"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS taps (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id TEXT UNIQUE NOT NULL,
+            card_id TEXT NOT NULL,
+            name TEXT,
+            status TEXT,
+            tap_time TEXT NOT NULL,
+            title TEXT,
+            message TEXT,
+            pushed INTEGER DEFAULT 0,
+            notified INTEGER DEFAULT 0,
+            push_attempts INTEGER DEFAULT 0,
+            last_error TEXT
+        )
+        ''')
+        # 以前のジャーナルには push_attempts / last_error がない
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(taps)")}
+        for column, definition in (("push_attempts", "INTEGER DEFAULT 0"), ("last_error", "TEXT")):
+            if column not in columns:
+                self.conn.execute("ALTER TABLE taps ADD COLUMN " + column + " " + definition)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_taps_pushed ON taps (pushed, seq)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_taps_notified ON taps (notified, seq)")
+
+    def append(self, card_id, name, status, title, message, tap_time=None, event_id=None):
+        # タッチを1件記録して event_id を返す
+        # 同じ event_id (同じカード・時刻) の再記録は無視される (重複排除)
+        tap_time = tap_time or datetime.now()
+        event_id = event_id or make_event_id(card_id, tap_time)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO taps (event_id, card_id, name, status, tap_time, title, message) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (event_id, str(card_id), name, status, tap_time.isoformat(), title, message)
+            )
+        return event_id
+
+    def unpushed(self, limit):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT seq, card_id, tap_time FROM taps WHERE pushed = ? ORDER BY seq LIMIT ?", (PUSH_PENDING, limit)
+            ).fetchall()
+
+    def unnotified(self, limit):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT seq, title, message FROM taps WHERE notified = 0 ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+
+    def mark_pushed(self, seqs):
+        with self.lock:
+            self.conn.executemany("UPDATE taps SET pushed = ? WHERE seq = ?", [(PUSH_DONE, seq) for seq in seqs])
+
+    def mark_push_error(self, errors, max_attempts):
+        # errors: [(seq, エラー内容)]. max_attempts 回失敗したものは PUSH_FAILED にして送信対象から外す
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE taps SET push_attempts = push_attempts + 1, last_error = ?,"
+                " pushed = CASE WHEN push_attempts + 1 >= ? THEN ? ELSE pushed END WHERE seq = ?",
+                [(error, max_attempts, PUSH_FAILED, seq) for seq, error in errors]
+            )
+
+    def failed(self, limit=100):
+        # 再送を諦めたタッチ (seq, card_id, tap_time, push_attempts, last_error)
+        with self.lock:
+            return self.conn.execute(
+                "SELECT seq, card_id, tap_time, push_attempts, last_error FROM taps WHERE pushed = ? ORDER BY seq LIMIT ?",
+                (PUSH_FAILED, limit)
+            ).fetchall()
+
+    def retry_failed(self):
+        # 再送を諦めたタッチを未送信に戻す (サーバーに学生を登録した後など). 戻した件数を返す
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE taps SET pushed = ?, push_attempts = 0 WHERE pushed = ?", (PUSH_PENDING, PUSH_FAILED)
+            ).rowcount
+
+    def mark_notified(self, seqs):
+        with self.lock:
+            self.conn.executemany("UPDATE taps SET notified = 1 WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def backlog(self):
+        # 未送信の件数 (サーバー, Webhook, サーバーへの再送を諦めた件数)
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COALESCE(SUM(pushed = ?), 0), COALESCE(SUM(notified = 0), 0), COALESCE(SUM(pushed = ?), 0) FROM taps",
+                (PUSH_PENDING, PUSH_FAILED)
+            ).fetchone()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+#}}}
+
+#{{{ class TapSyncWorker(threading.Thread):
+class TapSyncWorker(threading.Thread):
+    # ジャーナルの未送信分をバッチで送る送信スレッド
+    # server_url  : 出席管理サーバーのURL (例: http://localhost:8889). None なら送信しない
+    # webhook_url : Teams 等の Webhook のURL. None なら通知しない
+    # 失敗時は指数バックオフ (最大 max_delay 秒) で再送する
+    # サーバーがタッチ単位で error を返した場合 (未登録の学生など) はそのタッチだけ残し,
+    # max_push_attempts 回続けて error なら PUSH_FAILED にする (journal.failed() で確認できる)
+
+    def __init__(self, journal, server_url=None, webhook_url=None, batch_size=50,
+                 interval=2.0, timeout=5.0, max_delay=300.0, max_push_attempts=5):
+        super().__init__(daemon=True)
+        self.journal = journal
+        self.server_url = server_url.rstrip("/") if server_url else None
+        self.webhook_url = webhook_url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.max_delay = max_delay
+        self.max_push_attempts = max_push_attempts
+        self.session = requests.Session()
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+
+    def wake(self):
+        # 新しいタッチを記録したら呼び出す
+        self.wake_event.set()
+
+    def stop(self, timeout=None):
+        self.stop_event.set()
+        self.wake_event.set()
+        self.join(timeout)
+
+    def run(self):
+        delay = self.interval
+        while not self.stop_event.is_set():
+            try:
+                sent = self.sync_once()
+                delay = self.interval
+            except Exception as e:
+                sent = 0
+                delay = min(self.max_delay, delay * 2)
+                print("送信に失敗しました (" + str(round(delay, 1)) + "秒後に再送): " + str(e))
+
+            if sent >= self.batch_size:
+                continue
+            self.wake_event.wait(delay)
+            self.wake_event.clear()
+
+    def sync_once(self):
+        # 1バッチ分を送信して送信件数を返す. 失敗時は例外を送出する
+        sent = 0
+
+        if self.server_url:
+            rows = self.journal.unpushed(self.batch_size)
+            if rows:
+                # サーバー側の学籍番号としてカードIDを送る
+                # 同じ学生・時刻の再送はサーバー側で duplicate として無視される
+                events = [{"student_id": card_id, "time": tap_time} for _, card_id, tap_time in rows]
+                response = self.session.post(
+                    self.server_url + "/api/attendance/batch",
+                    json={"events": events},
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                # 結果は入力順. error のタッチは送信済みにせず, 次の回に再送する
+                results = response.json()
+                pushed = []
+                errors = []
+                for (seq, _, _), result in zip(rows, results):
+                    if result.get("status") == "error":
+                        errors.append((seq, str(result.get("detail"))))
+                    else:
+                        pushed.append(seq)
+                self.journal.mark_pushed(pushed)
+                if errors:
+                    self.journal.mark_push_error(errors, self.max_push_attempts)
+                    print("サーバーに記録できなかったタッチがあります: " + str(len(errors)) + "件 (" + errors[0][1] + ")")
+                # error を含むバッチはすぐには送り直さない
+                sent = max(sent, len(rows) if not errors else len(pushed))
+
+        if self.webhook_url:
+            rows = self.journal.unnotified(self.batch_size)
+            for seq, title, message in rows:
+                payload = {"text": title + ":" + message}
+                response = self.session.post(
+                    self.webhook_url,
+                    headers={"Content-Type": "application/json"},
+                    data=json.dumps(payload),
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                self.journal.mark_notified([seq])
+            sent = max(sent, len(rows))
+
+        return sent
+#}}}
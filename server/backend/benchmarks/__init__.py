@@ -0,0 +1 @@
+# このファイルは空で問題ありません 
\ No newline at end of file
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+非同期エンドポイントのイベントループ遅延ベンチマーク
+
+アプリをプロセス内で起動し（httpx の ASGI トランスポート）、
+5ms ごとに起床するプローブでイベントループの遅延を計測します。
+同時に以下の負荷をかけ、遅延の分布を比較します。
+
+- idle:  負荷なし
+- async: 非同期セッション版の /api/attendance-now/{id} への同時タッチ
+- sync:  比較用に、旧実装の /api/attendance-now/{id} と同じ読み取り・書き込み・コミットを
+         同期 Session でイベントループ上から直接行うエンドポイント
+         （旧実装は Telegram に直接送信していたが、ここでは async と同じくアウトボックスに積む）
+
+実行例（server/backend で実行）:
+    python -m benchmarks.bench_event_loop --students 200 --concurrency 50 --seconds 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE_INTERVAL = 0.005
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+async def probe(stop, lags):
+    """ 一定間隔で起床し、予定時刻からの遅れを記録する """
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, loop.time() - expected))
+
+async def run_phase(client, name, path_template, students, concurrency, seconds):
+    stop = asyncio.Event()
+    lags = []
+    requests = 0
+    errors = 0
+
+    async def worker(offset):
+        nonlocal requests, errors
+        i = offset
+        while not stop.is_set():
+            response = await client.post(path_template.format(student_id=f"s{i % students:05d}"))
+            requests += 1
+            if response.status_code >= 500:
+                errors += 1
+            i += concurrency
+            # ASGI トランスポートは実ソケットと違い I/O 待ちがないため、明示的にループへ戻す
+            await asyncio.sleep(0)
+
+    probe_task = asyncio.create_task(probe(stop, lags))
+    workers = [asyncio.create_task(worker(i)) for i in range(concurrency)] if path_template else []
+    started = time.perf_counter()
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(probe_task, *workers)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "phase": name,
+        "requests_per_sec": round(requests / elapsed, 1),
+        "errors": errors,  # 5xx（SQLite のロック待ちのタイムアウトなど）
+        "loop_lag_ms": {
+            "p50": round(percentile(lags, 50) * 1000, 2),
+            "p99": round(percentile(lags, 99) * 1000, 2),
+            "max": round(max(lags, default=0.0) * 1000, 2),
+            "mean": round(statistics.fmean(lags) * 1000, 2) if lags else 0.0,
+        },
+    }
+
+async def run(args):
+    import main
+    from db.database import SessionLocal
+    from models.models import Student, CurrentStatus, AttendanceLog
+    from services.notifier import enqueue_notification
+
+    # 比較用: 旧実装の attendance-now と同じ処理を、同期 Session でイベントループ上から直接行う
+    # Depends(get_db) だと close がスレッドプール側で遅れて実行され、
+    # 同時実行数がプールの上限を超えるとループが接続待ちで止まるため、ここで閉じる
+    @main.app.post("/bench/sync-tap/{student_id}")
+    async def sync_tap(student_id: str):
+        current_time = datetime.now()
+        db = SessionLocal()
+        try:
+            student = db.query(Student).filter(Student.student_id == student_id).first()
+            name = student.name
+            current_status = db.query(CurrentStatus).filter(CurrentStatus.student_id == student_id).first()
+            if not current_status:
+                db.add(CurrentStatus(student_id=student_id, entry_time=current_time))
+                db.add(AttendanceLog(student_id=student_id, entry_time=current_time, exit_time=None))
+                enqueue_notification(db, f"🟢 {name}さんが入室しました。")
+                db.commit()
+                main.presence.mark_entry(student_id, current_time)
+                status = "入室"
+            else:
+                attendance_log = db.query(AttendanceLog).filter(
+                    AttendanceLog.student_id == student_id,
+                    AttendanceLog.exit_time == None
+                ).order_by(AttendanceLog.entry_time.desc()).first()
+                if attendance_log:
+                    attendance_log.exit_time = current_time
+                db.delete(current_status)
+                enqueue_notification(db, f"🔴 {name}さんが退室しました。")
+                db.commit()
+                main.presence.mark_exit(student_id)
+                status = "退室"
+        finally:
+            db.close()
+        main.notifier.wake()
+        return {"name": name, "status": status}
+    main.app.router.routes.insert(0, main.app.router.routes.pop())
+
+    # Telegram への送信はローカルで成功扱いにする
+    main.notifier.transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True}))
+
+    async with main.app.router.lifespan_context(main.app):
+        # 5xx は例外にせず応答として数える
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for i in range(args.students):
+                await client.post("/api/students/", json={"student_id": f"s{i:05d}", "name": f"学生{i}"})
+
+            results = [await run_phase(client, "idle", None, args.students, args.concurrency, args.seconds)]
+            results.append(await run_phase(
+                client, "async", "/api/attendance-now/{student_id}", args.students, args.concurrency, args.seconds
+            ))
+            results.append(await run_phase(
+                client, "sync", "/bench/sync-tap/{student_id}", args.students, args.concurrency, args.seconds
+            ))
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="event loop latency benchmark")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # アプリの読み込み前に一時データベースと Telegram 設定を指定する
+        os.environ["ATTENDANCE_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ.setdefault("TELEGRAM_ID", "bench")
+        os.environ.setdefault("TELEGRAM_ALERT", "bench")
+        os.chdir(BACKEND_DIR)  # 静的ファイルのパスは backend からの相対パス
+        sys.path.insert(0, BACKEND_DIR)
+        results = asyncio.run(run(args))
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+APIの負荷・レイテンシベンチマーク
+
+アプリをプロセス内で起動し（httpx の ASGI トランスポート）、一時データベースに
+指定した規模のデータを投入してから、以下のシナリオを順に実行します。
+
+- taps:          /api/attendance-now/{id} への同時タッチ（入退室が交互に起きる）
+- core-time:     /api/core-time/check/{period}（今日の曜日にコアタイムのある学生が --students 人）
+- dashboard:     /api/dashboard/summary の読み取り
+- dashboard-304: 同上を If-None-Match 付きで読み取り（データが変わらない場合）
+
+シナリオごとにリクエスト数・エラー数・スループット・1リクエストあたりの SQL 文の数と、
+レイテンシの p50/p95/p99 を JSON で出力します。コミット間の比較用に、実行時のコミットも記録します。
+Telegram への送信はローカルで成功扱いにし、プロセス内のスケジューラは止めます。
+
+実行例（server/backend で実行）:
+    python -m benchmarks.bench_load --students 2000 --concurrency 20 --seconds 5 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import httpx
+
+from benchmarks.bench_event_loop import BACKEND_DIR, percentile
+from services.query_budget import count_queries
+
+SCENARIOS = ["taps", "core-time", "dashboard", "dashboard-304"]
+
+def seed(db_path, students, logs_per_student, present_ratio, rng):
+    """ 学生（全員が今日の曜日にコアタイムあり）・出席記録・入室状況を一括で投入する """
+    from db.migrations import upgrade_database
+    from services.daily_presence import rebuild
+
+    upgrade_database(db_path)
+    today = date.today().weekday() + 1  # 1:月曜 2:火曜 ... 7:日曜
+    now = datetime.now().replace(microsecond=0)
+    student_ids = [f"s{i:05d}" for i in range(students)]
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany(
+            "INSERT INTO students (student_id, name, core_time_1_day, core_time_1_period,"
+            " core_time_2_day, core_time_2_period) VALUES (?, ?, ?, ?, ?, ?)",
+            [(sid, f"学生{i}", today, i % 6 + 1, today, (i + 3) % 6 + 1) for i, sid in enumerate(student_ids)]
+        )
+        logs = []
+        for sid in student_ids:
+            for _ in range(logs_per_student):
+                entry = now - timedelta(days=rng.randint(1, 30), hours=rng.randint(0, 10))
+                logs.append((sid, entry, entry + timedelta(minutes=rng.randint(30, 240))))
+        conn.executemany("INSERT INTO attendance_logs (student_id, entry_time, exit_time) VALUES (?, ?, ?)", logs)
+        present = rng.sample(student_ids, int(students * present_ratio))
+        conn.executemany(
+            "INSERT INTO attendance_logs (student_id, entry_time) VALUES (?, ?)", [(sid, now) for sid in present]
+        )
+        conn.executemany("INSERT INTO current_status (student_id, entry_time) VALUES (?, ?)", [(sid, now) for sid in present])
+        conn.commit()
+        rebuild(conn)
+        conn.commit()
+    finally:
+        conn.close()
+    return student_ids
+
+async def run_scenario(name, request, concurrency, seconds):
+    """ concurrency 個のワーカーで seconds 秒間 request を繰り返し、レイテンシを集計する """
+    stop = asyncio.Event()
+    latencies = []
+    statuses = {}
+
+    async def worker(offset):
+        i = offset
+        while not stop.is_set():
+            started = time.perf_counter()
+            response = await request(i)
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            i += concurrency
+            # ASGI トランスポートは実ソケットと違い I/O 待ちがないため、明示的にループへ戻す
+            await asyncio.sleep(0)
+
+    # ワーカーのタスクは作成時のコンテキストを引き継ぐので、リクエスト中の SQL 文が数えられる
+    with count_queries() as queries:
+        workers = [asyncio.create_task(worker(i)) for i in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*workers)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": sum(count for status, count in statuses.items() if status >= 400),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "queries_per_request": round(queries.count / len(latencies), 2) if latencies else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0.0) * 1000, 2),
+            "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        },
+    }
+
+async def run(args, student_ids, rng):
+    import main
+
+    # Telegram への送信はローカルで成功扱いにする
+    main.notifier.transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True}))
+
+    results = []
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if "taps" in args.scenarios:
+                async def tap(i):
+                    return await client.post(f"/api/attendance-now/{rng.choice(student_ids)}")
+                results.append(await run_scenario("taps", tap, args.concurrency, args.seconds))
+
+            if "core-time" in args.scenarios:
+                # 定期チェックは重ならないので1並列で時限を順に回す
+                async def check(i):
+                    return await client.get(f"/api/core-time/check/{i % 6 + 1}")
+                results.append(await run_scenario("core-time", check, 1, args.seconds))
+
+            if "dashboard" in args.scenarios:
+                async def dashboard(i):
+                    return await client.get("/api/dashboard/summary")
+                results.append(await run_scenario("dashboard", dashboard, args.concurrency, args.seconds))
+
+            if "dashboard-304" in args.scenarios:
+                etag = (await client.get("/api/dashboard/summary")).headers.get("etag", "")
+                async def dashboard_cached(i):
+                    return await client.get("/api/dashboard/summary", headers={"If-None-Match": etag})
+                results.append(await run_scenario("dashboard-304", dashboard_cached, args.concurrency, args.seconds))
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="API load and latency benchmark")
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--logs-per-student", type=int, default=20)
+    parser.add_argument("--present-ratio", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="実行するシナリオ（カンマ区切り）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル（省略時は標準出力のみ）")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # アプリの読み込み前に一時データベースと Telegram 設定を指定する
+        db_path = os.path.join(tmp, "bench.db")
+        os.environ["ATTENDANCE_DB_PATH"] = db_path
+        os.environ["CORE_TIME_SCHEDULER"] = "false"
+        os.environ.setdefault("TELEGRAM_ID", "bench")
+        os.environ.setdefault("TELEGRAM_ALERT", "bench")
+        os.chdir(BACKEND_DIR)  # 静的ファイルのパスは backend からの相対パス
+        sys.path.insert(0, BACKEND_DIR)
+
+        seed_started = time.perf_counter()
+        student_ids = seed(db_path, args.students, args.logs_per_student, args.present_ratio, rng)
+        seed_seconds = time.perf_counter() - seed_started
+        results = asyncio.run(run(args, student_ids, rng))
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "params": {
+            "students": args.students,
+            "logs_per_student": args.logs_per_student,
+            "present_ratio": args.present_ratio,
+            "concurrency": args.concurrency,
+            "seconds": args.seconds,
+            "seed": args.seed,
+        },
+        "seed_seconds": round(seed_seconds, 2),
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+ログ出力のリクエストあたりのオーバーヘッドのベンチマーク
+
+アプリをプロセス内で起動し（httpx の ASGI トランスポート）、uvicorn と同じ形式の
+アクセスログを1リクエストごとに出しながら /api/current-status/ を同時に呼び出します。
+ログの出力先は一時ファイルで、--sink-delay-ms で書き込みごとに待ちを入れて
+遅い出力先（パイプ・コンテナのログドライバ）を再現します。以下の設定を比較します。
+
+- sync:          従来の設定（basicConfig 相当。イベントループ上で整形・書き込み）
+- queue:         QueueHandler / QueueListener 経由の JSON 出力（間引きなし）
+- queue-sampled: 同上で同じ書式のログを間引く（既定の 20件/秒）
+
+実行例（server/backend で実行）:
+    python -m benchmarks.bench_logging --concurrency 20 --seconds 5 --sink-delay-ms 0.5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.bench_event_loop import BACKEND_DIR
+from benchmarks.bench_load import run_scenario
+
+MODES = ["sync", "queue", "queue-sampled"]
+
+class SlowFile:
+    """ 書き込みごとに delay 秒待つファイル（遅い出力先の代わり） """
+
+    def __init__(self, path, delay):
+        self.file = open(path, "a", encoding="utf-8")
+        self.delay = delay
+        self.lines = 0
+
+    def write(self, text):
+        if self.delay:
+            time.sleep(self.delay)
+        self.lines += text.count("\n")
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class AccessLog:
+    """ uvicorn と同じ形式のアクセスログを出す ASGI ラッパー """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("uvicorn.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                self.logger.info(
+                    '%s - "%s %s HTTP/%s" %d',
+                    "127.0.0.1:50000", scope["method"], scope["path"], scope["http_version"], message["status"]
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+def configure(mode, sink):
+    """ ログの設定を切り替え、キューを使う場合はパイプラインを返す """
+    from services.log_pipeline import TEXT_FORMAT, setup_logging, stop_logging
+
+    if mode == "sync":
+        stop_logging()
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        logging.getLogger().handlers = [handler]
+        logging.getLogger().setLevel(logging.INFO)
+        return None
+    return setup_logging("INFO", "json", burst=20 if mode == "queue-sampled" else 0, stream=sink)
+
+async def run_mode(app, mode, args, tmp):
+    from services.log_pipeline import stop_logging
+
+    sink = SlowFile(os.path.join(tmp, f"{mode}.log"), args.sink_delay_ms / 1000)
+    pipeline = configure(mode, sink)
+    try:
+        transport = httpx.ASGITransport(app=AccessLog(app))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def status(i):
+                return await client.get("/api/current-status/")
+            result = await run_scenario(mode, status, args.concurrency, args.seconds)
+        started = time.perf_counter()
+        stop_logging()  # キューに残っている分を書き出す
+        result["drain_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        result["lines_written"] = sink.lines
+        result["lines_dropped"] = pipeline.queue_handler.dropped if pipeline is not None else 0
+    finally:
+        stop_logging()
+        # 次の設定に切り替えるまでの間（と終了時）のログは標準エラーへ
+        logging.getLogger().handlers = [logging.StreamHandler(sys.stderr)]
+        logging.getLogger().setLevel(logging.WARNING)
+        sink.close()
+    return result
+
+async def run(args, tmp):
+    import main
+
+    main.notifier.transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True}))
+    results = []
+    async with main.app.router.lifespan_context(main.app):
+        for mode in args.modes:
+            results.append(await run_mode(main.app, mode, args, tmp))
+    return results
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="logging overhead benchmark")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--sink-delay-ms", type=float, default=0.5, help="出力先への書き込み1回あたりの待ち（ミリ秒）")
+    parser.add_argument("--modes", default=",".join(MODES), help="比較する設定（カンマ区切り）")
+    args = parser.parse_args()
+    args.modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+    # httpx 自身のリクエストログは計測の対象外
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["ATTENDANCE_DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ["CORE_TIME_SCHEDULER"] = "false"
+        os.environ.setdefault("TELEGRAM_ID", "bench")
+        os.environ.setdefault("TELEGRAM_ALERT", "bench")
+        os.chdir(BACKEND_DIR)
+        sys.path.insert(0, BACKEND_DIR)
+        results = asyncio.run(run(args, tmp))
+
+    print(json.dumps({"sink_delay_ms": args.sink_delay_ms, "results": results}, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+起動方法ごとのスループット比較（実際のサーバープロセスとソケットを使う）
+
+一時データベースに bench_load と同じデータを投入し、以下の起動方法でサーバーを順に起動して
+同じ負荷をかけます。起動方法ごとにデータベースは投入直後の状態から始めます。
+
+- uvicorn-reload: 従来の start.sh（uvicorn --reload の1プロセス）
+- uvicorn:        uvicorn の1プロセス（--reload なし）
+- gunicorn-N:     gunicorn.conf.py（preload_app、N ワーカー）。--workers で N を指定
+
+シナリオ:
+- taps:      /api/attendance-now/{id} への同時タッチ（ワーカー間で入室状況がずれると 409 になる）
+- status:    /api/current-status/ の読み取り
+- dashboard: /api/dashboard/summary の読み取り
+
+最後に SIGTERM で停止し、停止までの秒数と、通知（ローカルのスタブで受ける）が停止までに
+送り切られたか・二重に送られていないかを記録します。負荷をかけるクライアントも同じマシンで
+動くため、CPU 数（cpu_count）が少ない環境ではワーカーを増やしても差が出にくくなります。
+
+実行例（server/backend で実行）:
+    python -m benchmarks.bench_server --students 500 --concurrency 20 --seconds 5 --workers 2,4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import httpx
+
+from benchmarks.bench_event_loop import BACKEND_DIR
+from benchmarks.bench_load import git_commit, run_scenario, seed
+
+SCENARIOS = ["taps", "status", "dashboard"]
+
+class TelegramStub:
+    """ sendMessage を常に成功で返すローカルの HTTP サーバー（別スレッドのイベントループで動く） """
+
+    def __init__(self):
+        self.received = 0
+        self.port = free_port()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in header.decode("latin-1").split("\r\n"):
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                await reader.readexactly(length)
+                self.received += 1
+                body = b'{"ok":true}'
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, "127.0.0.1", self.port), self._loop
+        ).result()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def server_command(config, port):
+    """ 起動方法ごとのコマンドと追加の環境変数 """
+    if config == "uvicorn-reload":
+        return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                "--reload", "--timeout-graceful-shutdown", "5"], {}
+    if config == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                "--timeout-graceful-shutdown", "5"], {}
+    workers = config.split("-", 1)[1]
+    return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"], {
+        "BIND": f"127.0.0.1:{port}", "WEB_CONCURRENCY": workers
+    }
+
+def outbox_counts(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT status, count(*) FROM notification_outbox GROUP BY status").fetchall())
+    finally:
+        conn.close()
+
+async def wait_ready(base_url, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode}")
+            try:
+                if (await client.get("/api/current-status/")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+async def run_config(config, args, template_path, tmp, student_ids, stub):
+    db_path = os.path.join(tmp, f"{config}.db")
+    shutil.copyfile(template_path, db_path)
+    port = free_port()
+    command, extra_env = server_command(config, port)
+    env = dict(
+        os.environ,
+        ATTENDANCE_DB_PATH=db_path,
+        CORE_TIME_SCHEDULER="false",
+        TELEGRAM_ID="bench",
+        TELEGRAM_ALERT="bench",
+        TELEGRAM_API_BASE=f"http://127.0.0.1:{stub.port}",
+        **extra_env,
+    )
+    received_before = stub.received
+    rng = random.Random(args.seed)
+    log = open(os.path.join(tmp, f"{config}.log"), "w")
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    result = {"config": config, "scenarios": []}
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        started = time.perf_counter()
+        await wait_ready(base_url, process)
+        result["startup_seconds"] = round(time.perf_counter() - started, 2)
+
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30.0, limits=limits) as client:
+            requests = {
+                "taps": lambda i: client.post(f"/api/attendance-now/{rng.choice(student_ids)}"),
+                "status": lambda i: client.get("/api/current-status/"),
+                "dashboard": lambda i: client.get("/api/dashboard/summary"),
+            }
+            for name in args.scenarios:
+                scenario = await run_scenario(name, requests[name], args.concurrency, args.seconds)
+                scenario.pop("queries_per_request")  # サーバーは別プロセスなので数えられない
+                result["scenarios"].append(scenario)
+    finally:
+        # 停止: 処理中のリクエストと未送信の通知を片付けてから終了するまでの時間
+        started = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        result["shutdown_seconds"] = round(time.perf_counter() - started, 2)
+        result["exit_code"] = process.returncode
+        log.close()
+
+    counts = outbox_counts(db_path)
+    result["notifications"] = {
+        "sent": counts.get("sent", 0),
+        "pending_after_stop": counts.get("pending", 0),
+        "received_by_stub": stub.received - received_before,  # sent より多ければ二重送信
+    }
+    return result
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="server throughput comparison (uvicorn vs gunicorn)")
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--logs-per-student", type=int, default=20)
+    parser.add_argument("--present-ratio", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--workers", default="2,4", help="gunicorn のワーカー数（カンマ区切り）")
+    parser.add_argument("--configs", default=None,
+                        help="比較する起動方法（カンマ区切り、既定は uvicorn-reload,uvicorn と --workers の gunicorn-N）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="実行するシナリオ（カンマ区切り）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--output", default=None, help="結果を書き出す JSON ファイル（省略時は標準出力のみ）")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    if args.configs:
+        configs = [config.strip() for config in args.configs.split(",") if config.strip()]
+    else:
+        configs = ["uvicorn-reload", "uvicorn"] + [f"gunicorn-{int(n)}" for n in args.workers.split(",") if n.strip()]
+    for config in configs:
+        if config not in ("uvicorn-reload", "uvicorn") and not (config.startswith("gunicorn-") and config[9:].isdigit()):
+            parser.error(f"unknown config: {config}")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    stub = TelegramStub()
+    stub.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        sys.path.insert(0, BACKEND_DIR)
+        template_path = os.path.join(tmp, "template.db")
+        student_ids = seed(template_path, args.students, args.logs_per_student, args.present_ratio, random.Random(args.seed))
+        results = []
+        for config in configs:
+            results.append(asyncio.run(run_config(config, args, template_path, tmp, student_ids, stub)))
+    stub.stop()
+
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "cpu_count": os.cpu_count(),
+        "params": {
+            "students": args.students,
+            "logs_per_student": args.logs_per_student,
+            "present_ratio": args.present_ratio,
+            "concurrency": args.concurrency,
+            "seconds": args.seconds,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite エンジンプロファイルのベンチマーク
+
+一時データベースに対して、入退室の書き込みスレッドとダッシュボード相当の
+集計読み取りスレッドを同時に走らせ、既定設定（rollback journal）と
+本番プロファイル（WAL など）のスループットとロックエラー数を比較します。
+
+実行例（server/backend で実行）:
+    python -m benchmarks.bench_sqlite_profile --seconds 10 --writers 4 --readers 4
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from db.database import Base, SQLITE_PROFILE, POOL_SETTINGS, create_sqlite_engine
+from models.models import Student, AttendanceLog
+
+# 比較するプロファイル（default は SQLite / pysqlite の既定値）
+PROFILES = {
+    "default": ({}, {}),
+    "production": (SQLITE_PROFILE, POOL_SETTINGS),
+}
+
+def seed(session_factory, students, logs_per_student):
+    db = session_factory()
+    start = datetime.now() - timedelta(days=30)
+    db.add_all([Student(student_id=f"s{i:05d}", name=f"学生{i}") for i in range(students)])
+    db.add_all([
+        AttendanceLog(
+            student_id=f"s{i:05d}",
+            entry_time=start + timedelta(hours=j * 7),
+            exit_time=start + timedelta(hours=j * 7 + 3)
+        ) for i in range(students) for j in range(logs_per_student)
+    ])
+    db.commit()
+    db.close()
+
+def run_profile(name, seconds, writers, readers, students, logs_per_student):
+    profile, pool_settings = PROFILES[name]
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_sqlite_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", profile, pool_settings)
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        seed(session_factory, students, logs_per_student)
+
+        counts = {"writes": 0, "reads": 0, "errors": 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def writer(seed_value):
+            rng = random.Random(seed_value)
+            while time.perf_counter() < deadline:
+                db = session_factory()
+                try:
+                    now = datetime.now()
+                    db.add(AttendanceLog(student_id=f"s{rng.randrange(students):05d}", entry_time=now, exit_time=now))
+                    db.commit()
+                    key = "writes"
+                except OperationalError:
+                    db.rollback()
+                    key = "errors"
+                finally:
+                    db.close()
+                with lock:
+                    counts[key] += 1
+
+        def reader():
+            week_start = datetime.now() - timedelta(days=7)
+            while time.perf_counter() < deadline:
+                db = session_factory()
+                try:
+                    db.query(AttendanceLog.student_id, func.count(AttendanceLog.id)).filter(
+                        AttendanceLog.entry_time >= week_start
+                    ).group_by(AttendanceLog.student_id).all()
+                    key = "reads"
+                except OperationalError:
+                    key = "errors"
+                finally:
+                    db.close()
+                with lock:
+                    counts[key] += 1
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        threads += [threading.Thread(target=reader) for _ in range(readers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+
+    return {
+        "profile": name,
+        "seconds": round(elapsed, 2),
+        "writes_per_sec": round(counts["writes"] / elapsed, 1),
+        "reads_per_sec": round(counts["reads"] / elapsed, 1),
+        "lock_errors": counts["errors"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite engine profile benchmark")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--students", type=int, default=300)
+    parser.add_argument("--logs-per-student", type=int, default=100)
+    parser.add_argument("--profile", choices=sorted(PROFILES), action="append")
+    args = parser.parse_args()
+
+    results = [
+        run_profile(name, args.seconds, args.writers, args.readers, args.students, args.logs_per_student)
+        for name in (args.profile or ["default", "production"])
+    ]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+締めた年度のアーカイブ
+
+年度（既定は4月始まり）が終わった出席記録・アラート・日ごとの在室時間を、
+年度ごとのアーカイブファイル（db/archive/Attendance{年度}.db）に移して本番のデータベースから削除します。
+アーカイブは services/archive.py がレポート用の接続に ATTACH し、履歴の読み出しは本番と合わせて行います。
+
+1. 作成: 本番を読み取り専用で開き、rowid 順に batch_size 件ずつ（1回ごとに別の短い読み取りで）一時ファイルへ写す。
+   インデックスは写し終えてから作り、ANALYZE と VACUUM で読み出し用に詰めてから置き換える
+2. 登録: archives に1行追加する（短い書き込みトランザクション1回）。以降の読み出しはアーカイブから
+3. 削除: アーカイブにある行を batch_size 件ずつ別のトランザクションで本番から削除し、間に pause 秒あける。
+   書き込みのロックは1回あたり数十ミリ秒以内で、キオスクの記録を長く待たせない。
+   アラートは削除と同じトランザクションで学生ごとの件数を students.archived_violations に加える
+   （コアタイムチェックは違反回数を archived_violations + 本番のアラートの件数で再計算する）
+
+アーカイブは圧縮しません。レポート用の接続が普通の SQLite ファイルとして ATTACH し（immutable でロックなし）、
+インデックスで期間・学生を絞って直接読むためです。gzip などで圧縮すると読むたびに展開が必要になり、
+SQLite の圧縮（ZIPVFS・sqlite-zstd など）は標準の sqlite3 にない拡張が要ります。
+代わりに VACUUM で空きページを詰め、不要な列・制約を持たない小さいテーブルにしています。
+ファイルとして持ち出す場合は締めた後に変更されないので、そのまま gzip などで圧縮できます。
+
+途中で止まった場合はもう一度実行すると続きから行います（登録済みなら削除だけ）。
+退室していない記録は本番に残します（次のタッチで退室として閉じられるため）。
+登録後に締めた年度の日ごとの在室時間が更新された場合、その行はアーカイブの値のままになります。
+
+実行例（server/backend で実行）:
+    python -m db.archive --year 2024
+    python -m db.archive --list
+"""
+import argparse
+import os
+import sqlite3
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from db.migrations import upgrade_database
+
+# 年度の始まりの月
+YEAR_START_MONTH = 4
+
+# アーカイブのテーブル（本番と同じ列。外部キーと AUTOINCREMENT はなし）
+ARCHIVE_TABLES = {
+    "attendance_logs": "CREATE TABLE attendance_logs (id INTEGER PRIMARY KEY, student_id TEXT, entry_time DATETIME, exit_time DATETIME)",
+    "alerts": "CREATE TABLE alerts (id INTEGER PRIMARY KEY, student_id TEXT, alert_date DATE NOT NULL, alert_period INTEGER NOT NULL)",
+    "daily_presence": "CREATE TABLE daily_presence (student_id TEXT NOT NULL, date DATE NOT NULL, seconds REAL NOT NULL DEFAULT 0, PRIMARY KEY (student_id, date))",
+}
+ARCHIVE_INDEXES = [
+    "CREATE INDEX ix_attendance_logs_student_entry ON attendance_logs (student_id, entry_time)",
+    "CREATE INDEX ix_attendance_logs_entry_time ON attendance_logs (entry_time)",
+    "CREATE UNIQUE INDEX ux_alerts_student_date_period ON alerts (student_id, alert_date, alert_period)",
+    "CREATE INDEX ix_alerts_alert_date ON alerts (alert_date)",
+]
+
+# テーブル -> (列, 行を一意にする列, 年度の行の条件)
+TABLES = {
+    "attendance_logs": (
+        ("id", "student_id", "entry_time", "exit_time"), ("id",),
+        "entry_time >= :start AND entry_time < :end AND exit_time IS NOT NULL",
+    ),
+    "alerts": (
+        ("id", "student_id", "alert_date", "alert_period"), ("id",),
+        "alert_date >= :start AND alert_date < :end",
+    ),
+    "daily_presence": (
+        ("student_id", "date", "seconds"), ("student_id", "date"),
+        "date >= :start AND date < :end",
+    ),
+}
+
+# 削除の前に同じトランザクションで実行する文（:after と :upper は削除する範囲のアーカイブの rowid。:after は含まない）
+# アラートは本番から削除する行の件数を学生ごとに違反回数の元として残す。実際に本番にある行だけを数えるので、
+# 途中で止まって続きから削除しても二重に数えない
+BEFORE_PURGE = {
+    "alerts": (
+        "UPDATE main.students SET archived_violations = archived_violations + ("
+        " SELECT COUNT(*) FROM main.alerts WHERE alerts.student_id = students.student_id"
+        " AND alerts.id IN (SELECT id FROM archived.alerts WHERE rowid > :after AND rowid <= :upper)"
+        ") WHERE student_id IN (SELECT student_id FROM archived.alerts WHERE rowid > :after AND rowid <= :upper)"
+    ),
+}
+
+def year_range(year: int, start_month: int = YEAR_START_MONTH) -> Tuple[date, date]:
+    """ 年度の初日と翌年度の初日 """
+    return date(year, start_month, 1), date(year + 1, start_month, 1)
+
+def default_archive_path(db_path: str, year: int) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "archive", f"Attendance{year}.db")
+
+#{{{ 作成
+def build_archive(db_path: str, archive_path: str, start: date, end: date, batch_size: int,
+                  progress: Optional[Callable[[str, int], None]] = None) -> Dict[str, int]:
+    """ start～end（end を含まない）の行をアーカイブファイルに写し、テーブルごとの件数を返す """
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    tmp_path = f"{archive_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    source = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    target = sqlite3.connect(tmp_path)
+    counts = {}
+    try:
+        target.execute("PRAGMA journal_mode = OFF")
+        target.execute("PRAGMA synchronous = OFF")
+        for table, (columns, _, condition) in TABLES.items():
+            target.execute(ARCHIVE_TABLES[table])
+            column_list = ", ".join(columns)
+            insert = f"INSERT INTO {table} ({column_list}) VALUES ({', '.join('?' * len(columns))})"
+            last_rowid, count = 0, 0
+            while True:
+                # 1回ずつ別の読み取りにして、本番の WAL のチェックポイントを長く止めない
+                rows = source.execute(
+                    f"SELECT rowid, {column_list} FROM {table} WHERE rowid > :after AND {condition}"
+                    " ORDER BY rowid LIMIT :limit",
+                    {"after": last_rowid, "start": start.isoformat(), "end": end.isoformat(), "limit": batch_size}
+                ).fetchall()
+                if not rows:
+                    break
+                target.executemany(insert, [row[1:] for row in rows])
+                target.commit()
+                last_rowid = rows[-1][0]
+                count += len(rows)
+                if progress:
+                    progress(table, count)
+            counts[table] = count
+        for sql in ARCHIVE_INDEXES:
+            target.execute(sql)
+        target.execute("ANALYZE")
+        target.commit()
+        target.execute("VACUUM")
+        target.execute("PRAGMA journal_mode = DELETE")
+    except Exception:
+        target.close()
+        os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(tmp_path, archive_path)
+    return counts
+#}}}
+
+#{{{ 登録・削除
+def register_archive(conn: sqlite3.Connection, year: int, path: str, start: date, end: date, counts: Dict[str, int]):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO archives (year, path, start_date, end_date, attendance_logs, alerts, daily_presence,"
+            " archived_at, purged_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+            (year, path, start.isoformat(), end.isoformat(), counts["attendance_logs"], counts["alerts"],
+             counts["daily_presence"], datetime.now().isoformat(sep=" "))
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def purge_archived(conn: sqlite3.Connection, archive_path: str, batch_size: int, pause: float,
+                   progress: Optional[Callable[[str, int], None]] = None) -> Tuple[Dict[str, int], float]:
+    """
+    アーカイブにある行を本番から batch_size 件ずつ削除する
+    戻り値: (テーブルごとの削除件数, 1回の書き込みトランザクションの最長時間（秒）)
+    """
+    conn.execute("ATTACH DATABASE ? AS archived", (archive_path,))
+    deleted, longest = {}, 0.0
+    try:
+        for table, (_, keys, _) in TABLES.items():
+            key_list = ", ".join(keys)
+            match = f"({key_list}) IN" if len(keys) > 1 else f"{key_list} IN"
+            last_rowid, count = 0, 0
+            while True:
+                # ロックを取る前にアーカイブ側で今回の範囲を決める
+                upper = conn.execute(
+                    f"SELECT MAX(rowid) FROM (SELECT rowid FROM archived.{table} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                    (last_rowid, batch_size)
+                ).fetchone()[0]
+                if upper is None:
+                    break
+                started = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if table in BEFORE_PURGE:
+                        conn.execute(BEFORE_PURGE[table], {"after": last_rowid, "upper": upper})
+                    cursor = conn.execute(
+                        f"DELETE FROM main.{table} WHERE {match}"
+                        f" (SELECT {key_list} FROM archived.{table} WHERE rowid > ? AND rowid <= ?)",
+                        (last_rowid, upper)
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                longest = max(longest, time.perf_counter() - started)
+                count += cursor.rowcount
+                last_rowid = upper
+                if progress:
+                    progress(f"{table} (削除)", count)
+                if pause:
+                    time.sleep(pause)
+            deleted[table] = count
+    finally:
+        conn.execute("DETACH DATABASE archived")
+    return deleted, longest
+#}}}
+
+def archive_year(db_path: str, year: int, archive_path: Optional[str] = None, batch_size: int = 500,
+                 pause: float = 0.05, start_month: int = YEAR_START_MONTH, today: Optional[date] = None,
+                 progress: Optional[Callable[[str, int], None]] = None) -> Dict:
+    """ year 年度をアーカイブして本番から削除し、件数などを返す（締めていない年度は ValueError） """
+    start, end = year_range(year, start_month)
+    if end > (today or date.today()):
+        raise ValueError(f"{year}年度（{start}～{end}）はまだ終わっていません")
+    upgrade_database(db_path)
+    archive_path = archive_path or default_archive_path(db_path, year)
+    relative_path = os.path.relpath(os.path.abspath(archive_path), os.path.dirname(os.path.abspath(db_path)))
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.isolation_level = None  # トランザクションを明示的に制御する
+    try:
+        row = conn.execute("SELECT path, purged_at FROM archives WHERE year = ?", (year,)).fetchone()
+        if row is not None and row[1] is not None:
+            raise ValueError(f"{year}年度は既にアーカイブされています ({row[0]})")
+        if row is None:
+            counts = build_archive(db_path, archive_path, start, end, batch_size, progress)
+            register_archive(conn, year, relative_path, start, end, counts)
+        else:
+            # 登録済みで削除が終わっていない: 登録されているファイルから続きを削除する
+            archive_path = os.path.join(os.path.dirname(os.path.abspath(db_path)), row[0])
+            counts = None
+        deleted, longest = purge_archived(conn, archive_path, batch_size, pause, progress)
+        conn.execute("UPDATE archives SET purged_at = ? WHERE year = ?", (datetime.now().isoformat(sep=" "), year))
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    return {
+        "year": year, "start": start, "end": end, "path": archive_path, "copied": counts, "deleted": deleted,
+        "size": os.path.getsize(archive_path), "longest_lock_ms": round(longest * 1000, 1),
+    }
+
+def main():
+    default_path = os.getenv("ATTENDANCE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Attendance2025.db"))
+    parser = argparse.ArgumentParser(description="締めた年度のアーカイブ")
+    parser.add_argument("--db", default=default_path, help="データベースファイルのパス")
+    parser.add_argument("--year", type=int, help="アーカイブする年度")
+    parser.add_argument("--archive", default=None, help="アーカイブファイルのパス（既定は db/archive/Attendance{年度}.db）")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回の読み取り・削除の行数")
+    parser.add_argument("--pause", type=float, default=0.05, help="削除の合間の待ち時間（秒）")
+    parser.add_argument("--start-month", type=int, default=YEAR_START_MONTH, help="年度の始まりの月")
+    parser.add_argument("--list", action="store_true", help="登録済みのアーカイブを表示して終了")
+    args = parser.parse_args()
+
+    if args.list:
+        upgrade_database(args.db)
+        conn = sqlite3.connect(args.db)
+        try:
+            for year, path, start, end, logs, alerts, purged_at in conn.execute(
+                "SELECT year, path, start_date, end_date, attendance_logs, alerts, purged_at FROM archives ORDER BY year"
+            ):
+                status = "完了" if purged_at else "削除中"
+                print(f"{year}年度 {start}～{end}: {path} 出席記録 {logs} 件, アラート {alerts} 件 ({status})")
+        finally:
+            conn.close()
+        return
+    if args.year is None:
+        parser.error("--year か --list を指定してください")
+
+    started = time.perf_counter()
+    last_report = [started]
+
+    def progress(table, count):
+        now = time.perf_counter()
+        if now - last_report[0] >= 5:
+            last_report[0] = now
+            print(f"{table}: {count} 件", flush=True)
+
+    try:
+        result = archive_year(
+            args.db, args.year, args.archive, args.batch_size, args.pause, args.start_month, progress=progress
+        )
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    copied = result["copied"]
+    if copied is not None:
+        print(f"{result['year']}年度（{result['start']}～{result['end']}）: " + ", ".join(f"{t} {n} 件" for t, n in copied.items())
+              + f" を {result['path']}（{result['size'] / 1024 / 1024:.1f} MiB）に移しました")
+    print("本番から削除: " + ", ".join(f"{t} {n} 件" for t, n in result["deleted"].items())
+          + f"（1回の最長 {result['longest_lock_ms']}ms、{time.perf_counter() - started:.1f} 秒）")
+
+if __name__ == "__main__":
+    main()
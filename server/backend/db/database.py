@@ -1,18 +1,105 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import asyncio
 import os
 
-# データベースファイルのパス
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'Attendance2025.db')}"
+# データベースファイルのパス（環境変数 ATTENDANCE_DB_PATH で変更可能）
+DB_PATH = os.getenv("ATTENDANCE_DB_PATH", os.path.join(os.path.dirname(__file__), 'Attendance2025.db'))
+SQLALCHEMY_DATABASE_URL = f"sqlite:///{DB_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+# SQLiteの接続プロファイル（接続ごとに設定するPRAGMA、環境変数で上書き可能）
+# busy_timeout は journal_mode の変更時にもロック待ちを効かせるため最初に設定する
+SQLITE_PROFILE = {
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # 負の値はKiB単位（64MiB）
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# コネクションプールの設定
+POOL_SETTINGS = {
+    "pool_size": int(os.getenv("SQLITE_POOL_SIZE", "10")),
+    "max_overflow": int(os.getenv("SQLITE_MAX_OVERFLOW", "20")),
+    "pool_timeout": float(os.getenv("SQLITE_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("SQLITE_POOL_RECYCLE", "3600")),
+}
+
+def apply_sqlite_profile(engine, profile=None):
+    """ 接続確立時に SQLite の PRAGMA を設定するイベントを登録 """
+    profile = SQLITE_PROFILE if profile is None else profile
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in profile.items():
+                if value is not None:
+                    cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    return engine
+
+# 書き込み用のセッションの実行オプション（トランザクションを BEGIN IMMEDIATE で始める）
+WRITE_OPTIONS = {"sqlite_begin": "IMMEDIATE"}
+
+def apply_begin_mode(engine):
+    """
+    実行オプション sqlite_begin（WRITE_OPTIONS）の付いた接続は、トランザクションを BEGIN IMMEDIATE で始めるイベントを登録
+    読み取りの後に書き込む処理は、書き込みのロックを最初に取っておけば、読み取りから書き込みへの切り替えでロックを
+    取り合わない（ロック待ちは busy_timeout の間、BEGIN で待つ）
+    オプションのない接続は従来どおり（最初の書き込みの前にドライバーが BEGIN する）
+    """
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        mode = conn.get_execution_options().get("sqlite_begin")
+        if mode:
+            conn.exec_driver_sql(f"BEGIN {mode}")
+
+    return engine
+
+def create_sqlite_engine(url=SQLALCHEMY_DATABASE_URL, profile=None, pool_settings=None):
+    """ プロファイルとプール設定を適用した SQLite エンジンを作成 """
+    engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        **(POOL_SETTINGS if pool_settings is None else pool_settings)
+    )
+    return apply_begin_mode(apply_sqlite_profile(engine, profile))
+
+def create_async_sqlite_engine(url=ASYNC_DATABASE_URL, profile=None, pool_settings=None):
+    """ 非同期エンドポイント用の aiosqlite エンジンを作成（PRAGMAは同期エンジンと共通） """
+    async_engine = create_async_engine(
+        url,
+        poolclass=AsyncAdaptedQueuePool,
+        **(POOL_SETTINGS if pool_settings is None else pool_settings)
+    )
+    apply_begin_mode(apply_sqlite_profile(async_engine.sync_engine, profile))
+    return async_engine
 
 # SQLAlchemyエンジンの作成
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+engine = create_sqlite_engine()
+async_engine = create_async_sqlite_engine()
 
 # セッションの作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 非同期セッション（コミット後に属性を読み直さないよう expire_on_commit=False）
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+# 書き込み用のセッション（同じプールで、トランザクションを BEGIN IMMEDIATE で始める）
+# コミット後に属性を読み直すとロックをもう一度取るので、非同期セッションと同じく expire_on_commit=False
+WriteSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=engine.execution_options(**WRITE_OPTIONS)
+)
+AsyncWriteSessionLocal = async_sessionmaker(
+    async_engine.execution_options(**WRITE_OPTIONS), autoflush=False, expire_on_commit=False
+)
 
 # モデルのベースクラス
 Base = declarative_base()
@@ -23,4 +110,40 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+# 非同期データベースセッションの取得（async def のエンドポイント用）
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# 書き込むエンドポイント用のセッション（読み取りの前に書き込みのロックを取る）
+def get_write_db():
+    db = WriteSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+# SQLite のロック待ち（busy_timeout）は先着順でなく、書き込みが続くと待ち続ける接続が出るので、
+# このプロセスの非同期の書き込みは BEGIN IMMEDIATE の前にイベントループ上で順番待ちにする
+# 順番はコミット（またはロールバック）した時点で次に回す（応答の送信を待たない）
+_async_write_lock = asyncio.Lock()
+
+async def get_async_write_db():
+    await _async_write_lock.acquire()
+    released = False
+
+    def release(*args):
+        nonlocal released
+        if not released:
+            released = True
+            _async_write_lock.release()
+
+    try:
+        async with AsyncWriteSessionLocal() as db:
+            event.listen(db.sync_session, "after_commit", release)
+            event.listen(db.sync_session, "after_rollback", release)
+            yield db
+    finally:
+        release()
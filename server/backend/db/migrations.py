@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+スキーマのマイグレーション
+
+データベースのスキーマバージョンを PRAGMA user_version に記録し、
+未適用のマイグレーションを番号順に1つずつトランザクション内で適用します。
+既存の Attendance2025.db もそのままアップグレードできます。
+
+テーブルやインデックスを追加する場合は、models/models.py と合わせて
+ここに新しい番号のマイグレーションを追加してください。
+
+実行例（server/backend で実行）:
+    python -m db.migrations            # 最新バージョンまで適用
+    python -m db.migrations --status   # 現在のバージョンを表示
+"""
+import argparse
+import os
+import sqlite3
+
+MIGRATIONS = []
+
+def migration(version, description):
+    """ マイグレーション関数を登録するデコレータ """
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+#{{{ マイグレーション定義
+@migration(1, "初期スキーマ")
+def _initial_schema(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS students (
+        student_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        core_time_1_day INTEGER DEFAULT 0,  -- 1:月曜 2:火曜 ... 7:日曜
+        core_time_1_period INTEGER DEFAULT 0,  -- 1:1限 2:2限 ... 6:6限
+        core_time_2_day INTEGER DEFAULT 0,
+        core_time_2_period INTEGER DEFAULT 0,
+        core_time_violations INTEGER DEFAULT 0
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS attendance_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id TEXT,
+        entry_time DATETIME,
+        exit_time DATETIME,
+        FOREIGN KEY (student_id) REFERENCES students(student_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS current_status (
+        student_id TEXT PRIMARY KEY,
+        entry_time DATETIME,
+        FOREIGN KEY (student_id) REFERENCES students(student_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id TEXT,
+        alert_date DATE NOT NULL,
+        alert_period INTEGER NOT NULL,
+        FOREIGN KEY (student_id) REFERENCES students(student_id)
+    )
+    ''')
+
+@migration(2, "通知アウトボックス")
+def _notification_outbox(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY,
+        message VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        attempts INTEGER NOT NULL,
+        created_at DATETIME NOT NULL,
+        next_attempt_at DATETIME NOT NULL,
+        sent_at DATETIME,
+        last_error VARCHAR
+    )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_notification_outbox_next_attempt_at ON notification_outbox (next_attempt_at)")
+
+@migration(3, "出席記録のインデックスとアラートの一意制約")
+def _attendance_indexes(conn):
+    # 学生ごとの履歴取得（student_id, entry_time の範囲検索）
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attendance_logs_student_entry ON attendance_logs (student_id, entry_time)")
+    # 退室処理で未退室の記録を探すための部分インデックス
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attendance_logs_open ON attendance_logs (student_id, entry_time) WHERE exit_time IS NULL")
+
+    # 一意制約を付ける前に重複したアラートを削除し、該当学生の違反回数を数え直す
+    duplicated = [row[0] for row in conn.execute('''
+    SELECT DISTINCT student_id FROM alerts
+    GROUP BY student_id, alert_date, alert_period HAVING COUNT(*) > 1
+    ''')]
+    conn.execute('''
+    DELETE FROM alerts WHERE id NOT IN (
+        SELECT MIN(id) FROM alerts GROUP BY student_id, alert_date, alert_period
+    )
+    ''')
+    conn.executemany('''
+    UPDATE students SET core_time_violations = (
+        SELECT COUNT(*) FROM alerts WHERE alerts.student_id = students.student_id
+    ) WHERE student_id = ?
+    ''', [(student_id,) for student_id in duplicated])
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_alerts_student_date_period ON alerts (student_id, alert_date, alert_period)")
+
+@migration(4, "出席記録の入室時刻インデックス")
+def _attendance_entry_time_index(conn):
+    # 期間指定のエクスポート（entry_time の範囲検索を entry_time, id の順に並べ替えなしで読む）
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_attendance_logs_entry_time ON attendance_logs (entry_time)")
+
+# 退室済みの記録を日付ごとに分割して (student_id, date) ごとの在室秒数を集計する
+# julianday の日付の境界は x.5 なので、次の0時は floor(s - 0.5) + 1.5
+DAILY_PRESENCE_ROLLUP_SQL = '''
+INSERT INTO daily_presence (student_id, date, seconds)
+WITH RECURSIVE segments(student_id, start, finish) AS (
+    SELECT student_id, julianday(entry_time), julianday(exit_time)
+    FROM attendance_logs
+    WHERE exit_time IS NOT NULL AND exit_time > entry_time
+    UNION ALL
+    SELECT student_id, floor(start - 0.5) + 1.5, finish
+    FROM segments
+    WHERE floor(start - 0.5) + 1.5 < finish
+)
+SELECT student_id, date(start), SUM((min(finish, floor(start - 0.5) + 1.5) - start) * 86400)
+FROM segments
+GROUP BY student_id, date(start)
+'''
+
+@migration(5, "日ごとの在室時間の集計テーブル")
+def _daily_presence(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS daily_presence (
+        student_id TEXT NOT NULL,
+        date DATE NOT NULL,
+        seconds REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (student_id, date),
+        FOREIGN KEY (student_id) REFERENCES students(student_id)
+    )
+    ''')
+    # 既存の出席記録から集計する
+    conn.execute("DELETE FROM daily_presence")
+    conn.execute(DAILY_PRESENCE_ROLLUP_SQL)
+
+@migration(6, "時限の時間帯")
+def _core_time_periods(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS core_time_periods (
+        period INTEGER PRIMARY KEY,  -- 1:1限 2:2限 ... 6:6限
+        start_time TEXT NOT NULL,    -- HH:MM
+        end_time TEXT NOT NULL       -- HH:MM
+    )
+    ''')
+    conn.executemany(
+        "INSERT OR IGNORE INTO core_time_periods (period, start_time, end_time) VALUES (?, ?, ?)",
+        [
+            (1, "09:00", "10:30"),
+            (2, "10:40", "12:10"),
+            (3, "13:00", "14:30"),
+            (4, "14:40", "16:10"),
+            (5, "16:20", "17:50"),
+            (6, "18:00", "19:30"),
+        ]
+    )
+
+# コアタイムチェックは時限の開始からこの分数だけ後に行う（遅れて入室した学生を違反にしないため）
+CHECK_GRACE_MINUTES = 20
+# チェックする時限（従来の crontab と同じく1～5限）
+CHECKED_PERIODS = (1, 2, 3, 4, 5)
+
+def _check_time(start_time, minutes=CHECK_GRACE_MINUTES):
+    """ 時限の開始時刻（HH:MM）に猶予を足したチェック時刻（HH:MM） """
+    hour, minute = (int(value) for value in start_time.split(":"))
+    total = hour * 60 + minute + minutes
+    return f"{total // 60:02d}:{total % 60:02d}"
+
+def _set_check_times(conn, condition, params=()):
+    """ condition に合う時限のチェック時刻を開始時刻 + 猶予にする """
+    rows = conn.execute(
+        f"SELECT period, start_time FROM core_time_periods WHERE {condition}", params
+    ).fetchall()
+    conn.executemany(
+        "UPDATE core_time_periods SET check_time = ? WHERE period = ?",
+        [(_check_time(start_time), period) for period, start_time in rows]
+    )
+
+@migration(7, "コアタイムチェックのスケジュールとリース")
+def _scheduler(conn):
+    # チェック時刻（HH:MM、NULL はチェックしない）。時限の開始時刻 + CHECK_GRACE_MINUTES
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(core_time_periods)")]
+    if "check_time" not in columns:
+        conn.execute("ALTER TABLE core_time_periods ADD COLUMN check_time TEXT")
+    _set_check_times(
+        conn, f"check_time IS NULL AND period IN ({', '.join('?' * len(CHECKED_PERIODS))})", CHECKED_PERIODS
+    )
+    # 複数ワーカーのうち1つだけがジョブを実行するためのリース
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        expires_at DATETIME NOT NULL
+    )
+    ''')
+    # 予定時刻ごとのジョブの実行記録（同じ予定を2回実行しないための記録を兼ねる）
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS job_runs (
+        job TEXT NOT NULL,
+        scheduled_at DATETIME NOT NULL,
+        owner TEXT,
+        status TEXT NOT NULL,  -- done / missed
+        started_at DATETIME,
+        detail TEXT,
+        PRIMARY KEY (job, scheduled_at)
+    )
+    ''')
+
+# 変更を数えるテーブル（data_versions のトリガーの対象）
+VERSIONED_TABLES = ["students", "attendance_logs", "current_status", "alerts", "daily_presence", "core_time_periods"]
+
+@migration(8, "テーブルごとのデータバージョン")
+def _data_versions(conn):
+    # 対象テーブルへの書き込みのたびにトリガーで version を1増やす（ETag に使う）
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS data_versions (
+        table_name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    conn.executemany(
+        "INSERT OR IGNORE INTO data_versions (table_name, version) VALUES (?, 0)",
+        [(table,) for table in VERSIONED_TABLES]
+    )
+    for table in VERSIONED_TABLES:
+        _version_triggers(conn, table)
+
+def _version_triggers(conn, table):
+    """ table への書き込みのたびに data_versions の version を1増やすトリガー """
+    for operation in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation.lower()}_version
+        AFTER {operation} ON {table}
+        BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE table_name = '{table}';
+        END
+        ''')
+
+@migration(9, "年度ごとのアーカイブ")
+def _archives(conn):
+    # 締めた年度の出席記録・アラート・日ごとの在室時間を移したアーカイブファイル（db/archive.py）
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS archives (
+        year INTEGER PRIMARY KEY,        -- 年度
+        path TEXT NOT NULL,              -- データベースのディレクトリからの相対パス
+        start_date DATE NOT NULL,        -- 年度の初日
+        end_date DATE NOT NULL,          -- 翌年度の初日（この日を含まない）
+        attendance_logs INTEGER NOT NULL DEFAULT 0,  -- アーカイブした件数
+        alerts INTEGER NOT NULL DEFAULT 0,
+        daily_presence INTEGER NOT NULL DEFAULT 0,
+        archived_at DATETIME NOT NULL,   -- アーカイブを登録した時刻（以降の読み出しはアーカイブから）
+        purged_at DATETIME               -- 本番のデータベースから削除し終えた時刻
+    )
+    ''')
+    # 読み取り用の接続はバージョンが変わるとアーカイブを付け直す
+    conn.execute("INSERT OR IGNORE INTO data_versions (table_name, version) VALUES ('archives', 0)")
+    _version_triggers(conn, "archives")
+
+@migration(10, "コアタイムチェックの時刻を時限の開始時刻 + 猶予にする")
+def _check_times_from_start(conn):
+    # 以前のマイグレーション7は従来の crontab の時刻をそのまま入れていた。5限（16:20 開始）の 16:00 は
+    # 開始前のため、5限がコアタイムの学生が全員違反になっていた。変更されていない時限だけ直す
+    previous = [(1, "09:00"), (2, "11:00"), (3, "13:30"), (4, "15:15"), (5, "16:00")]
+    for period, check_time in previous:
+        _set_check_times(conn, "period = ? AND check_time = ?", (period, check_time))
+
+@migration(11, "アーカイブした違反の件数")
+def _archived_violations(conn):
+    # 違反回数は alerts の件数から再計算するため、アーカイブで本番から削除した分を学生ごとに残す（db/archive.py）
+    conn.execute("ALTER TABLE students ADD COLUMN archived_violations INTEGER NOT NULL DEFAULT 0")
+#}}}
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def upgrade(conn, target=None):
+    """
+    未適用のマイグレーションを適用し、適用したバージョンのリストを返す
+    各マイグレーションは BEGIN IMMEDIATE ～ COMMIT の1トランザクションで実行する
+    """
+    target = latest_version() if target is None else target
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # トランザクションを明示的に制御する
+    applied = []
+    try:
+        for version, description, func in MIGRATIONS:
+            if version > target:
+                break
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 他のプロセスが先に適用していないかロック取得後に確認
+                if version <= current_version(conn):
+                    conn.execute("ROLLBACK")
+                    continue
+                func(conn)
+                conn.execute(f"PRAGMA user_version = {int(version)}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            applied.append((version, description))
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+def upgrade_database(db_path, target=None):
+    """ データベースファイルを開いてマイグレーションを適用する """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return upgrade(conn, target)
+    finally:
+        conn.close()
+
+def main():
+    default_path = os.getenv("ATTENDANCE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Attendance2025.db"))
+    parser = argparse.ArgumentParser(description="データベースのマイグレーション")
+    parser.add_argument("--db", default=default_path, help="データベースファイルのパス")
+    parser.add_argument("--target", type=int, default=None, help="適用する最大バージョン")
+    parser.add_argument("--status", action="store_true", help="現在のバージョンを表示して終了")
+    args = parser.parse_args()
+
+    if args.status:
+        conn = sqlite3.connect(args.db)
+        try:
+            print(f"{args.db}: version {current_version(conn)} / latest {latest_version()}")
+        finally:
+            conn.close()
+        return
+
+    applied = upgrade_database(args.db, args.target)
+    for version, description in applied:
+        print(f"applied {version}: {description}")
+    if not applied:
+        print("データベースは最新です。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+検証用の合成データの投入
+
+空のデータベースに、実際の時間割に近いコアタイムを持つ学生と、
+数年分の入退室の記録を生成して投入します。同じ --seed なら同じデータになります。
+
+- コアタイムは月～木曜・2～4限に多く、金曜・1限・5限は少なめに割り当てます（一部の学生はなし）
+- 平日は学生ごとの出席率で来室し、コアタイムのある日はその時限の少し前に来ます（一部は遅刻）。
+  昼休みなどで1日2回に分かれることもあります。土日の来室はまれです
+- 退室のタッチ忘れは、次に来室したときのタッチで退室として記録され、
+  その直後のタッチで改めて入室した扱いになります（最後まで忘れたままなら在室中のまま）
+- コアタイムのチェック時刻（core_time_periods.check_time）に在室していなければアラートを記録し、
+  違反回数と daily_presence も記録に合わせて作ります
+
+書き込みは executemany でまとめて行い、出席記録のインデックスとトリガーは投入後に作り直します。
+
+実行例（server/backend で実行）:
+    python -m db.seed --db /tmp/large.db --students 5000 --years 5 --seed 1
+"""
+import argparse
+import math
+import os
+import random
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+from db.migrations import DAILY_PRESENCE_ROLLUP_SQL, upgrade_database
+
+# コアタイムの曜日（1:月曜 ... 5:金曜）と時限の重み
+DAY_WEIGHTS = {1: 5, 2: 5, 3: 5, 4: 4, 5: 2}
+PERIOD_WEIGHTS = {1: 1, 2: 4, 3: 5, 4: 4, 5: 2, 6: 0}
+
+# 投入中に data_versions のトリガーを外すテーブル
+BULK_TABLES = ["students", "attendance_logs", "current_status", "alerts", "daily_presence"]
+
+def minutes(hhmm):
+    hour, minute = hhmm.split(":")
+    return int(hour) * 60 + int(minute)
+
+def make_students(rng, count, no_core_time_ratio):
+    """ (学籍番号, 氏名, コアタイム1の曜日・時限, コアタイム2の曜日・時限, 出席率, 遅刻率) """
+    days, day_weights = list(DAY_WEIGHTS), list(DAY_WEIGHTS.values())
+    periods, period_weights = list(PERIOD_WEIGHTS), list(PERIOD_WEIGHTS.values())
+    students = []
+    for i in range(count):
+        slots = [(0, 0), (0, 0)]
+        if rng.random() >= no_core_time_ratio:
+            first_day = rng.choices(days, day_weights)[0]
+            second_day = first_day
+            while second_day == first_day:
+                second_day = rng.choices(days, day_weights)[0]
+            slots = sorted(
+                [(first_day, rng.choices(periods, period_weights)[0]), (second_day, rng.choices(periods, period_weights)[0])]
+            )
+        students.append((
+            f"{24 + i % 4}{i:06d}",
+            f"学生{i}",
+            slots[0][0], slots[0][1], slots[1][0], slots[1][1],
+            rng.betavariate(8, 2),   # 平日の出席率（平均 0.8）
+            rng.betavariate(2, 10),  # コアタイムの日に遅刻する割合（平均 0.17）
+        ))
+    return students
+
+def day_sessions(rng, slot_periods, periods, punctual):
+    """ 1日分の在室区間（0時からの秒数）。slot_periods はその日のコアタイムの時限 """
+    if slot_periods:
+        first = min(minutes(periods[p][0]) for p in slot_periods) * 60
+        last = max(minutes(periods[p][1]) for p in slot_periods) * 60
+        if rng.random() < punctual:
+            arrival = first - abs(rng.gauss(15, 10)) * 60
+        else:
+            arrival = first + rng.expovariate(1 / 20) * 60
+        departure = max(last + rng.gauss(30, 40) * 60, arrival + 1800)
+    else:
+        arrival = (9 * 60 + rng.triangular(0, 300, 60)) * 60
+        departure = arrival + rng.lognormvariate(math.log(4 * 3600), 0.5)
+    departure = min(departure, 23 * 3600)
+    arrival = min(max(arrival, 7 * 3600), departure - 600)
+
+    # 昼休みなどで一度退室する
+    if departure - arrival > 4 * 3600 and rng.random() < 0.3:
+        middle = arrival + (departure - arrival) * rng.uniform(0.35, 0.65)
+        gap = rng.uniform(20, 60) * 60
+        return [(arrival, middle), (middle + gap, departure)]
+    return [(arrival, departure)]
+
+def covers(sessions, second):
+    return any(start <= second < end for start, end in sessions)
+
+class Writer:
+    """ 行をためて executemany でまとめて書き込む """
+
+    def __init__(self, conn, sql, batch_size):
+        self.conn = conn
+        self.sql = sql
+        self.batch_size = batch_size
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.conn.executemany(self.sql, self.rows)
+            self.count += len(self.rows)
+            self.rows = []
+
+def generate(conn, rng, students, start, end, forgot_exit_rate, weekend_rate, batch_size, progress=None):
+    """ start～end（両端を含む）の出席記録・アラートを生成して書き込み、(出席記録数, アラート数) を返す """
+    periods = {
+        period: (start_time, end_time, check_time)
+        for period, start_time, end_time, check_time in conn.execute(
+            "SELECT period, start_time, end_time, check_time FROM core_time_periods"
+        )
+    }
+    checks = {period: minutes(check_time) * 60 for period, (_, _, check_time) in periods.items() if check_time}
+
+    logs = Writer(conn, "INSERT INTO attendance_logs (id, student_id, entry_time, exit_time) VALUES (?, ?, ?, ?)", batch_size)
+    alerts = Writer(conn, "INSERT INTO alerts (student_id, alert_date, alert_period) VALUES (?, ?, ?)", batch_size)
+
+    # 曜日ごとのコアタイムの時限
+    schedules = []
+    for _, _, day_1, period_1, day_2, period_2, _, _ in students:
+        schedule = {}
+        for day, period in ((day_1, period_1), (day_2, period_2)):
+            if day and period in periods:
+                schedule.setdefault(day, []).append(period)
+        schedules.append(schedule)
+
+    next_id = 1
+    open_logs = {}  # 退室を忘れたままの学生 -> (id, 入室時刻)
+    day = start
+    while day <= end:
+        weekday = day.weekday() + 1
+        midnight = datetime.combine(day, datetime.min.time())
+        for index, student in enumerate(students):
+            student_id, attendance, punctual = student[0], student[6], student[7]
+            slot_periods = schedules[index].get(weekday, [])
+            rate = attendance if weekday <= 5 else weekend_rate
+            sessions = day_sessions(rng, slot_periods, periods, punctual) if rng.random() < rate else []
+
+            for period in slot_periods:
+                check = checks.get(period)
+                if check is None:
+                    continue
+                # 退室を忘れていればチェック時点では在室扱い（来室のタッチで退室になるまで）
+                forgotten = student_id in open_logs and (not sessions or check < sessions[0][0])
+                if not forgotten and not covers(sessions, check):
+                    alerts.add((student_id, day.isoformat(), period))
+
+            for n, (arrival, departure) in enumerate(sessions):
+                entry_time = midnight + timedelta(seconds=int(arrival))
+                if student_id in open_logs:
+                    # 来室のタッチが忘れていた退室になり、次のタッチで入室する
+                    log_id, open_entry = open_logs.pop(student_id)
+                    logs.add((log_id, student_id, open_entry, entry_time.isoformat(" ")))
+                    entry_time += timedelta(seconds=rng.randint(5, 90))
+                exit_time = midnight + timedelta(seconds=int(departure))
+                if n == len(sessions) - 1 and rng.random() < forgot_exit_rate:
+                    open_logs[student_id] = (next_id, entry_time.isoformat(" "))
+                else:
+                    logs.add((next_id, student_id, entry_time.isoformat(" "), exit_time.isoformat(" ")))
+                next_id += 1
+        if progress is not None:
+            progress(day, logs.count + len(logs.rows))
+        day += timedelta(days=1)
+
+    # 最後まで退室していない記録は在室中のまま残す
+    for student_id, (log_id, entry_time) in open_logs.items():
+        logs.add((log_id, student_id, entry_time, None))
+    logs.flush()
+    alerts.flush()
+    conn.executemany(
+        "INSERT INTO current_status (student_id, entry_time) VALUES (?, ?)",
+        [(student_id, entry_time) for student_id, (_, entry_time) in sorted(open_logs.items())]
+    )
+    conn.execute(
+        "UPDATE students SET core_time_violations = "
+        "(SELECT COUNT(*) FROM alerts WHERE alerts.student_id = students.student_id)"
+    )
+    return logs.count, alerts.count
+
+def seed(db_path, students=500, years=2.0, end=None, seed=0, forgot_exit_rate=0.02, weekend_rate=0.05,
+         no_core_time_ratio=0.1, batch_size=50000, progress=None):
+    """
+    空のデータベースに合成データを投入し、件数を返す
+    出席記録のインデックスと data_versions のトリガーは投入中は外し、最後に作り直す
+    """
+    upgrade_database(db_path)
+    rng = random.Random(seed)
+    end = end or date.today() - timedelta(days=1)
+    start = end - timedelta(days=int(years * 365) - 1)
+
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.isolation_level = None
+    try:
+        if conn.execute("SELECT COUNT(*) FROM students").fetchone()[0]:
+            raise ValueError(f"{db_path} には既に学生が登録されています。空のデータベースを指定してください")
+
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA cache_size = -262144")
+        placeholders = ", ".join("?" * len(BULK_TABLES))
+        saved = conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL"
+            f" AND (tbl_name IN ({placeholders}) AND (type = 'trigger' OR tbl_name = 'attendance_logs'))",
+            BULK_TABLES
+        ).fetchall()
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for kind, name, _ in saved:
+                conn.execute(f"DROP {kind.upper()} {name}")
+            rows = make_students(rng, students, no_core_time_ratio)
+            conn.executemany(
+                "INSERT INTO students (student_id, name, core_time_1_day, core_time_1_period,"
+                " core_time_2_day, core_time_2_period) VALUES (?, ?, ?, ?, ?, ?)",
+                [row[:6] for row in rows]
+            )
+            log_count, alert_count = generate(
+                conn, rng, rows, start, end, forgot_exit_rate, weekend_rate, batch_size, progress
+            )
+            conn.execute("DELETE FROM daily_presence")
+            conn.execute(DAILY_PRESENCE_ROLLUP_SQL)
+            for _, _, sql in saved:
+                conn.execute(sql)
+            # トリガーを外していた間の書き込みの分
+            conn.execute(
+                f"UPDATE data_versions SET version = version + 1 WHERE table_name IN ({placeholders})",
+                BULK_TABLES
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return {"students": students, "attendance_logs": log_count, "alerts": alert_count, "start": start, "end": end}
+
+def main():
+    default_path = os.getenv("ATTENDANCE_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "Attendance2025.db"))
+    parser = argparse.ArgumentParser(description="検証用の合成データの投入")
+    parser.add_argument("--db", default=default_path, help="データベースファイルのパス（空のデータベース）")
+    parser.add_argument("--students", type=int, default=500, help="学生数")
+    parser.add_argument("--years", type=float, default=2.0, help="生成する期間（年）")
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="最終日（YYYY-MM-DD、既定は昨日）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--forgot-exit-rate", type=float, default=0.02, help="退室のタッチを忘れる割合")
+    parser.add_argument("--weekend-rate", type=float, default=0.05, help="土日に来室する割合")
+    parser.add_argument("--no-core-time-ratio", type=float, default=0.1, help="コアタイムのない学生の割合")
+    parser.add_argument("--batch-size", type=int, default=50000, help="executemany 1回あたりの行数")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    last_report = [started]
+
+    def progress(day, count):
+        now = time.perf_counter()
+        if now - last_report[0] >= 5:
+            last_report[0] = now
+            print(f"{day}: {count} 件 ({count / (now - started):.0f} 件/秒)", flush=True)
+
+    try:
+        result = seed(
+            args.db, args.students, args.years, args.end, args.seed, args.forgot_exit_rate,
+            args.weekend_rate, args.no_core_time_ratio, args.batch_size, progress
+        )
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    print(
+        f"{result['start']}～{result['end']}: 学生 {result['students']} 人, 出席記録 {result['attendance_logs']} 件, "
+        f"アラート {result['alerts']} 件 ({time.perf_counter() - started:.1f} 秒)"
+    )
+
+if __name__ == "__main__":
+    main()
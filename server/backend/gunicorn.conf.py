@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+本番用の gunicorn の設定
+
+アプリはマスターで1回だけ読み込み（preload_app）、fork したワーカーで main.after_fork を呼んで
+接続・ログのスレッド・プロセスごとのIDを作り直します。マイグレーションはライフスパンで各ワーカーが
+実行しますが、BEGIN IMMEDIATE の中でバージョンを確認するので1回だけ適用されます。
+
+ワーカー間で共有する状態は SQLite を経由します。
+- コアタイムチェック: leases のリースを持つ1つのワーカーだけが実行する
+- 通知: 送信する通知をアウトボックスの UPDATE で取得するので、同じ通知を二重に送らない
+- 入室状況・イベント配信: data_versions を worker_sync_interval 秒ごとに確認し、他のワーカーの変更を取り込む
+  （workers が1なら確認しない）
+
+実行例（server/backend で実行）:
+    gunicorn -c gunicorn.conf.py main:app
+    WEB_CONCURRENCY=4 gunicorn -c gunicorn.conf.py main:app
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+# 書き込みは SQLite で直列になるので、CPU 数より多くしても入退室の記録は速くならない
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count(), 4))))
+worker_class = "workers.AttendanceWorker"
+preload_app = True
+
+# SIGTERM から SIGKILL までの秒数（処理中のリクエストの完了と、未送信の通知の送信を待つ）
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "15"))
+# 応答のないワーカーを再起動するまでの秒数
+timeout = int(os.getenv("WORKER_TIMEOUT", "30"))
+keepalive = 5
+
+# アクセスログはアプリのログ（services/log_pipeline.py）に uvicorn.access として出る
+accesslog = None
+
+
+def post_fork(server, worker):
+    import main
+    main.after_fork(server.cfg.workers)
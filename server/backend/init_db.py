@@ -1,14 +1,19 @@
-from db.database import Base, engine
-from models.models import Student, AttendanceLog, CurrentStatus, Alert
+from db.database import DB_PATH
+from db.migrations import upgrade_database, latest_version
 
 def init_db():
-    # テーブルを作成
-    Base.metadata.create_all(bind=engine)
-    print("データベースを初期化しました。以下のテーブルが作成されました：")
+    # マイグレーションを適用してテーブルを作成（既存のデータベースはアップグレード）
+    upgrade_database(DB_PATH)
+    print(f"データベースを初期化しました（スキーマバージョン {latest_version()}）。以下のテーブルが作成されました：")
     print("- Student（学生情報）")
     print("- AttendanceLog（出席記録）")
     print("- CurrentStatus（現在の入室状況）")
     print("- Alert（コアタイム違反等のアラート）")
+    print("- NotificationOutbox（Telegram通知のアウトボックス）")
+    print("- DailyPresence（日ごとの在室時間の集計）")
+    print("- CoreTimePeriod（時限の時間帯）")
+    print("- Lease, JobRun（スケジューラのリースと実行記録）")
+    print("- DataVersion（テーブルごとの変更回数。ETag 用）")
 
 if __name__ == "__main__":
-    init_db() 
\ No newline at end of file
+    init_db()
@@ -2,8 +2,8 @@
 
 
 # {{{ import
-from fastapi import FastAPI, HTTPException, Path, File, UploadFile, Depends, Body
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, Path, File, UploadFile, Depends, Body, Query, Request, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
@@ -16,15 +16,249 @@ from xml.etree import ElementTree as ET
 import base64
 import json
 import re
+import uuid
+from sqlalchemy import func, delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, OperationalError
 from sqlalchemy.orm import Session
 from datetime import datetime, date, timedelta
-from typing import List, Optional
-from models.models import Student, AttendanceLog, CurrentStatus, Alert
-from schemas.schemas import StudentCreate, Student as StudentSchema, AttendanceLogCreate, AttendanceLog as AttendanceLogSchema, CurrentStatusCreate, CurrentStatus as CurrentStatusSchema, AlertCreate, Alert as AlertSchema, AttendanceResponse, CoreTimeUpdate
-from db.database import get_db
+from typing import Dict, List, Optional
+from models.models import Student, AttendanceLog, CurrentStatus, Alert, DailyPresence
+from schemas.schemas import StudentCreate, Student as StudentSchema, AttendanceLogCreate, AttendanceLog as AttendanceLogSchema, CurrentStatusCreate, CurrentStatus as CurrentStatusSchema, AlertCreate, Alert as AlertSchema, AttendanceResponse, CoreTimeUpdate, CoreTimeCompliance, DashboardSummary, AttendanceBatchCreate, AttendanceBatchResult
+from contextlib import asynccontextmanager
+from db.database import get_db, get_async_db, get_write_db, get_async_write_db, SessionLocal, engine, async_engine, DB_PATH
+from db.migrations import upgrade_database
+from services.core_time import run_core_time_check, violation_message
+from services.compliance import evaluate_compliance
+from services.notifier import TelegramNotifier, enqueue_notification, enqueue_notifications
+from services.scheduler import CoreTimeScheduler
+from services.leases import make_owner_id
+from services.presence import presence
+from services.attendance import apply_attendance_batch
+from services.daily_presence import rollup_statement, week_start as week_start_of, weekly_seconds
+from services.events import hub
+from services.export import FORMATS, attendance_query, alerts_query, stream_rows
+from services.pagination import InvalidCursor, MAX_PAGE_SIZE, keyset_page, sequence_page
+from services.versions import LocalWrites, VersionWatcher, versions_statement, make_etag, etag_matches
+from services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Gauge, MetricsMiddleware, instrument_engine, registry
+from services import query_budget
+from services.log_pipeline import setup_logging
+from services.reporting import ReportingDatabase, freshness_headers
+from services.archive import history_source
 # }}}
 
-app = FastAPI(title="Attendance Manager API")
+# Telegram設定
+class Settings(BaseSettings):
+    telegram_id: str
+    telegram_alert: str
+    telegram_api_base: str = "https://api.telegram.org"
+    core_time_scheduler: bool = True  # False にするとプロセス内のコアタイムチェックを行わない
+    query_debug_headers: bool = False  # True にするとクエリ数・DB時間を X-DB-Queries / X-DB-Time-Ms で返す
+    query_budget_default: int = 20     # QUERY_BUDGETS にないルートのクエリ数の上限
+    query_budgets: Dict[str, int] = {}  # ルートごとの上限の上書き（JSON で {"GET /api/students/": 3} のように指定）
+    log_level: str = "INFO"
+    log_format: str = "json"           # json / text
+    log_sample_burst: int = 20         # 同じ書式の INFO 以下のログを log_sample_interval 秒あたりこの件数まで出す（0 で間引かない）
+    log_sample_interval: float = 1.0
+    reporting_mode: str = "readonly"   # readonly / snapshot（集計・エクスポートの読み出し先）
+    reporting_snapshot_interval: float = 60.0  # snapshot モードでスナップショットを作り直す間隔（秒）
+    reporting_snapshot_path: Optional[str] = None  # 省略時はデータベースと同じディレクトリの *.reporting.db
+    worker_sync_interval: float = 1.0  # 他のワーカーの入退室・学生・違反の変更を確認する間隔（秒、0 で確認しない。ワーカーが1つなら確認しない）
+    notifier_drain_timeout: float = 5.0  # 停止時に未送信の通知を送り切るまで待つ最大秒数（0 で待たない）
+
+    class Config:
+        env_file = ".env"
+
+settings = Settings()
+
+# 通知はアウトボックス経由でバックグラウンドのワーカーが送信する
+notifier = TelegramNotifier(
+    SessionLocal,
+    token=settings.telegram_alert,
+    chat_id=settings.telegram_id,
+    api_base=settings.telegram_api_base
+)
+
+#{{{ イベント配信（/api/events）
+def current_week() -> date:
+    return week_start_of(date.today()).date()
+
+def publish_entry(student_id: str, name: str, entry_time: datetime):
+    hub.publish("entry", {"student_id": student_id, "name": name, "entry_time": entry_time})
+
+def publish_exits(exits, weekly_rows):
+    """ exits: [(学籍番号, 氏名, 退室時刻)]、weekly_rows: weekly_seconds の結果 """
+    seconds = dict(weekly_rows)
+    for student_id, name, exit_time in exits:
+        hub.publish("exit", {
+            "student_id": student_id,
+            "name": name,
+            "exit_time": exit_time,
+            "weekly_hours": round((seconds.get(student_id) or 0) / 3600, 2)
+        })
+
+def after_core_time_check(period: int, result, checked_at: datetime):
+    """ コアタイムチェックのコミット後の処理（エンドポイントとスケジューラで共通） """
+    notifier.wake()
+    hub.publish("violation", {
+        "period": period,
+        "date": checked_at.date(),
+        "violations": result.violations,
+        "new_alerts": [student_id for student_id, _ in result.new_alerts],
+        "updated_students": result.updated_students
+    })
+#}}}
+
+# コアタイムチェックは core_time_periods.check_time の時刻にプロセス内で実行する
+scheduler = CoreTimeScheduler(SessionLocal, on_run=after_core_time_check)
+
+#{{{ ワーカー間の同期
+def apply_worker_changes(db: Session, tables):
+    """
+    他のワーカーの書き込みをこのプロセスの入室状況とイベント配信に反映する（watcher のスレッドで呼ばれる）
+    入退室は入室状況のインデックスとの差分をイベントにする（このプロセスで記録済みの変更は差分にならない）
+    学生・違反の変更は差分を作らず、resync で一覧の再読み込みを促す。このプロセスの書き込みは local_writes で除かれ、
+    ここには来ない（学生の登録・コアタイムの設定は resync、削除は student_deleted、コアタイムチェックは violation で配信済み）
+    取り込めなかったテーブルを返す（次の回にもう一度呼ばれる）
+    """
+    retry = set()
+    if "current_status" in tables:
+        result = presence.sync(db)
+        if result is None:
+            # 読み出し中にこのプロセスで入退室があった
+            retry.add("current_status")
+            result = ([], [])
+        entered, exited = result
+        student_ids = [student_id for student_id, _ in entered] + exited
+        if student_ids:
+            names = dict(db.query(Student.student_id, Student.name).filter(Student.student_id.in_(student_ids)).all())
+            for student_id, entry_time in entered:
+                publish_entry(student_id, names.get(student_id), entry_time)
+        if exited:
+            exit_times = dict(db.query(AttendanceLog.student_id, func.max(AttendanceLog.exit_time)).filter(
+                AttendanceLog.student_id.in_(exited)
+            ).group_by(AttendanceLog.student_id).all())
+            publish_exits(
+                [(student_id, names.get(student_id), exit_times.get(student_id)) for student_id in exited],
+                db.execute(weekly_seconds(exited, current_week())).all()
+            )
+    if "students" in tables or "alerts" in tables:
+        hub.publish("resync", {"reason": "data changed"})
+    return retry
+
+# data_versions を定期的に読み、他のワーカーの変更を取り込む
+# ワーカーが1つなら他のワーカーの変更はないので確認しない（gunicorn で複数ワーカーの場合に after_fork で有効にする）
+# 学生・違反はこのプロセスの書き込みで増えたバージョンを local_writes に記録し、他のワーカーの変更だけを resync にする
+local_writes = LocalWrites(["students", "alerts"])
+watcher = VersionWatcher(
+    SessionLocal, ["current_status", "students", "alerts"], apply_worker_changes,
+    interval=0, local=local_writes
+)
+#}}}
+
+# 集計・エクスポートは入退室の書き込みとは別の読み取り専用のエンジンで読む
+reporting = ReportingDatabase(
+    DB_PATH,
+    mode=settings.reporting_mode,
+    snapshot_path=settings.reporting_snapshot_path,
+    interval=settings.reporting_snapshot_interval
+)
+
+#{{{ メトリクス（/metrics）
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+for reporting_engine in reporting.engines():
+    instrument_engine(reporting_engine)
+registry.register(Gauge("sse_subscribers", "Connected dashboard event streams", lambda: hub.subscriber_count))
+registry.register(Gauge("students_present", "Students currently in the room", lambda: len(presence.student_ids())))
+registry.register(Gauge("core_time_scheduler_leader", "1 if this process holds the scheduler lease", lambda: int(scheduler.is_leader)))
+#}}}
+
+#{{{ リクエストごとのクエリ数
+query_budget.instrument_engine(engine)
+query_budget.instrument_engine(async_engine.sync_engine)
+for reporting_engine in reporting.engines():
+    query_budget.instrument_engine(reporting_engine)
+
+# ルートごとのクエリ数の上限（超えると警告をログに出す）
+QUERY_BUDGETS = {
+    "POST /api/attendance-now/{student_id}": 8,
+    "POST /api/attendance/": 8,
+    "POST /api/attendance/batch": 12,
+    "GET /api/attendance/{student_id}": 2,
+    "GET /api/current-status/": 0,
+    "GET /api/students/": 2,
+    "GET /api/students/{student_id}": 2,
+    "DELETE /api/students/{student_id}": 8,
+    "GET /api/dashboard/summary": 2,
+    "GET /api/core-time/check/{period}": 6,
+    "GET /api/core-time/violations": 2,
+    "GET /api/coretime/{student_id}": 2,
+}
+#}}}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 既存のデータベースを最新のスキーマにアップグレード
+    for version, description in upgrade_database(DB_PATH):
+        logger.info("Migration applied: %s %s", version, description)
+    # 他のワーカーの変更の確認は、読み込みより前のバージョンを基準にする（読み込み中の変更も取り込むため）
+    await watcher.start()
+    # 入室状況のインデックスを読み込む
+    db = SessionLocal()
+    try:
+        presence.load(db)
+    finally:
+        db.close()
+    # snapshot モードでは最初のスナップショットを作る
+    await reporting.start()
+    # 再起動前に送信できなかった通知もここから送信される
+    await notifier.start()
+    if settings.core_time_scheduler:
+        await scheduler.start()
+    yield
+    await watcher.stop()
+    if settings.core_time_scheduler:
+        await scheduler.stop()
+    # 処理中のリクエストが登録した通知まで送ってから止める
+    await notifier.stop(drain_timeout=settings.notifier_drain_timeout)
+    await reporting.stop()
+    # プール中の aiosqlite 接続（接続ごとのスレッド）を閉じる
+    await async_engine.dispose()
+
+def after_fork(workers: int = 1):
+    """
+    gunicorn の preload_app でアプリを読み込んだマスターからワーカーを fork した直後に呼ぶ（gunicorn.conf.py の post_fork）
+    マスターで作った接続・ログのスレッド・プロセスを表すIDはワーカーに引き継がない
+    workers（ワーカー数）が2以上なら、他のワーカーの変更の確認（watcher）を有効にする
+    """
+    # 接続は閉じずに手放す（マスター側の接続を子から閉じない）
+    # async_engine はライフスパンまで接続しないので対象外（プールを作り直すと最初の接続のロックが
+    # asyncio 用でなくなり、同時に接続するリクエストがイベントループを止める）
+    for sqlite_engine in [engine, *reporting.engines()]:
+        sqlite_engine.dispose(close=False)
+    # QueueListener のスレッドは fork で引き継がれない
+    configure_logging()
+    # 同じ ID のままだとワーカー同士で ETag が衝突し、全ワーカーがリースの所有者になる
+    presence.instance_id = uuid.uuid4().hex
+    scheduler.owner = make_owner_id()
+    if workers > 1:
+        # 接続はこの後に作り直されるので、新しい接続からこのプロセスの書き込みを記録する
+        for sqlite_engine in [engine, async_engine.sync_engine]:
+            local_writes.register(sqlite_engine)
+        watcher.interval = settings.worker_sync_interval
+
+app = FastAPI(title="Attendance Manager API", lifespan=lifespan)
+
+# ルートごとの応答時間の計測
+app.add_middleware(MetricsMiddleware)
+# リクエストごとのクエリ数の計測と予算の確認
+app.add_middleware(
+	query_budget.QueryBudgetMiddleware,
+	budgets={**QUERY_BUDGETS, **settings.query_budgets},
+	default_budget=settings.query_budget_default,
+	debug_headers=settings.query_debug_headers,
+)
 
 # CORSミドルウェアの設定
 app.add_middleware(
@@ -33,8 +267,75 @@ app.add_middleware(
 	allow_credentials=True,
 	allow_methods=["*"],
 	allow_headers=["*"],
+	expose_headers=["X-Next-Cursor", "ETag", "X-DB-Queries", "X-DB-Time-Ms", "X-Data-Source", "X-Data-As-Of", "X-Data-Age"],
 )
 
+# SQLite のロック待ちが busy_timeout を超えた場合は 503（Retry-After）を返し、クライアントに再送させる
+def is_database_locked(exc: Exception) -> bool:
+	return isinstance(exc, OperationalError) and "database is locked" in str(exc.orig)
+
+@app.exception_handler(OperationalError)
+async def operational_error_handler(request: Request, exc: OperationalError):
+	if is_database_locked(exc):
+		logger.warning("データベースのロック待ちがタイムアウトしました: %s %s", request.method, request.url.path)
+		return JSONResponse(
+			status_code=503, headers={"Retry-After": "1"},
+			content={"detail": "データベースが混み合っています。もう一度記録してください"}
+		)
+	logger.error("データベースエラー: %s %s: %s", request.method, request.url.path, exc)
+	return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+
+# 一覧APIのページング（次のページのカーソルは X-Next-Cursor ヘッダーで返す）
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+	return JSONResponse(status_code=400, content={"detail": "Invalid cursor"})
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+	if next_cursor is not None:
+		response.headers["X-Next-Cursor"] = next_cursor
+
+# 条件付きGET（ETag は元になるテーブルのバージョンとリクエストのパス・パラメータから作る）
+class NotModified(Exception):
+	def __init__(self, etag: str):
+		self.etag = etag
+
+@app.exception_handler(NotModified)
+async def not_modified_handler(request: Request, exc: NotModified):
+	return Response(status_code=304, headers={"ETag": exc.etag})
+
+def request_etag(request: Request, versions: dict, *parts) -> str:
+	return make_etag(versions, request.url.path, sorted(request.query_params.multi_items()), *parts)
+
+def check_etag(request: Request, response: Response, etag: str):
+	""" If-None-Match が一致すれば NotModified（304）、しなければ応答に ETag を付ける """
+	if etag_matches(request.headers.get("if-none-match"), etag):
+		raise NotModified(etag)
+	response.headers["ETag"] = etag
+
+def check_versions(request: Request, response: Response, db: Session, tables: List[str], *parts):
+	""" テーブルのバージョンだけを読んで条件付きGETを判定する（本体のクエリより先に呼ぶ） """
+	versions = dict(db.execute(versions_statement(tables)).all())
+	check_etag(request, response, request_etag(request, versions, *parts))
+
+# 集計・レポート用の読み取り専用セッション（応答にデータの鮮度を X-Data-As-Of などで付ける）
+def get_reporting_db(response: Response):
+	db, headers = reporting.session()
+	response.headers.update(headers)
+	try:
+		yield db
+	finally:
+		db.close()
+
+# 最新のデータを読む読み取り専用セッション（snapshot モードでもスナップショットを使わない）
+# SSE のイベントで差分を当てる一覧（ダッシュボード・学生ごとの履歴）用
+def get_live_db(response: Response):
+	db, headers = reporting.live_session()
+	response.headers.update(headers)
+	try:
+		yield db
+	finally:
+		db.close()
+
 # 静的ファイルの設定（APIエンドポイントの後にマウント）
 @app.get("/", response_class=HTMLResponse)
 async def read_root():
@@ -42,9 +343,17 @@ async def read_root():
         return f.read()
 
 #{{{ ロギングの設定
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+def configure_logging():
+    """ 書き込みは別スレッド（QueueListener）で行い、リクエストの処理はログの出力を待たない """
+    setup_logging(
+        level=settings.log_level,
+        log_format=settings.log_format,
+        burst=settings.log_sample_burst,
+        interval=settings.log_sample_interval,
+    )
+
+configure_logging()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 logger.info("Start FastAPI")
 #}}}
@@ -56,35 +365,53 @@ DATABASE = os.path.join(BASE_DIR, "db/Attendance2025.db")
 def get_db_connection():
 	""" データベース接続を確立 """
 	if not os.path.exists(DATABASE):
-		logger.error(f"Nonexist: {DATABASE}")
+		logger.error("Nonexist: %s", DATABASE)
 		raise FileNotFoundError(f"Not exist: {DATABASE}")
 
 	try:
-		logger.info(f"Open Database: {DATABASE}")
+		logger.debug("Open Database: %s", DATABASE)
 		conn = sqlite3.connect(DATABASE)
 		conn.row_factory = sqlite3.Row
 		return conn
 	except sqlite3.Error as e:
-		logger.error(f"DB Error: {e}")
+		logger.error("DB Error: %s", e)
 		raise HTTPException(status_code=500, detail="データベースに接続できませんでした")
 #}}}
 
 #{{{ 学生管理API
 @app.post("/api/students/", response_model=StudentSchema)
-def create_student(student: StudentCreate, db: Session = Depends(get_db)):
+def create_student(student: StudentCreate, db: Session = Depends(get_write_db)):
 	db_student = Student(**student.dict())
 	db.add(db_student)
+	db.flush()
+	db.refresh(db_student)  # 既定値の入った行を読む（コミット後に読むと書き込みのロックをもう一度取る）
 	db.commit()
-	db.refresh(db_student)
+	hub.publish("resync", {"reason": "student created"})
 	return db_student
 
 @app.get("/api/students/", response_model=List[StudentSchema])
-def read_students(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-	students = db.query(Student).offset(skip).limit(limit).all()
+def read_students(
+	request: Request,
+	response: Response,
+	cursor: Optional[str] = None,
+	limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+	skip: int = Query(0, ge=0, deprecated=True),  # 旧クライアント用。cursor を使ってください
+	db: Session = Depends(get_db)
+):
+	check_versions(request, response, db, ["students"])
+	query = db.query(Student)
+	if skip and cursor is None:
+		query = query.order_by(Student.student_id).offset(skip).limit(limit)
+		return query.all()
+	students, next_cursor = keyset_page(
+		query, [Student.student_id], lambda s: [s.student_id], cursor, limit
+	)
+	set_next_cursor(response, next_cursor)
 	return students
 
 @app.get("/api/students/{student_id}", response_model=StudentSchema)
-def read_student(student_id: str, db: Session = Depends(get_db)):
+def read_student(student_id: str, request: Request, response: Response, db: Session = Depends(get_db)):
+	check_versions(request, response, db, ["students"])
 	student = db.query(Student).filter(Student.student_id == student_id).first()
 	if student is None:
 		raise HTTPException(status_code=404, detail="Student not found")
@@ -93,7 +420,7 @@ def read_student(student_id: str, db: Session = Depends(get_db)):
 @app.delete("/api/students/{student_id}")
 async def delete_student(
     student_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_write_db)
 ):
     """
     指定された学籍番号の学生のレコードを削除するAPI
@@ -101,57 +428,88 @@ async def delete_student(
     """
     try:
         # トランザクション開始
-        student = db.query(Student).filter(Student.student_id == student_id).first()
+        student = await db.get(Student, student_id)
         if not student:
             raise HTTPException(status_code=404, detail="Student not found")
 
         # 関連する出席記録を削除
-        db.query(AttendanceLog).filter(
+        await db.execute(delete(AttendanceLog).where(
             AttendanceLog.student_id == student_id
-        ).delete()
+        ))
 
         # 現在の入室状況を削除
-        db.query(CurrentStatus).filter(
+        await db.execute(delete(CurrentStatus).where(
             CurrentStatus.student_id == student_id
-        ).delete()
+        ))
 
         # コアタイム違反の記録を削除
-        db.query(Alert).filter(
+        await db.execute(delete(Alert).where(
             Alert.student_id == student_id
-        ).delete()
+        ))
 
-        # 学生レコードを削除
-        db.delete(student)
+        # 日ごとの在室時間の集計を削除
+        await db.execute(delete(DailyPresence).where(
+            DailyPresence.student_id == student_id
+        ))
 
-        # 変更をコミット
-        db.commit()
+        # 学生レコードを削除（関連はすでに削除済みのため、リレーションの読み込みを伴わない一括削除）
+        await db.execute(delete(Student).where(
+            Student.student_id == student_id
+        ))
 
-        # Telegram通知を送信
+        # Telegram通知をアウトボックスに登録
         message = f"🗑️ {student.name}さん（学籍番号：{student_id}）のレコードを削除しました。"
-        await send_telegram_message(message)
+        enqueue_notification(db, message)
+
+        # 変更をコミット
+        await db.commit()
+        presence.mark_exit(student_id)
+        notifier.wake()
+        hub.publish("student_deleted", {"student_id": student_id})
 
         return {"status": "success", "message": f"学生ID {student_id} のレコードを削除しました"}
 
     except Exception as e:
-        db.rollback()
-        logger.error(f"学生削除エラー: {str(e)}")
+        await db.rollback()
+        if is_database_locked(e):
+            raise  # 503（operational_error_handler）
+        logger.error("学生削除エラー: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 #}}}
 
 #{{{ 入退室管理API
+def commit_attendance(db: Session, student_id: str):
+	"""
+	入退室の変更をコミットする
+	入室状況のインデックスとテーブルがずれていて失敗した場合は、読み直してから409を返す
+	"""
+	try:
+		db.commit()
+	except IntegrityError:
+		db.rollback()
+		presence.refresh(db, student_id)
+		logger.warning("入室状況の不整合を検出したため読み直しました: %s", student_id)
+		raise HTTPException(status_code=409, detail="入室状況を再読み込みしました。もう一度記録してください")
+
+async def commit_attendance_async(db: AsyncSession, student_id: str):
+	""" commit_attendance の非同期セッション版 """
+	try:
+		await db.commit()
+	except IntegrityError:
+		await db.rollback()
+		await db.run_sync(presence.refresh, student_id)
+		logger.warning("入室状況の不整合を検出したため読み直しました: %s", student_id)
+		raise HTTPException(status_code=409, detail="入室状況を再読み込みしました。もう一度記録してください")
+
 @app.post("/api/attendance/", response_model=AttendanceResponse)
-def record_attendance(attendance: AttendanceLogCreate, db: Session = Depends(get_db)):
+def record_attendance(attendance: AttendanceLogCreate, db: Session = Depends(get_write_db)):
 	# 学生が存在するか確認
 	student = db.query(Student).filter(Student.student_id == attendance.student_id).first()
 	if student is None:
 		raise HTTPException(status_code=404, detail="Student not found")
 
-	# 現在の入室状況を確認
-	current_status = db.query(CurrentStatus).filter(
-		CurrentStatus.student_id == attendance.student_id
-	).first()
-
-	if current_status is None:
+	# 現在の入室状況を確認（プロセス内のインデックスを参照）
+	if not presence.is_present(attendance.student_id):
 		# 入室処理
 		db_attendance = AttendanceLog(
 			student_id=attendance.student_id,
@@ -166,7 +524,9 @@ def record_attendance(attendance: AttendanceLogCreate, db: Session = Depends(get
 			entry_time=attendance.time
 		)
 		db.add(current_status)
-		db.commit()
+		commit_attendance(db, attendance.student_id)
+		presence.mark_entry(attendance.student_id, attendance.time)
+		publish_entry(attendance.student_id, student.name, attendance.time)
 		return {"name": student.name, "status": "入室"}
 	else:
 		# 退室処理
@@ -178,42 +538,124 @@ def record_attendance(attendance: AttendanceLogCreate, db: Session = Depends(get
 		
 		if attendance_log:
 			attendance_log.exit_time = attendance.time
+			# 日ごとの在室時間に加算
+			rollup = rollup_statement([(attendance.student_id, attendance_log.entry_time, attendance.time)])
+			if rollup is not None:
+				db.execute(rollup)
 		
 		# 現在の入室状況を削除
-		db.delete(current_status)
-		db.commit()
+		db.query(CurrentStatus).filter(
+			CurrentStatus.student_id == attendance.student_id
+		).delete(synchronize_session=False)
+		# 今週の利用時間はコミットの前に読む（コミット後に読むと書き込みのロックをもう一度取る）
+		weekly = db.execute(weekly_seconds([attendance.student_id], current_week())).all()
+		commit_attendance(db, attendance.student_id)
+		presence.mark_exit(attendance.student_id)
+		publish_exits([(attendance.student_id, student.name, attendance.time)], weekly)
 		return {"name": student.name, "status": "退室"}
 
+@app.post("/api/attendance/batch", response_model=List[AttendanceBatchResult])
+def record_attendance_batch(batch: AttendanceBatchCreate, db: Session = Depends(get_write_db)):
+	"""
+	キオスクが溜めた入退室をまとめて記録するエンドポイント
+	学生ごとに時刻順で入室/退室を切り替え、1トランザクションで記録して入力順の結果を返します
+	"""
+	results, changed = apply_attendance_batch(db, batch.events)
+	# 退室した学生の今週の利用時間はコミットの前に読む（コミット後に読むと書き込みのロックをもう一度取る）
+	exited = [student_id for student_id, entry_time in changed.items() if entry_time is None]
+	weekly = db.execute(weekly_seconds(exited, current_week())).all() if exited else []
+	try:
+		db.commit()
+	except IntegrityError:
+		db.rollback()
+		raise HTTPException(status_code=409, detail="入室状況が同時に更新されました。もう一度送信してください")
+
+	for student_id, entry_time in changed.items():
+		if entry_time is None:
+			presence.mark_exit(student_id)
+		else:
+			presence.mark_entry(student_id, entry_time)
+
+	# 最終的な入室状況が変わった学生のみイベントを配信
+	last = {}
+	for result in results:
+		if result["student_id"] in changed and result["status"] in ("入室", "退室"):
+			if result["student_id"] not in last or result["time"] >= last[result["student_id"]]["time"]:
+				last[result["student_id"]] = result
+	exits = []
+	for student_id, result in last.items():
+		if changed[student_id] is None:
+			exits.append((student_id, result["name"], result["time"]))
+		else:
+			publish_entry(student_id, result["name"], changed[student_id])
+	if exits:
+		publish_exits(exits, weekly)
+	return results
+
 @app.get("/api/attendance/{student_id}", response_model=List[AttendanceLogSchema])
 def read_student_attendance(
 	student_id: str,
+	request: Request,
+	response: Response,
 	days: int = 0,  # 日数パラメータを追加（デフォルトは0）
-	db: Session = Depends(get_db)
+	cursor: Optional[str] = None,
+	limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE),
+	db: Session = Depends(get_live_db)
 ):
+	# days 指定時は対象期間が時刻とともに動くので、期間の開始（分単位に切り捨て）を ETag に含め、
+	# 同じ値で絞り込む（ETag が同じ間は同じ期間の結果になる）
+	cutoff_date = (datetime.now() - timedelta(days=days)).replace(second=0, microsecond=0) if days > 0 else None
+	check_versions(request, response, db, ["attendance_logs", "archives"], cutoff_date or "")
+	# 締めた年度の記録はアーカイブから読む（cutoff_date 以降に重なる年度のみ）
+	logs = history_source(db, AttendanceLog, cutoff_date)
 	# 基本のクエリを作成
-	query = db.query(AttendanceLog).filter(
-		AttendanceLog.student_id == student_id
+	query = db.query(logs).filter(
+		logs.student_id == student_id
 	)
 	
 	# 日数が0より大きい場合、指定された日数分のレコードを取得
-	if days > 0:
-		# 現在時刻から指定された日数分前の日時を計算
-		cutoff_date = datetime.now() - timedelta(days=days)
-		query = query.filter(AttendanceLog.entry_time >= cutoff_date)
+	if cutoff_date is not None:
+		query = query.filter(logs.entry_time >= cutoff_date)
 	
-	# レコードを取得（入室時刻の降順でソート）
-	attendance_logs = query.order_by(AttendanceLog.entry_time.desc()).all()
+	# レコードを取得（入室時刻の降順、同時刻はIDの降順）
+	attendance_logs, next_cursor = keyset_page(
+		query, [logs.entry_time, logs.id],
+		lambda log: [log.entry_time, log.id], cursor, limit, descending=True
+	)
+	set_next_cursor(response, next_cursor)
 	return attendance_logs
 
 @app.get("/api/current-status/", response_model=List[CurrentStatusSchema])
-def read_current_status(db: Session = Depends(get_db)):
-	current_status = db.query(CurrentStatus).all()
-	return current_status
+def read_current_status(
+	request: Request,
+	response: Response,
+	cursor: Optional[str] = None,
+	limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+	# プロセス内のインデックスから返す（DBへの問い合わせなし）。ETag もインデックスの版から作る
+	check_etag(request, response, request_etag(request, {}, presence.instance_id, presence.version))
+	entries, next_cursor = sequence_page(presence.snapshot(), lambda entry: entry[0], cursor, limit)
+	set_next_cursor(response, next_cursor)
+	return [
+		{"student_id": student_id, "entry_time": entry_time}
+		for student_id, entry_time in entries
+	]
+
+@app.get("/api/current-status/consistency")
+def check_current_status_consistency(repair: bool = False, db: Session = Depends(get_db)):
+	"""
+	入室状況のインデックスと current_status テーブルの差分を返す
+	repair=true の場合はテーブルの内容でインデックスを読み直す
+	"""
+	result = presence.check_consistency(db, repair=repair)
+	if not result["consistent"]:
+		logger.warning("入室状況の不整合を検出: %s", result)
+	return result
 
 @app.post("/api/attendance-now/{student_id}", response_model=AttendanceResponse)
 async def record_attendance_now(
 	student_id: str,
-	db: Session = Depends(get_db)
+	db: AsyncSession = Depends(get_async_write_db)
 ):
 	"""
 	現在時刻を使用して入退室を記録するエンドポイント
@@ -222,16 +664,12 @@ async def record_attendance_now(
 	current_time = datetime.now()
 	
 	# 学生の存在確認
-	student = db.query(Student).filter(Student.student_id == student_id).first()
+	student = await db.get(Student, student_id)
 	if not student:
 		raise HTTPException(status_code=404, detail="Student not found")
 	
-	# 現在の入室状況を確認
-	current_status = db.query(CurrentStatus).filter(
-		CurrentStatus.student_id == student_id
-	).first()
-	
-	if not current_status:
+	# 現在の入室状況を確認（プロセス内のインデックスを参照）
+	if not presence.is_present(student_id):
 		# 入室処理
 		current_status = CurrentStatus(
 			student_id=student_id,
@@ -246,119 +684,218 @@ async def record_attendance_now(
 			exit_time=None
 		)
 		db.add(attendance_log)
-		
-		db.commit()
 
-		# Telegram通知を送信
+		# Telegram通知をアウトボックスに登録（送信は待たない）
 		message = f"🟢 {student.name}さんが入室しました。\n時刻: {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
-		await send_telegram_message(message)
+		enqueue_notification(db, message)
+
+		await commit_attendance_async(db, student_id)
+		presence.mark_entry(student_id, current_time)
+		notifier.wake()
+		publish_entry(student_id, student.name, current_time)
 		
 		return AttendanceResponse(name=student.name, status="入室")
 	else:
 		# 退室処理
 		# 出席ログを更新
-		attendance_log = db.query(AttendanceLog).filter(
-			AttendanceLog.student_id == student_id,
-			AttendanceLog.exit_time == None
-		).order_by(AttendanceLog.entry_time.desc()).first()
+		attendance_log = (await db.execute(
+			select(AttendanceLog).where(
+				AttendanceLog.student_id == student_id,
+				AttendanceLog.exit_time == None
+			).order_by(AttendanceLog.entry_time.desc()).limit(1)
+		)).scalar_one_or_none()
 		
 		if attendance_log:
 			attendance_log.exit_time = current_time
+			# 日ごとの在室時間に加算
+			rollup = rollup_statement([(student_id, attendance_log.entry_time, current_time)])
+			if rollup is not None:
+				await db.execute(rollup)
 		
 		# 現在の入室状況を削除
-		db.delete(current_status)
-		db.commit()
+		await db.execute(delete(CurrentStatus).where(
+			CurrentStatus.student_id == student_id
+		).execution_options(synchronize_session=False))
 
-		# Telegram通知を送信
+		# Telegram通知をアウトボックスに登録（送信は待たない）
 		message = f"🔴 {student.name}さんが退室しました。\n時刻: {current_time.strftime('%Y-%m-%d %H:%M:%S')}"
-		await send_telegram_message(message)
+		enqueue_notification(db, message)
+
+		# 今週の利用時間はコミットの前に読む（コミット後に読むと書き込みのロックをもう一度取る）
+		weekly = (await db.execute(weekly_seconds([student_id], current_week()))).all()
+		await commit_attendance_async(db, student_id)
+		presence.mark_exit(student_id)
+		notifier.wake()
+		publish_exits([(student_id, student.name, current_time)], weekly)
 		
 		return AttendanceResponse(name=student.name, status="退室")
 #}}}
 
+#{{{ ダッシュボードAPI
+@app.get("/api/dashboard/summary", response_model=DashboardSummary)
+def read_dashboard_summary(request: Request, response: Response, db: Session = Depends(get_live_db)):
+    """
+    ダッシュボード表示用のデータを1回のクエリで返すAPI
+    学生ごとの入室状況、コアタイム、違反回数、今週（日曜日0時から）の利用時間を集計します
+    利用時間は日ごとの集計（daily_presence）の今週分を合計します（退室済みの分のみ）
+    集計は読み取り専用のエンジンで行います。画面は /api/events のイベントで差分を当てるので、
+    snapshot モードでもスナップショットではなく最新のデータを読みます（読み直しで古い状態に戻さない）
+    """
+    week_start = week_start_of(date.today())
+    check_versions(request, response, db, ["students", "current_status", "daily_presence"], week_start)
+
+    weekly = db.query(
+        DailyPresence.student_id.label("student_id"),
+        func.sum(DailyPresence.seconds).label("seconds")
+    ).filter(
+        DailyPresence.date >= week_start.date()
+    ).group_by(DailyPresence.student_id).subquery()
+
+    rows = db.query(Student, CurrentStatus.entry_time, weekly.c.seconds).outerjoin(
+        CurrentStatus, CurrentStatus.student_id == Student.student_id
+    ).outerjoin(
+        weekly, weekly.c.student_id == Student.student_id
+    ).order_by(Student.student_id).all()
+
+    students = []
+    for student, entry_time, seconds in rows:
+        students.append({
+            "student_id": student.student_id,
+            "name": student.name,
+            "core_time_1_day": student.core_time_1_day,
+            "core_time_1_period": student.core_time_1_period,
+            "core_time_2_day": student.core_time_2_day,
+            "core_time_2_period": student.core_time_2_period,
+            "core_time_violations": student.core_time_violations,
+            "is_present": entry_time is not None,
+            "entry_time": entry_time,
+            "weekly_hours": round((seconds or 0) / 3600, 2)
+        })
+
+    return {"week_start": week_start, "students": students}
+#}}}
+
+#{{{ エクスポートAPI
+def export_response(name: str, query, fmt: str, gzip: bool, start: Optional[date], end: Optional[date]):
+    """
+    クエリ結果をファイルとしてストリーミングで返す（レポート用の読み取り専用のエンジンから読む）
+    query は接続を受け取ってクエリを返す関数（接続に ATTACH されたアーカイブに合わせて作る）
+    """
+    filename = f"{name}_{start or 'all'}_{end or 'all'}.{fmt}"
+    media_type = FORMATS[fmt]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    reporting_engine, snapshot_at = reporting.current()
+    return StreamingResponse(
+        stream_rows(reporting_engine, query, fmt, gzip),  # 同期ジェネレータなのでスレッドプールで読み出される
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', **freshness_headers(snapshot_at)}
+    )
+
+@app.get("/api/export/attendance")
+def export_attendance(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    student_id: Optional[str] = None,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    gzip: bool = False
+):
+    """ 入室日が start～end の出席記録を CSV / NDJSON で出力する（締めた年度はアーカイブから読む） """
+    def query(conn):
+        return attendance_query(start, end, student_id, logs=history_source(conn, AttendanceLog, start, end))
+    return export_response("attendance", query, fmt, gzip, start, end)
+
+@app.get("/api/export/alerts")
+def export_alerts(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    student_id: Optional[str] = None,
+    fmt: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    gzip: bool = False
+):
+    """ 違反日が start～end のコアタイム違反を CSV / NDJSON で出力する（締めた年度はアーカイブから読む） """
+    def query(conn):
+        return alerts_query(start, end, student_id, alerts=history_source(conn, Alert, start, end))
+    return export_response("alerts", query, fmt, gzip, start, end)
+#}}}
+
+#{{{ イベント配信API
+@app.get("/api/events")
+async def stream_events():
+    """
+    入退室（entry / exit）・コアタイム違反（violation）などのイベントを Server-Sent Events で配信する
+    バッファがあふれた場合は resync を送るので、クライアントは一覧を読み直す
+    """
+    return StreamingResponse(
+        hub.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+#}}}
+
 #{{{ コアタイム管理API
 @app.get("/api/core-time/check/{period}")
-async def check_core_time(period: int, db: Session = Depends(get_db)):
+async def check_core_time(period: int, db: AsyncSession = Depends(get_async_write_db)):
     try:
         current_time = datetime.now()
-        current_day = current_time.weekday() + 1  # 1:月曜 2:火曜 ... 7:日曜
-        
-        # コアタイムの学生を取得
-        students = db.query(Student).filter(
-            ((Student.core_time_1_day == current_day) & (Student.core_time_1_period == period)) |
-            ((Student.core_time_2_day == current_day) & (Student.core_time_2_period == period))
-        ).all()
-
-        violations = []
-        for student in students:
-            # 入室状況を確認
-            current_status = db.query(CurrentStatus).filter(
-                CurrentStatus.student_id == student.student_id
-            ).first()
-            
-            if not current_status:
-                # コアタイム違反
-                violations.append(student.student_id)
-
-                # 同じ日の同じ時限の違反が既に記録されているか確認
-                existing_alert = db.query(Alert).filter(
-                    Alert.student_id == student.student_id,
-                    Alert.alert_date == current_time.date(),
-                    Alert.alert_period == period
-                ).first()
-
-                # 重複がない場合のみアラートを記録
-                if not existing_alert:
-                    alert = Alert(
-                        student_id=student.student_id,
-                        alert_date=current_time.date(),
-                        alert_period=period
-                    )
-                    db.add(alert)
-                    db.commit()
-
-                    # Telegram通知を送信
-                    message = (
-                        f"⚠️ コアタイム違反の通知\n\n"
-                        f"学籍番号: {student.student_id}\n"
-                        f"氏名: {student.name}\n"
-                        f"違反日時: {current_time.strftime('%Y-%m-%d')} {period}限目"
-                    )
-                    await send_telegram_message(message)
-
-            # 違反回数を更新 （試験的に全学生に対して実行)
-            # student.core_time_violations を Alertのstudent_idでカウント
-            violation_count = db.query(Alert).filter(
-                Alert.student_id == student.student_id
-            ).count()
-            student.core_time_violations = violation_count
-            db.add(student)
-            db.commit()
-
-
-        # 更新後の学生データを取得して返す
-        updated_students = db.query(Student).filter(
-            Student.student_id.in_([s.student_id for s in students])
-        ).all()
-        
+
+        # 不在者の抽出・アラート登録・違反回数の更新を1トランザクションで実行
+        result = await db.run_sync(run_core_time_check, period, current_time)
+
+        # 新規に記録された違反のみ、同じトランザクションで通知をアウトボックスに登録
+        await db.run_sync(enqueue_notifications, [
+            violation_message(student_id, name, current_time, period) for student_id, name in result.new_alerts
+        ])
+        await db.commit()
+        after_core_time_check(period, result, current_time)
+
         return {
-            "violations": violations,
-            "updated_students": [
-                {
-                    "student_id": s.student_id,
-                    "core_time_violations": s.core_time_violations
-                } for s in updated_students
-            ]
+            "violations": result.violations,
+            "updated_students": result.updated_students
         }
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        if is_database_locked(e):
+            raise  # 503（operational_error_handler）
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/core-time/compliance", response_model=CoreTimeCompliance)
+def read_core_time_compliance(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    student_id: Optional[str] = None,
+    min_coverage: float = Query(0.8, ge=0, le=1),
+    db: Session = Depends(get_reporting_db)
+):
+    """
+    コアタイムの各コマの時間帯と在室区間を突き合わせた充足状況を返すAPI
+    期間の既定値は今日までの7日間。終了済みのコマのみ対象
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=6)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be on or before end")
+    slots = evaluate_compliance(db, start, end, student_id=student_id, min_coverage=min_coverage)
+    return {"start": start, "end": end, "min_coverage": min_coverage, "slots": slots}
+
 @app.get("/api/core-time/violations", response_model=List[AlertSchema])
-def read_core_time_violations(db: Session = Depends(get_db)):
+def read_core_time_violations(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_reporting_db)
+):
+    check_versions(request, response, db, ["alerts", "archives"])
     try:
-        alerts = db.query(Alert).all()
+        # 締めた年度の違反はアーカイブから読む
+        alert_source = history_source(db, Alert)
+        alerts, next_cursor = keyset_page(db.query(alert_source), [alert_source.id], lambda a: [a.id], cursor, limit)
+        set_next_cursor(response, next_cursor)
         return alerts
+    except InvalidCursor:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 #}}}
@@ -368,10 +905,10 @@ def read_core_time_violations(db: Session = Depends(get_db)):
 async def set_coretime(
     student_id: str,
     coretime: CoreTimeUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_write_db)
 ):
     try:
-        student = db.query(Student).filter(Student.student_id == student_id).first()
+        student = await db.get(Student, student_id)
         if not student:
             raise HTTPException(status_code=404, detail="Student not found")
         
@@ -380,22 +917,29 @@ async def set_coretime(
         student.core_time_2_day = coretime.core_time_2_day
         student.core_time_2_period = coretime.core_time_2_period
         
-        db.commit()
+        await db.commit()
+        hub.publish("resync", {"reason": "core time updated"})
         return {"message": "Core time updated successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        if is_database_locked(e):
+            raise  # 503（operational_error_handler）
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/coretime/{student_id}")
 async def get_coretime(
     student_id: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     学生のコアタイム設定を取得するAPI
     """
+    versions = dict((await db.execute(versions_statement(["students"]))).all())
+    check_etag(request, response, request_etag(request, versions))
     try:
-        student = db.query(Student).filter(Student.student_id == student_id).first()
+        student = await db.get(Student, student_id)
         if not student:
             raise HTTPException(status_code=404, detail="Student not found")
         
@@ -406,40 +950,17 @@ async def get_coretime(
             "core_time_2_period": student.core_time_2_period
         }
     except Exception as e:
-        logger.error(f"コアタイム取得エラー: {str(e)}")
+        logger.error("コアタイム取得エラー: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 #}}}
 
+#{{{ メトリクスAPI
+@app.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """ Prometheus 形式のメトリクス（このプロセスの分） """
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+#}}}
+
 # 静的ファイルの設定（最後にマウント）
 app.mount("/js", StaticFiles(directory="../public/js"), name="js")
 app.mount("/", StaticFiles(directory="../public", html=True), name="static")
-
-# Telegram設定
-class Settings(BaseSettings):
-    telegram_id: str
-    telegram_alert: str
-
-    class Config:
-        env_file = ".env"
-
-settings = Settings()
-
-async def send_telegram_message(message: str) -> bool:
-    """
-    Telegramにメッセージを送信する関数
-    """
-    try:
-        url = f"https://api.telegram.org/bot{settings.telegram_alert}/sendMessage"
-        data = {
-            "chat_id": settings.telegram_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-        logging.info(f"Telegram送信試行: URL={url}, データ={data}")
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data)
-            logging.info(f"Telegram送信レスポンス: {response.status_code} - {response.text}")
-            return response.status_code == 200
-    except Exception as e:
-        logging.error(f"Telegram送信エラー: {str(e)}")
-        return False
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Date
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Date, Float, Index, text
 from sqlalchemy.orm import relationship
 from db.database import Base
 from datetime import datetime
@@ -13,6 +13,7 @@ class Student(Base):
     core_time_2_day = Column(Integer, default=0)
     core_time_2_period = Column(Integer, default=0)
     core_time_violations = Column(Integer, default=0)
+    archived_violations = Column(Integer, nullable=False, default=0)  # アーカイブで本番から削除した違反の件数
 
     # リレーションシップ
     attendance_logs = relationship("AttendanceLog", back_populates="student")
@@ -27,6 +28,13 @@ class AttendanceLog(Base):
     entry_time = Column(DateTime)
     exit_time = Column(DateTime)
 
+    # インデックス（db/migrations.py と対応）
+    __table_args__ = (
+        Index("ix_attendance_logs_student_entry", "student_id", "entry_time"),
+        Index("ix_attendance_logs_entry_time", "entry_time"),
+        Index("ix_attendance_logs_open", "student_id", "entry_time", sqlite_where=text("exit_time IS NULL")),
+    )
+
     # リレーションシップ
     student = relationship("Student", back_populates="attendance_logs")
 
@@ -47,5 +55,78 @@ class Alert(Base):
     alert_date = Column(Date, nullable=False)
     alert_period = Column(Integer, nullable=False)
 
+    # 同じ学生・日付・時限のアラートは1件のみ（db/migrations.py と対応）
+    __table_args__ = (
+        Index("ux_alerts_student_date_period", "student_id", "alert_date", "alert_period", unique=True),
+    )
+
     # リレーションシップ
-    student = relationship("Student", back_populates="alerts") 
\ No newline at end of file
+    student = relationship("Student", back_populates="alerts") 
+
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    id = Column(Integer, primary_key=True)
+    message = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.now, index=True)
+    sent_at = Column(DateTime)
+    last_error = Column(String)
+
+class DailyPresence(Base):
+    __tablename__ = "daily_presence"
+
+    # 学生ごと・日付ごとの在室秒数（退室時に加算、日付をまたぐ記録は日ごとに分割）
+    student_id = Column(String, ForeignKey("students.student_id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    seconds = Column(Float, nullable=False, default=0)
+
+class CoreTimePeriod(Base):
+    __tablename__ = "core_time_periods"
+
+    # 時限の時間帯（HH:MM）。コアタイムの充足率の計算に使う
+    period = Column(Integer, primary_key=True)
+    start_time = Column(String, nullable=False)
+    end_time = Column(String, nullable=False)
+    check_time = Column(String)  # コアタイムチェックの時刻（HH:MM、NULL はチェックしない）
+
+class Lease(Base):
+    __tablename__ = "leases"
+
+    # 名前ごとに1つの所有者だけが expires_at まで保持できるリース
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class JobRun(Base):
+    __tablename__ = "job_runs"
+
+    job = Column(String, primary_key=True)
+    scheduled_at = Column(DateTime, primary_key=True)
+    owner = Column(String)
+    status = Column(String, nullable=False)  # done / missed
+    started_at = Column(DateTime)
+    detail = Column(String)
+
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    # テーブルごとの変更回数（書き込みのたびにトリガーで加算、db/migrations.py と対応）
+    table_name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class Archive(Base):
+    __tablename__ = "archives"
+
+    # 締めた年度のアーカイブファイル（db/archive.py、db/migrations.py と対応）
+    year = Column(Integer, primary_key=True)
+    path = Column(String, nullable=False)  # データベースのディレクトリからの相対パス
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)  # 翌年度の初日（この日を含まない）
+    attendance_logs = Column(Integer, nullable=False, default=0)
+    alerts = Column(Integer, nullable=False, default=0)
+    daily_presence = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime, nullable=False)
+    purged_at = Column(DateTime)
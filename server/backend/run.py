@@ -1,4 +1,5 @@
+# 開発用（ファイルの変更で自動的に再起動する1プロセス）。本番は gunicorn -c gunicorn.conf.py main:app
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, timeout_graceful_shutdown=5) 
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime, date
 from typing import Optional, List
 
@@ -37,6 +37,17 @@ class AttendanceResponse(BaseModel):
     name: str
     status: str
 
+class AttendanceBatchCreate(BaseModel):
+    events: List[AttendanceLogCreate] = Field(..., max_length=1000)
+
+class AttendanceBatchResult(BaseModel):
+    index: int
+    student_id: str
+    time: datetime
+    name: Optional[str] = None
+    status: str  # 入室 / 退室 / duplicate / error
+    detail: Optional[str] = None
+
 # CurrentStatus schemas
 class CurrentStatusBase(BaseModel):
     student_id: str
@@ -64,6 +75,36 @@ class Alert(AlertBase):
     class Config:
         orm_mode = True
 
+# Dashboard schemas
+class DashboardStudent(StudentBase):
+    is_present: bool
+    entry_time: Optional[datetime] = None
+    weekly_hours: float
+
+class DashboardSummary(BaseModel):
+    week_start: datetime
+    students: List[DashboardStudent]
+
+# CoreTime compliance schemas
+class CoreTimeSlotCompliance(BaseModel):
+    student_id: str
+    name: str
+    date: date
+    period: int
+    window_start: datetime
+    window_end: datetime
+    covered_seconds: float
+    coverage_ratio: float
+    late_seconds: Optional[float] = None
+    early_departure_seconds: Optional[float] = None
+    compliant: bool
+
+class CoreTimeCompliance(BaseModel):
+    start: date
+    end: date
+    min_coverage: float
+    slots: List[CoreTimeSlotCompliance]
+
 # CoreTime schemas
 class CoreTimeUpdate(BaseModel):
     core_time_1_day: int
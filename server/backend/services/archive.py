@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+年度ごとのアーカイブの読み出し（ATTACH と UNION ALL による振り分け）
+
+締めた年度の出席記録・アラート・日ごとの在室時間は db/archive.py でアーカイブファイル
+（db/archive/Attendance{年度}.db）に移し、本番のデータベースには今の年度の分だけを残します。
+
+- attach_archives: レポート用の接続（services/reporting.py）を開くときに、archives テーブルに
+  登録されたアーカイブを読み取り専用で ATTACH する（スキーマ名 archive_{年度}）。
+  archives が更新されると接続を開き直して付け直す
+- history_source: モデルの代わりに使う「本番 + 期間の重なるアーカイブ」の UNION ALL。
+  期間の重ならない年度は読まない。アーカイブがなければモデルをそのまま返す（SQL は変わらない）
+
+アーカイブの登録から本番のデータベースからの削除が終わるまでの間は、同じ行が両方にあります。
+本番側はアーカイブの期間内でアーカイブにある行（主キーが一致する行）を除いて読むので、重複しません。
+"""
+import logging
+import os
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import Column, DateTime, MetaData, Table, and_, event, exists, not_, select, union_all
+from sqlalchemy.exc import DisconnectionError
+from sqlalchemy.orm import Session, aliased
+
+from models.models import AttendanceLog, Alert, DailyPresence
+
+logger = logging.getLogger(__name__)
+
+# アーカイブするテーブル -> 年度の振り分けに使う列
+PARTITION_COLUMNS = {
+    AttendanceLog.__tablename__: "entry_time",
+    Alert.__tablename__: "alert_date",
+    DailyPresence.__tablename__: "date",
+}
+
+
+@dataclass(frozen=True)
+class AttachedArchive:
+    year: int
+    schema: str       # ATTACH したスキーマ名
+    start_date: date  # 年度の初日
+    end_date: date    # 翌年度の初日（この日を含まない）
+
+
+def archive_schema(year: int) -> str:
+    return f"archive_{int(year)}"
+
+
+#{{{ ATTACH
+def archives_version(dbapi_connection) -> Optional[int]:
+    """ archives テーブルのバージョン（マイグレーション前は None） """
+    try:
+        row = dbapi_connection.execute("SELECT version FROM data_versions WHERE table_name = 'archives'").fetchone()
+    except Exception:
+        return None
+    return row[0] if row else None
+
+
+def attach_archives(dbapi_connection, base_dir: str) -> List[AttachedArchive]:
+    """
+    archives に登録されたアーカイブを読み取り専用で ATTACH する
+    アーカイブは置き換えるまで変更されないので immutable で開く（ロックを取らない）。接続は URI ファイル名が有効なこと
+    """
+    try:
+        rows = dbapi_connection.execute(
+            "SELECT year, path, start_date, end_date FROM archives ORDER BY year"
+        ).fetchall()
+    except Exception:
+        return []  # マイグレーション前
+    attached = []
+    for year, path, start_date, end_date in rows:
+        full_path = os.path.join(base_dir, path)
+        try:
+            dbapi_connection.execute(
+                f"ATTACH DATABASE ? AS {archive_schema(year)}", (f"file:{full_path}?mode=ro&immutable=1",)
+            )
+        except Exception as e:
+            # ファイルがない・ATTACH の上限（既定 10）を超えた場合など。その年度はアーカイブなしとして読む
+            logger.error("アーカイブを開けませんでした: %s年度 %s: %s", year, full_path, e)
+            continue
+        attached.append(AttachedArchive(year, archive_schema(year), date.fromisoformat(start_date), date.fromisoformat(end_date)))
+    return attached
+
+
+def register_attach_events(engine, base_dir: str):
+    """
+    接続時にアーカイブを ATTACH し、チェックアウト時に archives が変わっていれば接続を開き直すイベントを登録する
+    ATTACH した一覧は接続の info["archives"] に入れる
+    """
+
+    @event.listens_for(engine, "connect")
+    def _attach(dbapi_connection, connection_record):
+        connection_record.info["archives_version"] = archives_version(dbapi_connection)
+        connection_record.info["archives"] = attach_archives(dbapi_connection, base_dir)
+
+    @event.listens_for(engine, "checkout")
+    def _check(dbapi_connection, connection_record, connection_proxy):
+        if archives_version(dbapi_connection) != connection_record.info.get("archives_version"):
+            # プールはこの接続を捨てて新しい接続で再試行する
+            raise DisconnectionError("archives changed")
+
+    return engine
+#}}}
+
+
+#{{{ 振り分け
+_archive_tables: Dict[Tuple[str, str], Table] = {}
+
+
+def archive_table(table: Table, schema: str) -> Table:
+    """ アーカイブのスキーマ内の同じ構成のテーブル """
+    key = (schema, table.name)
+    if key not in _archive_tables:
+        _archive_tables[key] = Table(
+            table.name, MetaData(schema=schema),
+            *[Column(column.name, column.type, primary_key=column.primary_key) for column in table.columns]
+        )
+    return _archive_tables[key]
+
+
+def attached_archives(db: Union[Session, object]) -> List[AttachedArchive]:
+    """ セッション（または Connection）の接続に ATTACH されているアーカイブ """
+    connection = db.connection() if isinstance(db, Session) else db
+    return connection.info.get("archives", [])
+
+
+def _as_date(value: Union[date, datetime, None]) -> Optional[date]:
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _bound(column, value: date):
+    return datetime.combine(value, datetime.min.time()) if isinstance(column.type, DateTime) else value
+
+
+def history_source(db, model, start: Union[date, datetime, None] = None, end: Union[date, datetime, None] = None):
+    """
+    model（AttendanceLog / Alert / DailyPresence）の代わりに使う、本番と start～end（両端を含む、None は制限なし）に
+    重なるアーカイブの UNION ALL。model と同じ属性名で使える
+    """
+    table = model.__table__
+    start, end = _as_date(start), _as_date(end)
+    archives = [
+        archive for archive in attached_archives(db)
+        if (end is None or archive.start_date <= end) and (start is None or archive.end_date > start)
+    ]
+    if not archives:
+        return model
+
+    # 本番とアーカイブのテーブル名は同じなので別名を付ける
+    main = table.alias("main_" + table.name)
+    column = main.c[PARTITION_COLUMNS[table.name]]
+    keys = [main.c[key.name] for key in table.primary_key.columns]
+    # 本番側: アーカイブの期間内でアーカイブに移した行は除く（削除が終わるまでの重複を防ぐ）
+    hot = select(*main.c)
+    members = []
+    for archive in archives:
+        archived = archive_table(table, archive.schema).alias(archive.schema + "_" + table.name)
+        hot = hot.where(not_(and_(
+            column >= _bound(column, archive.start_date),
+            column < _bound(column, archive.end_date),
+            exists().where(*[archived.c[key.name] == key for key in keys]),
+        )))
+        members.append(select(*archived.c))
+    return aliased(model, union_all(hot, *members).subquery(table.name))
+#}}}
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+入退室記録の一括取り込み
+
+キオスクがオフライン中に溜めたタッチをまとめて受け取り、
+学生ごとに時刻順で入室/退室を切り替えながら1トランザクションで記録します。
+入室/退室の判定は POST /api/attendance/ と同じです。
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert, or_
+from sqlalchemy.orm import Session
+
+from models.models import Student, AttendanceLog, CurrentStatus
+from services.daily_presence import rollup_statement
+
+
+def apply_attendance_batch(db: Session, events: Sequence) -> Tuple[List[Dict], Dict[str, Optional[datetime]]]:
+    """
+    events（student_id と time を持つオブジェクトの列）を記録する（コミットは呼び出し側で行う）
+    戻り値: (入力順の結果のリスト, 入室状況が変わった学生の {学籍番号: 入室時刻 or None})
+    """
+    results: List[Optional[Dict]] = [None] * len(events)
+    student_ids = {event.student_id for event in events}
+
+    # 対象学生・入室状況・未退室の記録・既に記録済みの時刻をまとめて取得
+    names = dict(db.query(Student.student_id, Student.name).filter(
+        Student.student_id.in_(student_ids)
+    ).all())
+    initial = dict(db.query(CurrentStatus.student_id, CurrentStatus.entry_time).filter(
+        CurrentStatus.student_id.in_(student_ids)
+    ).all())
+    open_logs = {}
+    for log in db.query(AttendanceLog).filter(
+        AttendanceLog.student_id.in_(list(initial)),
+        AttendanceLog.exit_time.is_(None)
+    ).order_by(AttendanceLog.entry_time):
+        open_logs[log.student_id] = log  # 最新の記録が残る
+    times = {event.time for event in events}
+    recorded = set()
+    for student_id, entry_time, exit_time in db.query(
+        AttendanceLog.student_id, AttendanceLog.entry_time, AttendanceLog.exit_time
+    ).filter(
+        AttendanceLog.student_id.in_(student_ids),
+        or_(AttendanceLog.entry_time.in_(times), AttendanceLog.exit_time.in_(times))
+    ):
+        recorded.add((student_id, entry_time))
+        recorded.add((student_id, exit_time))
+
+    # 学生ごとに時刻順で入室/退室を切り替える
+    present = dict(initial)
+    finished = []  # 退室した (学籍番号, 入室時刻, 退室時刻)
+    new_logs = []  # 追加する記録（最後に1回の executemany で INSERT する）
+    order = sorted(range(len(events)), key=lambda i: (events[i].student_id, events[i].time))
+    for i in order:
+        event = events[i]
+        result = {
+            "index": i,
+            "student_id": event.student_id,
+            "time": event.time,
+            "name": names.get(event.student_id),
+        }
+        results[i] = result
+
+        if event.student_id not in names:
+            result.update(status="error", detail="Student not found")
+            continue
+        # 再送などで同じ時刻のタッチが既に記録されている場合は無視
+        if (event.student_id, event.time) in recorded:
+            result.update(status="duplicate", detail="Already recorded")
+            continue
+        recorded.add((event.student_id, event.time))
+
+        if event.student_id not in present:
+            # 入室処理
+            log = {"student_id": event.student_id, "entry_time": event.time, "exit_time": None}
+            new_logs.append(log)
+            open_logs[event.student_id] = log
+            present[event.student_id] = event.time
+            result["status"] = "入室"
+        else:
+            # 退室処理
+            log = open_logs.pop(event.student_id, None)
+            if isinstance(log, dict):
+                log["exit_time"] = event.time
+                finished.append((event.student_id, log["entry_time"], event.time))
+            elif log is not None:
+                log.exit_time = event.time
+                finished.append((event.student_id, log.entry_time, event.time))
+            del present[event.student_id]
+            result["status"] = "退室"
+
+    # ORM で1件ずつ INSERT すると SQLite では RETURNING id のために1行ずつ実行されるため、ID を使わない新しい記録はまとめて追加する
+    if new_logs:
+        db.execute(insert(AttendanceLog), new_logs)
+
+    # 日ごとの在室時間にまとめて加算
+    rollup = rollup_statement(finished)
+    if rollup is not None:
+        db.execute(rollup)
+
+    # current_status は最終状態だけを反映する
+    changed = {
+        student_id: present.get(student_id)
+        for student_id in student_ids
+        if present.get(student_id) != initial.get(student_id)
+    }
+    if changed:
+        db.query(CurrentStatus).filter(
+            CurrentStatus.student_id.in_(list(changed))
+        ).delete(synchronize_session=False)
+        entries = [
+            {"student_id": student_id, "entry_time": entry_time}
+            for student_id, entry_time in changed.items() if entry_time is not None
+        ]
+        if entries:
+            db.execute(insert(CurrentStatus), entries)
+
+    return results, changed
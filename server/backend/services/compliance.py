@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+コアタイムの充足状況（区間ベース）
+
+コアタイムの各コマ（曜日・時限）を core_time_periods の時間帯として実際の時間区間にし、
+出席記録の在室区間と突き合わせます。チェック時刻の1点だけを見るのではなく、
+コマの時間帯のうち在室していた割合（充足率）・遅刻・早退を学生ごと・コマごとに求めます。
+
+出席記録は対象学生・期間の分を (学籍番号, 入室時刻) 順に1回のクエリで読み、
+学生ごとに在室区間とコマをそれぞれ時刻順に並べて1回ずつ走査（スイープ）します。
+"""
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from models.models import Student, AttendanceLog, CoreTimePeriod
+from services.archive import history_source
+
+Interval = Tuple[datetime, datetime]
+
+
+@dataclass
+class SlotCompliance:
+    student_id: str
+    name: str
+    date: date
+    period: int
+    window_start: datetime
+    window_end: datetime
+    covered_seconds: float
+    coverage_ratio: float
+    late_seconds: Optional[float]             # 最初に在室した時刻 - 開始時刻（在室なしは None）
+    early_departure_seconds: Optional[float]  # 終了時刻 - 最後に在室した時刻（在室なしは None）
+    compliant: bool
+
+
+def load_periods(db: Session) -> Dict[int, Tuple[time, time]]:
+    """ 時限 -> (開始時刻, 終了時刻) """
+    return {
+        period: (time.fromisoformat(start_time), time.fromisoformat(end_time))
+        for period, start_time, end_time in db.query(
+            CoreTimePeriod.period, CoreTimePeriod.start_time, CoreTimePeriod.end_time
+        )
+    }
+
+
+def merge_intervals(intervals: List[Interval]) -> List[Interval]:
+    """ 開始時刻順の区間のうち重なる・接するものを結合する """
+    merged: List[Interval] = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def sweep(windows: List[Interval], intervals: List[Interval]):
+    """
+    開始時刻順のコマの区間 windows と、結合済みの在室区間 intervals を走査し、
+    コマごとに (在室秒数, 最初に在室した時刻, 最後に在室した時刻) を返す
+    """
+    results = []
+    i = 0
+    for window_start, window_end in windows:
+        # このコマより前に終わる在室区間は以降のコマにも関係しないので読み飛ばす
+        while i < len(intervals) and intervals[i][1] <= window_start:
+            i += 1
+        covered = 0.0
+        first = last = None
+        j = i
+        while j < len(intervals) and intervals[j][0] < window_end:
+            start = max(intervals[j][0], window_start)
+            end = min(intervals[j][1], window_end)
+            if start < end:
+                covered += (end - start).total_seconds()
+                first = start if first is None else first
+                last = end
+            j += 1
+        results.append((covered, first, last))
+    return results
+
+
+def evaluate_compliance(
+    db: Session,
+    start: date,
+    end: date,
+    student_id: Optional[str] = None,
+    min_coverage: float = 0.8,
+    now: Optional[datetime] = None,
+) -> List[SlotCompliance]:
+    """
+    start～end（両端を含む）のうち終了済みのコマについて、学生ごとの充足状況を返す
+    在室中（未退室）の記録は now まで在室していたものとして扱う
+    """
+    now = now or datetime.now()
+    periods = load_periods(db)
+
+    query = db.query(Student).filter(or_(Student.core_time_1_day > 0, Student.core_time_2_day > 0))
+    if student_id is not None:
+        query = query.filter(Student.student_id == student_id)
+    students = query.order_by(Student.student_id).all()
+
+    # 学生ごとのコマの時間区間（開始時刻順）
+    windows: Dict[str, List[Tuple[datetime, datetime, int]]] = {}
+    day = start
+    while day <= end:
+        weekday = day.weekday() + 1  # 1:月曜 2:火曜 ... 7:日曜
+        for student in students:
+            for slot_day, period in (
+                (student.core_time_1_day, student.core_time_1_period),
+                (student.core_time_2_day, student.core_time_2_period),
+            ):
+                if slot_day != weekday or period not in periods:
+                    continue
+                window_start = datetime.combine(day, periods[period][0])
+                window_end = datetime.combine(day, periods[period][1])
+                if window_end <= now:
+                    windows.setdefault(student.student_id, []).append((window_start, window_end, period))
+        day += timedelta(days=1)
+    if not windows:
+        return []
+
+    # 対象期間に重なる在室区間を学生・入室時刻順にまとめて取得
+    range_start = min(window_start for slots in windows.values() for window_start, _, _ in slots)
+    range_end = max(window_end for slots in windows.values() for _, window_end, _ in slots)
+    intervals: Dict[str, List[Interval]] = {}
+    # 締めた年度のアーカイブが ATTACH されていれば期間の重なる分も読む
+    # 日付をまたぐ在室（前日の入室）も含めるため1日広げる
+    logs = history_source(db, AttendanceLog, range_start - timedelta(days=1), range_end)
+    for sid, entry_time, exit_time in db.query(
+        logs.student_id, logs.entry_time, logs.exit_time
+    ).filter(
+        logs.student_id.in_(list(windows)),
+        logs.entry_time < range_end,
+        or_(logs.exit_time.is_(None), logs.exit_time > range_start)
+    ).order_by(logs.student_id, logs.entry_time):
+        exit_time = exit_time or now
+        if exit_time > entry_time:
+            intervals.setdefault(sid, []).append((entry_time, exit_time))
+
+    names = {student.student_id: student.name for student in students}
+    results: List[SlotCompliance] = []
+    for sid in sorted(windows):
+        slots = sorted(windows[sid])
+        swept = sweep([(s, e) for s, e, _ in slots], merge_intervals(intervals.get(sid, [])))
+        for (window_start, window_end, period), (covered, first, last) in zip(slots, swept):
+            ratio = covered / (window_end - window_start).total_seconds()
+            results.append(SlotCompliance(
+                student_id=sid,
+                name=names[sid],
+                date=window_start.date(),
+                period=period,
+                window_start=window_start,
+                window_end=window_end,
+                covered_seconds=covered,
+                coverage_ratio=round(ratio, 4),
+                late_seconds=None if first is None else (first - window_start).total_seconds(),
+                early_departure_seconds=None if last is None else (window_end - last).total_seconds(),
+                compliant=ratio >= min_coverage,
+            ))
+    return results
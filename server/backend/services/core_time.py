@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+コアタイムチェックのエンジン
+
+学生ごとにクエリとコミットを繰り返すのではなく、
+不在者の抽出・アラートの一括登録・違反回数の再計算を数本のSQLで行います。
+コミットは呼び出し側で1回だけ行ってください。
+"""
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy import and_, func, insert, or_
+from sqlalchemy.orm import Session
+
+from models.models import Student, CurrentStatus, Alert
+from services.metrics import CORE_TIME_CHECK_SECONDS
+
+
+@dataclass
+class CoreTimeCheckResult:
+    violations: List[str] = field(default_factory=list)          # 不在だった学生の学籍番号
+    new_alerts: List[Tuple[str, str]] = field(default_factory=list)  # 新規に記録した (学籍番号, 氏名)
+    updated_students: List[Dict] = field(default_factory=list)   # 更新後の違反回数
+
+
+def scheduled_filter(day: int, period: int):
+    """ 指定曜日・時限がコアタイムに設定されている学生の条件式 """
+    return or_(
+        and_(Student.core_time_1_day == day, Student.core_time_1_period == period),
+        and_(Student.core_time_2_day == day, Student.core_time_2_period == period)
+    )
+
+
+def violation_message(student_id: str, name: str, now: datetime, period: int) -> str:
+    """ 新規の違反を知らせる通知の本文 """
+    return (
+        f"⚠️ コアタイム違反の通知\n\n"
+        f"学籍番号: {student_id}\n"
+        f"氏名: {name}\n"
+        f"違反日時: {now.strftime('%Y-%m-%d')} {period}限目"
+    )
+
+
+def run_core_time_check(db: Session, period: int, now: datetime) -> CoreTimeCheckResult:
+    """
+    指定時限のコアタイムチェックを1トランザクション分のSQLとして実行する
+    """
+    started = time.perf_counter()
+    day = now.weekday() + 1  # 1:月曜 2:火曜 ... 7:日曜
+    alert_date = now.date()
+    scheduled = scheduled_filter(day, period)
+    result = CoreTimeCheckResult()
+
+    # 不在の学生を current_status との反結合で抽出し、同日同時限のアラートの有無も同時に取得
+    absent = db.query(Student.student_id, Student.name, Alert.id).outerjoin(
+        CurrentStatus, CurrentStatus.student_id == Student.student_id
+    ).outerjoin(
+        Alert, and_(
+            Alert.student_id == Student.student_id,
+            Alert.alert_date == alert_date,
+            Alert.alert_period == period
+        )
+    ).filter(
+        scheduled,
+        CurrentStatus.student_id.is_(None)
+    ).order_by(Student.student_id).all()
+
+    names = {}
+    alerted = {}
+    for student_id, name, alert_id in absent:
+        names[student_id] = name
+        alerted[student_id] = alerted.get(student_id, False) or alert_id is not None
+    result.violations = list(names)
+    candidates = [student_id for student_id in names if not alerted[student_id]]
+
+    # 未記録のアラートを一括登録（一意制約により同時実行時の重複は無視される）
+    # 通知するのは実際に登録できた行だけ（同時に走った別のチェックが先に登録した学生は含めない）
+    if candidates:
+        inserted = set(db.execute(
+            insert(Alert).prefix_with("OR IGNORE").returning(Alert.student_id),
+            [
+                {"student_id": student_id, "alert_date": alert_date, "alert_period": period}
+                for student_id in candidates
+            ]
+        ).scalars().all())
+        result.new_alerts = [(student_id, names[student_id]) for student_id in candidates if student_id in inserted]
+
+    # 対象学生の違反回数を1回のUPDATEで再計算（アーカイブで本番から削除した分は archived_violations に残っている）
+    violation_count = db.query(func.count(Alert.id)).filter(
+        Alert.student_id == Student.student_id
+    ).scalar_subquery()
+    db.query(Student).filter(scheduled).update(
+        {Student.core_time_violations: Student.archived_violations + violation_count},
+        synchronize_session=False
+    )
+
+    result.updated_students = [
+        {"student_id": student_id, "core_time_violations": count}
+        for student_id, count in db.query(
+            Student.student_id, Student.core_time_violations
+        ).filter(scheduled).order_by(Student.student_id).all()
+    ]
+    CORE_TIME_CHECK_SECONDS.observe(time.perf_counter() - started, str(period))
+    return result
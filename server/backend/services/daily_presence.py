@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+日ごとの在室時間（daily_presence）の集計
+
+退室を記録するたびに、その入退室の在室秒数を (学籍番号, 日付) の行へ加算します。
+日付をまたいだ記録は0時で分割してそれぞれの日に加算します。
+週・月の利用時間は出席記録を走査せず、この表の日数分の行を合計するだけで求められます。
+
+集計がずれた場合は出席記録から作り直せます（server/backend で実行）:
+    python -m services.daily_presence --rebuild
+"""
+import argparse
+import sqlite3
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, List, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+
+from db.migrations import DAILY_PRESENCE_ROLLUP_SQL
+from models.models import DailyPresence
+
+
+def split_by_day(entry_time: datetime, exit_time: datetime) -> List[Tuple[date, float]]:
+    """ 入室～退室を0時で分割し、[(日付, 秒数)] を返す（退室が入室以前なら空） """
+    parts = []
+    start = entry_time
+    while start < exit_time:
+        midnight = datetime.combine(start.date() + timedelta(days=1), time.min)
+        finish = min(midnight, exit_time)
+        parts.append((start.date(), (finish - start).total_seconds()))
+        start = finish
+    return parts
+
+
+def rollup_statement(sessions: Iterable[Tuple[str, datetime, datetime]]):
+    """
+    (学籍番号, 入室時刻, 退室時刻) の列を daily_presence に加算する UPSERT 文を返す
+    加算するものがなければ None（同期・非同期どちらのセッションでも execute できる）
+    """
+    totals = {}
+    for student_id, entry_time, exit_time in sessions:
+        if entry_time is None or exit_time is None:
+            continue
+        for day, seconds in split_by_day(entry_time, exit_time):
+            totals[(student_id, day)] = totals.get((student_id, day), 0.0) + seconds
+    if not totals:
+        return None
+
+    stmt = insert(DailyPresence).values([
+        {"student_id": student_id, "date": day, "seconds": seconds}
+        for (student_id, day), seconds in totals.items()
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[DailyPresence.student_id, DailyPresence.date],
+        set_={"seconds": DailyPresence.seconds + stmt.excluded.seconds}
+    )
+
+
+def week_start(today: date) -> datetime:
+    """ today を含む週の開始（日曜日0時） """
+    return datetime.combine(today - timedelta(days=(today.weekday() + 1) % 7), time.min)
+
+
+def weekly_seconds(student_ids: Iterable[str], since: date):
+    """ 学生ごとの since 以降の在室秒数の合計を返す SELECT 文（同期・非同期どちらでも execute できる） """
+    return select(
+        DailyPresence.student_id, func.sum(DailyPresence.seconds)
+    ).where(
+        DailyPresence.student_id.in_(list(student_ids)),
+        DailyPresence.date >= since
+    ).group_by(DailyPresence.student_id)
+
+
+def rebuild(conn: sqlite3.Connection) -> int:
+    """ daily_presence を出席記録から作り直し、行数を返す """
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM daily_presence")
+            conn.execute(DAILY_PRESENCE_ROLLUP_SQL)
+            count = conn.execute("SELECT COUNT(*) FROM daily_presence").fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+    return count
+
+
+def main():
+    from db.database import DB_PATH
+
+    parser = argparse.ArgumentParser(description="日ごとの在室時間の集計")
+    parser.add_argument("--db", default=DB_PATH, help="データベースファイルのパス")
+    parser.add_argument("--rebuild", action="store_true", help="出席記録から集計を作り直す")
+    args = parser.parse_args()
+
+    if not args.rebuild:
+        parser.print_help()
+        return
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        count = rebuild(conn)
+    finally:
+        conn.close()
+    print(f"daily_presence を作り直しました: {count} 行")
+
+
+if __name__ == "__main__":
+    main()
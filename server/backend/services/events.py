@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+ダッシュボード向けのイベント配信（Server-Sent Events）
+
+入退室・コアタイム違反のイベントをプロセス内のハブから購読中の全クライアントへ配信します。
+publish はどのスレッドからでも呼べます（同期エンドポイント・スケジューラのスレッドなど）。
+
+クライアントごとのバッファは buffer_size 件までです。読み出しの遅いクライアントで
+あふれた場合はバッファを捨てて resync イベントを送り、一覧の再読み込みを促します。
+サーバーの停止を妨げないよう、1つの接続は max_age 秒で閉じます（EventSource は自動で再接続します）。
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from typing import AsyncIterator, Optional, Set
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, buffer_size: int):
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.dropped = 0
+
+    def offer(self, message: str):
+        """ イベントループのスレッドで呼ばれる """
+        if self.queue.full():
+            # 追いつけないクライアントには差分ではなく再読み込みを指示する
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(format_event("resync", {"reason": "buffer overflow"}))
+            return
+        self.queue.put_nowait(message)
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """ SSE の1イベント分の文字列 """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, default=str))
+    return "\n".join(lines) + "\n\n"
+
+
+class EventHub:
+    def __init__(self, buffer_size: int = 100, heartbeat: float = 15.0, retry_ms: int = 3000, max_age: float = 300.0):
+        self.buffer_size = buffer_size
+        self.heartbeat = heartbeat
+        self.retry_ms = retry_ms
+        self.max_age = max_age
+        self._subscribers: Set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def subscribe(self) -> Subscriber:
+        """ イベントループ上で呼び出す """
+        subscriber = Subscriber(asyncio.get_running_loop(), self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event: str, data: dict):
+        """ 全購読者にイベントを配信する（どのスレッドからでも呼び出し可、待たない） """
+        with self._lock:
+            message = format_event(event, data, next(self._ids))
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, message)
+            except RuntimeError:
+                # イベントループが既に終了している
+                self.unsubscribe(subscriber)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """ 購読してイベントを SSE として返し続ける（切断時に購読を解除する） """
+        subscriber = self.subscribe()
+        deadline = time.monotonic() + self.max_age
+        try:
+            yield f"retry: {self.retry_ms}\n\n"
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), timeout=min(self.heartbeat, remaining))
+                except asyncio.TimeoutError:
+                    # プロキシにアイドル接続として切られないようコメント行を送る
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+# アプリ全体で共有するハブ
+hub = EventHub()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+出席記録・コアタイム違反のエクスポート
+
+期間（と学籍番号）で絞り込んだ行をDBから一定件数ずつ読み、CSV または NDJSON の
+チャンクとして順に返すジェネレータです。StreamingResponse にそのまま渡せます。
+全件をメモリに載せないため、期間の長さに関係なくメモリ使用量は一定です。
+
+リクエストのセッションとは別に、ジェネレータ自身がエンジンから接続を開いて閉じます。
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, time, timedelta
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from models.models import Student, AttendanceLog, Alert
+
+# 1回に読み込んでチャンクにする行数
+CHUNK_ROWS = 1000
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def attendance_query(start: Optional[date], end: Optional[date], student_id: Optional[str], logs=AttendanceLog):
+    """
+    入室日が start～end（両端を含む）の出席記録を入室時刻順に返すクエリ
+    logs にはアーカイブを含めて読む場合の history_source（services/archive.py）を渡す
+    """
+    query = select(
+        logs.id,
+        logs.student_id,
+        Student.name,
+        logs.entry_time,
+        logs.exit_time,
+    ).outerjoin(Student, Student.student_id == logs.student_id)
+    if start is not None:
+        query = query.where(logs.entry_time >= datetime.combine(start, time.min))
+    if end is not None:
+        query = query.where(logs.entry_time < datetime.combine(end + timedelta(days=1), time.min))
+    if student_id is not None:
+        query = query.where(logs.student_id == student_id)
+    # entry_time のインデックスは (entry_time, rowid) 順なので並べ替えは発生しない（本番のみの場合）
+    return query.order_by(logs.entry_time, logs.id)
+
+
+def alerts_query(start: Optional[date], end: Optional[date], student_id: Optional[str], alerts=Alert):
+    """ 違反日が start～end（両端を含む）のコアタイム違反を日付・時限順に返すクエリ（alerts は attendance_query の logs と同じ） """
+    query = select(
+        alerts.id,
+        alerts.student_id,
+        Student.name,
+        alerts.alert_date,
+        alerts.alert_period,
+    ).outerjoin(Student, Student.student_id == alerts.student_id)
+    if start is not None:
+        query = query.where(alerts.alert_date >= start)
+    if end is not None:
+        query = query.where(alerts.alert_date <= end)
+    if student_id is not None:
+        query = query.where(alerts.student_id == student_id)
+    return query.order_by(alerts.alert_date, alerts.alert_period, alerts.id)
+
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_chunk(rows, header=None) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header is not None:
+        writer.writerow(header)
+    writer.writerows([("" if v is None else _value(v)) for v in row] for row in rows)
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(columns, rows) -> str:
+    return "".join(
+        json.dumps(dict(zip(columns, (_value(v) for v in row))), ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+def stream_rows(engine: Engine, query, fmt: str = "csv", gzip: bool = False) -> Iterator[bytes]:
+    """
+    query の結果を fmt（csv / ndjson）のバイト列チャンクとして順に返す
+    query は接続を受け取ってクエリを返す関数でもよい（接続に ATTACH されたアーカイブに合わせて作る場合）
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    compressor = zlib.compressobj(wbits=31) if gzip else None  # wbits=31 で gzip 形式
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    with engine.connect() as conn:
+        if callable(query):
+            query = query(conn)
+        result = conn.execution_options(yield_per=CHUNK_ROWS).execute(query)
+        columns = list(result.keys())
+        if fmt == "csv":
+            # Excel で日本語の氏名が文字化けしないよう BOM を付ける
+            yield encode("\ufeff" + _csv_chunk([], header=columns))
+        for rows in result.partitions():
+            if fmt == "csv":
+                chunk = encode(_csv_chunk(rows))
+            else:
+                chunk = encode(_ndjson_chunk(columns, rows))
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
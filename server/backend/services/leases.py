@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+DBのリース（複数ワーカー間の排他）
+
+uvicorn/gunicorn のワーカーが複数あっても、定期ジョブなどを1つのワーカーだけが
+実行するためのリースです。所有者は期限（expires_at）の前に acquire_lease を
+呼び直して延長し続けます。所有者が止まると期限切れ後に他のワーカーが引き継ぎます。
+"""
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, or_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from models.models import Lease
+
+
+def make_owner_id() -> str:
+    """ このプロセスを表す所有者ID（ホスト名:PID:ランダム） """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_lease(db: Session, name: str, owner: str, ttl: float, now: Optional[datetime] = None) -> bool:
+    """
+    リースを取得または延長し、取得できたかを返す（コミットは呼び出し側で行う）
+    期限切れか、自分が所有している場合のみ所有者と期限を書き換える
+    """
+    now = now or datetime.now()
+    stmt = insert(Lease).values(name=name, owner=owner, expires_at=now + timedelta(seconds=ttl))
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[Lease.name],
+        set_={"owner": stmt.excluded.owner, "expires_at": stmt.excluded.expires_at},
+        where=or_(Lease.expires_at < now, Lease.owner == owner)
+    ))
+    return db.query(Lease.owner).filter(Lease.name == name).scalar() == owner
+
+
+def release_lease(db: Session, name: str, owner: str):
+    """ 自分が所有しているリースを手放す（コミットは呼び出し側で行う） """
+    db.execute(delete(Lease).where(Lease.name == name, Lease.owner == owner))
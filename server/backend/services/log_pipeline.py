@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+ノンブロッキングのログ出力
+
+ログを出すスレッド（イベントループ・スレッドプール）ではレコードをキューに入れるだけにし、
+整形と書き込みは QueueListener のスレッドで行います。出力先（標準エラー・パイプ）が
+詰まっても、リクエストの処理はログの書き込みを待ちません。
+
+- 出力は1行1レコードの JSON（log_format="text" で従来の形式）
+- 同じ書式（ロガー名と msg）のメッセージは interval 秒あたり burst 件までにし、
+  超えた分は捨てて、次に出力するレコードの "suppressed" に捨てた件数を入れる（INFO 以下のみ。WARNING 以上は常に出す）
+- uvicorn のロガー（uvicorn.error / uvicorn.access）も同じキューに流す
+- httpx のロガーは WARNING 以上だけを出す（INFO のリクエストログの URL に Telegram のトークンが入るため）
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+# LogRecord の標準の属性（これ以外は extra として JSON に含める）
+# color_message は uvicorn が端末用に付ける属性
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "color_message"}
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+UVICORN_LOGGERS = ["uvicorn", "uvicorn.error", "uvicorn.access"]
+# httpx は INFO でリクエストの URL を出す（Telegram の URL にはボットのトークンが入る）ので WARNING 以上だけにする
+QUIET_LOGGERS = ["httpx"]
+
+_exception_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """ 1レコードを1行の JSON にする """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """ 同じ書式のメッセージを interval 秒あたり burst 件までに間引く """
+
+    def __init__(self, burst: int = 20, interval: float = 1.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows: Dict[Tuple[str, str], list] = {}  # (ロガー名, msg) -> [窓の開始時刻, 件数, 捨てた件数]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if len(self._windows) > 10000:
+                    # 書式の種類が増え続ける場合に備えて古い窓を捨てる
+                    self._windows = {k: w for k, w in self._windows.items() if now - w[0] < self.interval}
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """ キューがあふれた場合はログのために待たず、そのレコードを捨てる """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """ 引数の埋め込みと例外の文字列化だけを行う（整形は QueueListener 側の Formatter で行う） """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """ QueueHandler / QueueListener の組 """
+
+    def __init__(self, handler: logging.Handler, queue_size: int = 10000):
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.queue_handler = QueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, handler, respect_handler_level=True)
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def stop(self):
+        """ キューに残っているレコードを書き出してからスレッドを止める """
+        if self._started:
+            self.listener.stop()
+            self._started = False
+
+
+_pipeline: Optional[LogPipeline] = None
+
+
+@atexit.register
+def stop_logging():
+    """ 現在のパイプラインを止める（キューに残っているレコードは書き出す） """
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.stop()
+        _pipeline = None
+
+
+def setup_logging(level: str = "INFO", log_format: str = "json", burst: int = 20, interval: float = 1.0,
+                  stream=None) -> LogPipeline:
+    """
+    ルートロガーと uvicorn のロガーをキュー経由の出力に切り替え、パイプラインを返す
+    もう一度呼ぶと前のパイプラインを止めて設定し直す
+    """
+    global _pipeline
+    stop_logging()
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+    pipeline = LogPipeline(handler)
+    pipeline.queue_handler.addFilter(SamplingFilter(burst, interval))
+
+    root = logging.getLogger()
+    root.handlers = [pipeline.queue_handler]
+    root.setLevel(level)
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    pipeline.start()
+    _pipeline = pipeline
+    return pipeline
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus 形式のメトリクス
+
+外部ライブラリやサービスを使わず、プロセス内でカウンターとヒストグラムを集計し、
+/metrics でテキスト形式（exposition format 0.0.4）として返します。
+
+- http_request_duration_seconds: ルート（パスのテンプレート）ごとの応答時間（レスポンスヘッダーの送信まで）
+- db_statements_total / db_statement_duration_seconds: SQL文の実行回数と実行時間（SQLAlchemy のイベントで計測）
+- telegram_send_duration_seconds / telegram_send_failures_total: Telegram への送信時間と失敗数
+- core_time_check_duration_seconds: コアタイムチェックの実行時間
+
+集計はメトリクスごとのロックで数値を足すだけで、文字列への変換は /metrics の読み出し時に行います。
+値はプロセスごとです（複数ワーカーの場合はワーカーごとに集計されます）。
+"""
+import bisect
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SQL_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "WITH"}
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # charset は Response が付ける
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"] + self.samples()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}" for labels, value in values]
+
+
+class Gauge(Metric):
+    """ 読み出し時に関数を呼んで値を得るゲージ """
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, function: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.function = function
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {format_value(self.function())}"]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル -> [バケットごとの件数（累積前、最後は +Inf）, 合計, 件数]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels) -> int:
+        with self._lock:
+            entry = self._values.get(labels)
+            return entry[2] if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items())
+        lines = []
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics = [m for m in self._metrics if m.name != metric.name] + [metric]
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# アプリ全体で共有するレジストリとメトリクス
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response headers are sent",
+    ["method", "route", "status"]
+))
+DB_STATEMENTS = registry.register(Counter(
+    "db_statements_total", "SQL statements executed", ["operation"]
+))
+DB_STATEMENT_SECONDS = registry.register(Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ["operation"], SQL_BUCKETS
+))
+DB_ERRORS = registry.register(Counter(
+    "db_errors_total", "SQL statements that raised an error", ["operation"]
+))
+TELEGRAM_SEND_SECONDS = registry.register(Histogram(
+    "telegram_send_duration_seconds", "Telegram sendMessage latency", ["result"]
+))
+TELEGRAM_SEND_FAILURES = registry.register(Counter(
+    "telegram_send_failures_total", "Failed Telegram sends", ["reason"]
+))
+CORE_TIME_CHECK_SECONDS = registry.register(Histogram(
+    "core_time_check_duration_seconds", "Core time check duration", ["period"]
+))
+
+
+#{{{ SQL の計測
+def statement_operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    operation = words[0].upper() if words else ""
+    return operation if operation in SQL_OPERATIONS else "OTHER"
+
+
+def instrument_engine(engine):
+    """ エンジン（非同期エンジンは sync_engine）の SQL 実行を計測するイベントを登録する """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        operation = statement_operation(statement)
+        DB_STATEMENTS.inc(operation)
+        DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, operation)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        started = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        DB_ERRORS.inc(statement_operation(context.statement or ""))
+
+    return engine
+#}}}
+
+
+#{{{ HTTP の計測
+class MetricsMiddleware:
+    """
+    ルートごとの応答時間を計測する ASGI ミドルウェア
+    ラベルにはパスのテンプレート（/api/students/{student_id} など）を使い、
+    どのルートにも一致しないリクエスト（静的ファイルなど）は "other" にまとめる
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        responded = False
+
+        def observe(status):
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope["method"], getattr(route, "path", "other"), status)
+
+        async def send_wrapper(message):
+            nonlocal responded
+            if message["type"] == "http.response.start":
+                responded = True
+                observe(str(message["status"]))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            # 未処理の例外は外側のミドルウェアが 500 を返す
+            if not responded:
+                observe("500")
+            raise
+#}}}
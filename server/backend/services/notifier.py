@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+Telegram通知のアウトボックスと送信ワーカー
+
+通知はリクエストと同じトランザクションで notification_outbox に書き込み、
+送信はアプリのライフスパンで起動するワーカーが非同期に行います。
+ワーカーは1つの httpx.AsyncClient を使い回し、失敗時は指数バックオフで再送します。
+未送信の通知はテーブルに残るため、再起動後にそのまま送信されます。
+
+gunicorn などでワーカーが複数あっても、送信する通知は UPDATE で next_attempt_at を先に進めて
+取得する（claim）ので、同じ通知を2つのワーカーが送ることはありません。送信中にワーカーが止まった
+通知は claim_timeout 秒後に他のワーカー（または再起動後）が送り直します。
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from models.models import NotificationOutbox
+from services.metrics import TELEGRAM_SEND_SECONDS, TELEGRAM_SEND_FAILURES
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_notification(db: Session, message: str) -> NotificationOutbox:
+    """
+    通知をアウトボックスに追加する（コミットは呼び出し側で行う）
+    """
+    notification = NotificationOutbox(message=message)
+    db.add(notification)
+    return notification
+
+
+def enqueue_notifications(db: Session, messages: List[str]):
+    """
+    複数の通知を1回の executemany でアウトボックスに追加する（コミットは呼び出し側で行う）
+    ORM の add では SQLite の RETURNING のために1件ずつ INSERT されるため、件数の多いコアタイムチェックで使う
+    """
+    if messages:
+        db.execute(insert(NotificationOutbox), [{"message": message} for message in messages])
+
+
+class TelegramNotifier:
+    """
+    アウトボックスを読み出してTelegramに送信するワーカー
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        token: str,
+        chat_id: str,
+        api_base: str = "https://api.telegram.org",
+        batch_size: int = 20,
+        max_attempts: int = 8,
+        base_delay: float = 2.0,
+        max_delay: float = 600.0,
+        poll_interval: float = 30.0,
+        timeout: float = 10.0,
+        claim_timeout: float = 60.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.session_factory = session_factory
+        self.token = token
+        self.chat_id = chat_id
+        self.api_base = api_base
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.claim_timeout = claim_timeout  # 取得した通知を他のワーカーが送らない時間（送信のタイムアウトより長くする）
+        self.transport = transport
+        self.record_retries = 3
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    #{{{ ライフサイクル
+    async def start(self):
+        """ 共有クライアントを作成し、送信ループを起動する """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._client = httpx.AsyncClient(
+            base_url=self.api_base,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+            transport=self.transport,
+        )
+        self._task = asyncio.create_task(self._run())
+        logger.info("Telegram notifier started")
+
+    async def stop(self, drain_timeout: float = 0.0):
+        """
+        送信ループを停止し、クライアントを閉じる
+        drain_timeout 秒までは、送信時刻に達している通知を送り切ってから止める（残りはアウトボックスに残る）
+        送信中のバッチの途中で止めると、取得済みの通知が claim_timeout 秒の間だれにも送られなくなるため
+        """
+        if self._task is not None:
+            if drain_timeout > 0:
+                self._stopping = True
+                self._wake.set()
+                try:
+                    await asyncio.wait_for(self._task, timeout=drain_timeout)
+                except asyncio.TimeoutError:
+                    logger.warning("未送信の通知を残して停止します（%s秒以内に送り切れませんでした）", drain_timeout)
+                except asyncio.CancelledError:
+                    pass
+            else:
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        logger.info("Telegram notifier stopped")
+
+    def wake(self):
+        """ 新しい通知があることをワーカーに知らせる（どのスレッドからでも呼び出し可） """
+        if self._loop is None or self._wake is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            # イベントループが既に終了している
+            pass
+    #}}}
+
+    #{{{ 送信処理
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("通知ワーカーエラー: %s", e)
+                sent = 0
+
+            # バッチが埋まっていれば続けて送信し、そうでなければ次の通知か再送時刻まで待つ
+            if sent >= self.batch_size:
+                continue
+            self._wake.clear()
+            if self._stopping:
+                # 停止中は送信時刻に達した通知がなくなるまで続ける
+                if sent == 0:
+                    return
+                continue
+            try:
+                delay = await asyncio.to_thread(self._next_due_delay)
+            except Exception:
+                delay = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def drain_once(self) -> int:
+        """
+        送信時刻に達した通知を1バッチ分取得して送信し、処理した件数を返す
+        """
+        due = await asyncio.to_thread(self._claim_due)
+        for notification_id, message, attempts in due:
+            ok, error, retry_after = await self.send(message)
+            # 送信済みの結果を記録できないと claim_timeout 後に二重に送るので、書き込みの競合では諦めずにやり直す
+            for retry in range(self.record_retries, -1, -1):
+                try:
+                    await asyncio.to_thread(self._record_result, notification_id, attempts, ok, error, retry_after)
+                    break
+                except OperationalError as e:
+                    if retry == 0:
+                        raise
+                    logger.warning("通知の送信結果を記録できませんでした (id=%s, 再試行します): %s", notification_id, e)
+                    await asyncio.sleep(0.1)
+        return len(due)
+
+    async def send(self, message: str) -> Tuple[bool, Optional[str], Optional[float]]:
+        """
+        Telegramに1件送信する
+        戻り値: (成功したか, エラー内容, サーバーが指定した再送までの秒数)
+        """
+        data = {
+            "chat_id": self.chat_id,
+            "text": message,
+            "parse_mode": "HTML"
+        }
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(f"/bot{self.token}/sendMessage", json=data)
+        except httpx.HTTPError as e:
+            TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, "error")
+            TELEGRAM_SEND_FAILURES.inc("transport")
+            return False, f"{type(e).__name__}: {str(e)}", None
+
+        if response.status_code == 200:
+            TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, "ok")
+            return True, None, None
+
+        TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, "error")
+        TELEGRAM_SEND_FAILURES.inc("rate_limited" if response.status_code == 429 else "http_status")
+        retry_after = None
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.json().get("parameters", {}).get("retry_after"))
+            except (ValueError, TypeError, AttributeError):
+                retry_after = None
+        return False, f"HTTP {response.status_code}: {response.text[:200]}", retry_after
+
+    def _claim_due(self) -> List[Tuple[int, str, int]]:
+        """
+        送信時刻に達した通知を取得し、next_attempt_at を claim_timeout 秒後に進めて他のワーカーから隠す
+        候補は読み取りだけで探し、取得の UPDATE は同じ条件を付けて行うので、先に他のワーカーが取得した通知は返らない
+        """
+        db = self.session_factory()
+        try:
+            now = datetime.now()
+            due = NotificationOutbox.status == "pending", NotificationOutbox.next_attempt_at <= now
+            ids = db.execute(
+                select(NotificationOutbox.id).where(*due).order_by(NotificationOutbox.id).limit(self.batch_size)
+            ).scalars().all()
+            if not ids:
+                return []
+            rows = db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id.in_(ids), *due)
+                .values(next_attempt_at=now + timedelta(seconds=self.claim_timeout))
+                .returning(NotificationOutbox.id, NotificationOutbox.message, NotificationOutbox.attempts)
+                .execution_options(synchronize_session=False)
+            ).all()
+            db.commit()
+            return sorted(tuple(row) for row in rows)
+        finally:
+            db.close()
+
+    def _next_due_delay(self) -> float:
+        """ 次に送信時刻を迎える通知までの秒数（最大 poll_interval） """
+        db = self.session_factory()
+        try:
+            next_attempt_at = db.query(func.min(NotificationOutbox.next_attempt_at)).filter(
+                NotificationOutbox.status == "pending"
+            ).scalar()
+        finally:
+            db.close()
+        if next_attempt_at is None:
+            return self.poll_interval
+        delay = (next_attempt_at - datetime.now()).total_seconds()
+        return min(self.poll_interval, max(0.0, delay))
+
+    def _record_result(self, notification_id: int, attempts: int, ok: bool,
+                       error: Optional[str], retry_after: Optional[float]):
+        db = self.session_factory()
+        try:
+            notification = db.get(NotificationOutbox, notification_id)
+            if notification is None:
+                return
+            now = datetime.now()
+            notification.attempts = attempts + 1
+            if ok:
+                notification.status = "sent"
+                notification.sent_at = now
+                notification.last_error = None
+            else:
+                notification.last_error = error
+                if notification.attempts >= self.max_attempts:
+                    notification.status = "failed"
+                    logger.error("Telegram送信を断念しました (id=%s): %s", notification_id, error)
+                else:
+                    delay = min(self.max_delay, self.base_delay * (2 ** attempts))
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    notification.next_attempt_at = now + timedelta(seconds=delay)
+                    logger.warning("Telegram送信失敗 (id=%s, %.1f秒後に再送): %s", notification_id, delay, error)
+            db.commit()
+        finally:
+            db.close()
+    #}}}
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+キーセット（カーソル）ページネーション
+
+一覧APIは offset ではなく「前のページの最後の行のキー」から続きを読みます。
+キーはURLセーフなbase64のJSONにした不透明なカーソルとしてクライアントに渡し、
+クライアントは中身を解釈せずに次のリクエストの cursor パラメータへ渡すだけです。
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+# 1ページあたりの件数の上限
+MAX_PAGE_SIZE = 1000
+# yield_per でDBから一度に読み込む行数
+FETCH_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """ カーソルが壊れている・別の一覧のものなど、解釈できない場合 """
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """ キーの値の列をカーソル文字列にする """
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> List[Any]:
+    """ カーソル文字列をキーの値の列に戻す（キーの数が合わなければ InvalidCursor） """
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = [_decode_value(v) for v in json.loads(raw)]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise InvalidCursor("invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("invalid cursor")
+    return values
+
+
+def keyset_page(
+    query: Query,
+    columns: Sequence,
+    key: Callable[[Any], Sequence[Any]],
+    cursor: Optional[str],
+    limit: int,
+    descending: bool = False,
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    columns の順に並べた query の1ページ分を返す
+    key は行から columns に対応する値を取り出す関数
+    戻り値: (行のリスト, 次のページのカーソル。最後のページなら None)
+    """
+    if cursor is not None:
+        values = decode_cursor(cursor, len(columns))
+        if len(columns) == 1:
+            column, value = columns[0], values[0]
+            query = query.filter(column < value if descending else column > value)
+        else:
+            keys = tuple_(*columns)
+            query = query.filter(keys < tuple_(*values) if descending else keys > tuple_(*values))
+
+    order = [column.desc() if descending else column.asc() for column in columns]
+    # 1件多く読んで次のページの有無を判定する。行はまとめて読み込まず FETCH_SIZE 件ずつ取り出す
+    rows = []
+    for row in query.order_by(*order).limit(limit + 1).yield_per(FETCH_SIZE):
+        rows.append(row)
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+def sequence_page(
+    items: Sequence[Any],
+    key: Callable[[Any], Any],
+    cursor: Optional[str],
+    limit: int,
+) -> Tuple[List[Any], Optional[str]]:
+    """ key の昇順に並んだメモリ上の一覧から1ページ分を返す（keyset_page と同じカーソル形式） """
+    start = 0
+    if cursor is not None:
+        last = decode_cursor(cursor, 1)[0]
+        while start < len(items) and key(items[start]) <= last:
+            start += 1
+    page = list(items[start:start + limit])
+    if start + limit >= len(items):
+        return page, None
+    return page, encode_cursor([key(page[-1])])
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+現在の入室状況（current_status）のプロセス内インデックス
+
+起動時に current_status テーブルから読み込み、以降は入退室APIが
+コミット後に更新します（write-through）。入室状況の参照と一覧はDBを使わずに返せます。
+クラッシュ等でテーブルとずれていないかは check_consistency で確認できます。
+
+ワーカーが複数ある場合、他のワーカーの入退室は sync で取り込みます（main.py が data_versions の
+current_status のバージョンが変わったときに呼ぶ）。取り込むまでの間（既定で最大1秒）に同じ学生が
+別のワーカーでタッチした場合は、テーブルの一意制約で失敗して 409 になり、そのワーカーのインデックスも読み直されます。
+"""
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models.models import CurrentStatus
+
+
+class PresenceIndex:
+    def __init__(self):
+        self._entries: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self.loaded_at: Optional[datetime] = None
+        # 変更のたびに増える番号（ETag 用）。プロセスごとに異なる instance_id と組み合わせて使う
+        self.instance_id = uuid.uuid4().hex
+        self._version = 0
+
+    def load(self, db: Session):
+        """ current_status テーブル全体を読み込む """
+        rows = db.query(CurrentStatus.student_id, CurrentStatus.entry_time).all()
+        with self._lock:
+            self._entries = {student_id: entry_time for student_id, entry_time in rows}
+            self.loaded_at = datetime.now()
+            self._version += 1
+
+    def sync(self, db: Session) -> Optional[Tuple[List[Tuple[str, datetime]], List[str]]]:
+        """
+        current_status テーブル全体を読み直し、インデックスになかった (入室した学籍番号, 入室時刻) と
+        インデックスにだけあった（退室した）学籍番号を返す。このプロセスで記録済みの変更は含まれない
+        読み出しはロックの外で行い（DBの待ちで参照を止めないため）、読み出し中にこのプロセスで
+        mark_entry / mark_exit があった場合は古い内容で上書きしないよう何もせず None を返す（呼び出し側で読み直す）
+        """
+        version = self.version
+        rows = db.query(CurrentStatus.student_id, CurrentStatus.entry_time).all()
+        table = {student_id: entry_time for student_id, entry_time in rows}
+        with self._lock:
+            if self._version != version:
+                return None
+            entered = sorted(
+                (student_id, entry_time) for student_id, entry_time in table.items()
+                if self._entries.get(student_id) != entry_time
+            )
+            exited = sorted(set(self._entries) - set(table))
+            if entered or exited:
+                self._entries = table
+                self._version += 1
+            self.loaded_at = datetime.now()
+        return entered, exited
+
+    def refresh(self, db: Session, student_id: str):
+        """ 1人分の入室状況をテーブルから読み直す """
+        entry_time = db.query(CurrentStatus.entry_time).filter(
+            CurrentStatus.student_id == student_id
+        ).scalar()
+        with self._lock:
+            if entry_time is None:
+                self._entries.pop(student_id, None)
+            else:
+                self._entries[student_id] = entry_time
+            self._version += 1
+
+    #{{{ 参照
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def is_present(self, student_id: str) -> bool:
+        with self._lock:
+            return student_id in self._entries
+
+    def entry_time(self, student_id: str) -> Optional[datetime]:
+        with self._lock:
+            return self._entries.get(student_id)
+
+    def student_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def snapshot(self) -> List[Tuple[str, datetime]]:
+        """ 入室中の (学籍番号, 入室時刻) を学籍番号順に返す """
+        with self._lock:
+            return sorted(self._entries.items())
+    #}}}
+
+    #{{{ 更新（DBのコミット後に呼び出す）
+    def mark_entry(self, student_id: str, entry_time: datetime):
+        with self._lock:
+            self._entries[student_id] = entry_time
+            self._version += 1
+
+    def mark_exit(self, student_id: str):
+        with self._lock:
+            self._entries.pop(student_id, None)
+            self._version += 1
+    #}}}
+
+    def check_consistency(self, db: Session, repair: bool = False) -> Dict:
+        """
+        インデックスと current_status テーブルを比較する
+        missing: テーブルにのみ存在 / stale: インデックスにのみ存在 / mismatched: 入室時刻が異なる
+        repair=True の場合はテーブルの内容で置き換える
+        """
+        table = {
+            student_id: entry_time
+            for student_id, entry_time in db.query(CurrentStatus.student_id, CurrentStatus.entry_time).all()
+        }
+        with self._lock:
+            cached = dict(self._entries)
+            if repair:
+                self._entries = dict(table)
+                self.loaded_at = datetime.now()
+                self._version += 1
+
+        missing = sorted(set(table) - set(cached))
+        stale = sorted(set(cached) - set(table))
+        mismatched = sorted(
+            student_id for student_id in set(table) & set(cached)
+            if table[student_id] != cached[student_id]
+        )
+        return {
+            "consistent": not (missing or stale or mismatched),
+            "missing": missing,
+            "stale": stale,
+            "mismatched": mismatched,
+            "repaired": repair,
+        }
+
+
+# アプリ全体で共有するインデックス
+presence = PresenceIndex()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+リクエストごとの SQL のクエリ数と予算（N+1 の検出）
+
+SQLAlchemy のイベントで、実行中のリクエストの SQL 文の数と DB の合計時間を数えます。
+数える先はコンテキスト変数で持つため、スレッドプールで動く同期エンドポイントや
+asyncio.to_thread の中の SQL も、呼び出し元のリクエストの分として数えられます。
+バックグラウンドのワーカー（通知・スケジューラ）の SQL はどのリクエストにも数えません。
+
+- QueryBudgetMiddleware: リクエストごとに数え、debug_headers が有効なら
+  X-DB-Queries / X-DB-Time-Ms ヘッダーで返す。ルートごとの予算を超えたら
+  最も多く繰り返された SQL 文とともに警告をログに出す
+- count_queries: ブロック内で実行された SQL 文を数える（テスト・ベンチマーク用）。
+  httpx.ASGITransport のようにアプリを同じタスクで呼び出す場合はリクエストの分も含まれます
+
+    with count_queries() as stats:
+        await client.post("/api/attendance-now/s00001")
+    assert stats.count == 4
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """ SQL 文の数・合計時間・文ごとの回数 """
+
+    def __init__(self, parent: Optional["QueryStats"] = None):
+        self.parent = parent  # 外側の count_queries などにも同じ数を足す
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, statement: str, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.statements[statement] += 1
+        if self.parent is not None:
+            self.parent.record(statement, seconds)
+
+    def most_repeated(self):
+        """ 最も多く実行された (SQL 文, 回数)。なければ None """
+        with self._lock:
+            common = self.statements.most_common(1)
+        return common[0] if common else None
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_stats() -> Optional[QueryStats]:
+    """ 実行中のリクエストの QueryStats（リクエスト外では None） """
+    return _current.get()
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    """ ブロック内（同じコンテキスト）で実行された SQL 文を数える """
+    stats = QueryStats(parent=_current.get())
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def instrument_engine(engine):
+    """ エンジン（非同期エンジンは sync_engine）の SQL 文を数えるイベントを登録する """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_budget_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_budget_started"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.record(statement, seconds)
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(context):
+        started = context.connection.info.get("query_budget_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+    return engine
+
+
+class QueryBudgetMiddleware:
+    """
+    リクエストごとに SQL 文を数える ASGI ミドルウェア
+    budgets は "メソッド パスのテンプレート"（"GET /api/students/" など）ごとの上限、それ以外は default_budget
+    """
+
+    def __init__(self, app, budgets: Optional[Dict[str, int]] = None, default_budget: int = 20, debug_headers: bool = False):
+        self.app = app
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(parent=_current.get())
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.debug_headers:
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-queries", str(stats.count).encode()))
+                headers.append((b"x-db-time-ms", f"{stats.seconds * 1000:.2f}".encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            self.check_budget(scope, stats)
+
+    def check_budget(self, scope, stats: QueryStats):
+        route = getattr(scope.get("route"), "path", None)
+        if route is None:
+            return
+        key = f"{scope['method']} {route}"
+        budget = self.budgets.get(key, self.default_budget)
+        if stats.count <= budget:
+            return
+        statement, repeated = stats.most_repeated()
+        logger.warning(
+            "クエリ数が予算を超えました: %s %d件 (予算 %d件, %.1fms) 最多 %d回: %s",
+            key, stats.count, budget, stats.seconds * 1000, repeated, " ".join(statement.split())[:200]
+        )
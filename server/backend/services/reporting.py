@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+集計・レポート用の読み取り専用データベース
+
+エクスポート・充足状況・ダッシュボードの集計を、入退室の書き込みと同じコネクションプールではなく
+別のエンジンで実行します。mode で読み出し先を選びます。
+
+- readonly: 本番のデータベースを読み取り専用（mode=ro, query_only）で開く別のプール。
+  WAL なので常に最新のコミット済みデータを読み、書き込みとはプールを取り合わない
+- snapshot: sqlite3 のバックアップAPIで interval 秒ごとに別ファイルへ複製し、そこから読む。
+  複製は1回の短い読み取りトランザクションで、長い集計が本番の WAL のチェックポイントを止めない。
+  複製は一時ファイルに作ってから置き換えるので、読み出し中のクエリは古いファイルをそのまま読み続ける
+
+snapshot はエクスポート・充足状況・違反の一覧などのレポート用です。ダッシュボードと学生ごとの履歴は、画面が
+/api/events のイベントで差分を当てているため、読み直したときに古い状態へ戻らないよう mode によらず readonly で読みます（live_session）。
+
+応答にはデータの鮮度（freshness_headers の X-Data-As-Of など）を付けます。snapshot は複製を開始した時刻、readonly は読み出し時刻です。
+スナップショットがまだない（初回の複製に失敗した）間は readonly で読みます。
+どちらのエンジンも締めた年度のアーカイブを ATTACH します（services/archive.py の history_source で読む）。
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from db.database import SQLITE_PROFILE, create_sqlite_engine
+from services.archive import register_attach_events
+
+logger = logging.getLogger(__name__)
+
+MODES = ("readonly", "snapshot")
+
+# 読み取り専用の接続では journal_mode / synchronous は変更しない
+READONLY_PROFILE = {
+    "busy_timeout": SQLITE_PROFILE["busy_timeout"],
+    "mmap_size": SQLITE_PROFILE["mmap_size"],
+    "cache_size": SQLITE_PROFILE["cache_size"],
+    "temp_store": SQLITE_PROFILE["temp_store"],
+    "query_only": 1,
+}
+
+
+def readonly_url(path: str, immutable: bool = False) -> str:
+    """ ファイルを読み取り専用で開く SQLAlchemy の URL（immutable は変更されないファイル用でロックを取らない） """
+    return f"sqlite:///file:{path}?mode=ro{'&immutable=1' if immutable else ''}&uri=true"
+
+
+def backup_database(source_path: str, target_path: str, busy_timeout: int = SQLITE_PROFILE["busy_timeout"]):
+    """
+    source_path の整合したコピーを target_path に作る（target_path は上書き）
+    コピーはロールバックジャーナルのモードにし、読み取り専用でも WAL のファイルなしで開けるようにする
+    """
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    try:
+        source.execute(f"PRAGMA busy_timeout={busy_timeout}")
+        target = sqlite3.connect(target_path)
+        try:
+            # pages=-1（既定）で1回の読み取りトランザクションで全ページを写す
+            # 少しずつ写すと途中で書き込みがあるたびに最初からやり直しになる
+            source.backup(target)
+            target.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+
+def freshness_headers(snapshot_at: Optional[datetime], now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    X-Data-Source（snapshot / readonly）・X-Data-As-Of（データの時点）・X-Data-Age（経過秒数）
+    snapshot_at が None（readonly で読む場合）は現在時刻のデータとする
+    """
+    now = now or datetime.now()
+    as_of = snapshot_at or now
+    return {
+        "X-Data-Source": "snapshot" if snapshot_at is not None else "readonly",
+        "X-Data-As-Of": as_of.isoformat(timespec="seconds"),
+        "X-Data-Age": str(max(int((now - as_of).total_seconds()), 0)),
+    }
+
+
+class ReportingDatabase:
+    """ mode（readonly / snapshot）に応じた読み取り専用のエンジンを持つ """
+
+
+    def __init__(self, source_path: str, mode: str = "readonly", snapshot_path: Optional[str] = None,
+                 interval: float = 60.0):
+        if mode not in MODES:
+            raise ValueError(f"unknown reporting mode: {mode}")
+        self.source_path = source_path
+        self.mode = mode
+        self.snapshot_path = snapshot_path or os.path.splitext(source_path)[0] + ".reporting.db"
+        self.interval = interval
+        self.snapshot_at: Optional[datetime] = None  # 最新のスナップショットの時点
+        self.readonly_engine = create_sqlite_engine(readonly_url(source_path), profile=READONLY_PROFILE)
+        self.snapshot_engine = None
+        if mode == "snapshot":
+            # 接続はセッションごとに開く（置き換え後のファイルを読むため、プールしない）
+            self.snapshot_engine = create_sqlite_engine(
+                readonly_url(self.snapshot_path, immutable=True), profile=READONLY_PROFILE,
+                pool_settings={"poolclass": NullPool}
+            )
+        # 締めた年度のアーカイブ（services/archive.py）を接続ごとに ATTACH する
+        base_dir = os.path.dirname(os.path.abspath(source_path))
+        for engine in self.engines():
+            register_attach_events(engine, base_dir)
+        self._task: Optional[asyncio.Task] = None
+
+    #{{{ エンジン・セッション
+    def current(self) -> Tuple[Engine, Optional[datetime]]:
+        """ 現在の読み出し先のエンジンとスナップショットの時点（readonly で読む場合は None） """
+        snapshot_at = self.snapshot_at if self.mode == "snapshot" else None
+        if snapshot_at is None:
+            return self.readonly_engine, None
+        return self.snapshot_engine, snapshot_at
+
+    def session(self) -> Tuple[Session, Dict[str, str]]:
+        """ 読み出し用のセッションと、その鮮度を表す応答ヘッダー """
+        engine, snapshot_at = self.current()
+        return Session(bind=engine, autoflush=False), freshness_headers(snapshot_at)
+
+    def live_session(self) -> Tuple[Session, Dict[str, str]]:
+        """ mode によらず最新のコミット済みデータを読むセッション（readonly のエンジン）と応答ヘッダー """
+        return Session(bind=self.readonly_engine, autoflush=False), freshness_headers(None)
+
+    def engines(self):
+        """ 読み出しに使うエンジン（計測のイベント登録用） """
+        return [e for e in (self.readonly_engine, self.snapshot_engine) if e is not None]
+    #}}}
+
+    #{{{ スナップショット
+    def refresh(self) -> datetime:
+        """ スナップショットを作り直して置き換え、その時点を返す """
+        started = datetime.now()
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            backup_database(self.source_path, tmp_path)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.snapshot_at = started
+        logger.debug("Reporting snapshot refreshed: %s", self.snapshot_path)
+        return started
+
+    async def start(self):
+        """ snapshot モードでは最初のスナップショットを作り、定期的な作り直しを始める """
+        if self.mode != "snapshot":
+            return
+        try:
+            await asyncio.to_thread(self.refresh)
+        except Exception as e:
+            logger.error("レポート用スナップショットの作成に失敗しました（readonly で読み出します）: %s", e)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for engine in self.engines():
+            engine.dispose()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.refresh)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("レポート用スナップショットの更新に失敗しました: %s", e)
+    #}}}
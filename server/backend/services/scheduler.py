@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+コアタイムチェックのスケジューラ
+
+cron + curl の代わりに、アプリのライフスパンで起動してプロセス内でチェックを実行します。
+チェック時刻は core_time_periods.check_time から読み、月曜～金曜（既定）に実行します。
+
+- 複数ワーカーで起動しても、リース（services/leases.py）を持つ1つだけが実行します
+- 予定時刻ごとに job_runs に1行記録し、チェック本体と同じトランザクションでコミットします。
+  同じ予定が2回実行されることはありません
+- 停止中に過ぎた当日の予定は、その時限の終了前であれば起動後すぐに実行します（キャッチアップ）。
+  終了後は入室状況から判定できないため missed として記録します
+"""
+import asyncio
+import json
+import logging
+from datetime import date, datetime, time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from models.models import CoreTimePeriod, JobRun
+from services.core_time import CoreTimeCheckResult, run_core_time_check, violation_message
+from services.leases import acquire_lease, make_owner_id, release_lease
+from services.notifier import enqueue_notifications
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "core-time-check"
+LEASE_NAME = "core-time-scheduler"
+
+
+def scheduled_checks(db: Session, day: date) -> List[Tuple[int, datetime, datetime]]:
+    """ その日の (時限, チェック時刻, 時限の終了時刻) をチェック時刻順に返す """
+    checks = []
+    for period, check_time, end_time in db.query(
+        CoreTimePeriod.period, CoreTimePeriod.check_time, CoreTimePeriod.end_time
+    ).filter(CoreTimePeriod.check_time.isnot(None)):
+        check_at = datetime.combine(day, time.fromisoformat(check_time))
+        end_at = max(datetime.combine(day, time.fromisoformat(end_time)), check_at)
+        checks.append((period, check_at, end_at))
+    return sorted(checks, key=lambda check: check[1])
+
+
+def claim_job_run(db: Session, job: str, scheduled_at: datetime, owner: str, status: str, now: datetime) -> bool:
+    """
+    予定時刻の実行記録を追加し、自分が実行してよいかを返す（コミットは呼び出し側で行う）
+    既に記録があれば（他のワーカーが実行済み）False
+    """
+    result = db.execute(insert(JobRun).prefix_with("OR IGNORE").values(
+        job=job, scheduled_at=scheduled_at, owner=owner, status=status, started_at=now
+    ))
+    return result.rowcount == 1
+
+
+class CoreTimeScheduler:
+    """
+    コアタイムチェックを予定時刻に実行するスケジューラ
+    on_run(時限, 結果, 実行時刻) はチェックをコミットした後にスケジューラのスレッドで呼ばれる
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        on_run: Optional[Callable[[int, CoreTimeCheckResult, datetime], None]] = None,
+        weekdays: Sequence[int] = (1, 2, 3, 4, 5),
+        poll_interval: float = 30.0,
+        lease_ttl: float = 90.0,
+        owner: Optional[str] = None,
+    ):
+        self.session_factory = session_factory
+        self.on_run = on_run
+        self.weekdays = set(weekdays)  # 1:月曜 2:火曜 ... 7:日曜
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self.owner = owner or make_owner_id()
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+
+    #{{{ ライフサイクル
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+        logger.info("Core time scheduler started (%s)", self.owner)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.is_leader:
+            try:
+                await asyncio.to_thread(self._release)
+            except Exception as e:
+                logger.error("リースの解放に失敗しました: %s", e)
+        logger.info("Core time scheduler stopped")
+
+    def _release(self):
+        db = self.session_factory()
+        try:
+            release_lease(db, LEASE_NAME, self.owner)
+            db.commit()
+            self.is_leader = False
+        finally:
+            db.close()
+    #}}}
+
+    #{{{ 実行
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.tick, datetime.now())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("スケジューラエラー: %s", e)
+            await asyncio.sleep(await asyncio.to_thread(self.next_delay, datetime.now()))
+
+    def next_delay(self, now: datetime) -> float:
+        """ 次の確認までの秒数（リースの延長のため poll_interval を超えない） """
+        delay = self.poll_interval
+        db = self.session_factory()
+        try:
+            for _, check_at, _ in scheduled_checks(db, now.date()):
+                if check_at > now:
+                    delay = min(delay, (check_at - now).total_seconds())
+                    break
+        except Exception:
+            pass
+        finally:
+            db.close()
+        return max(delay, 0.5)
+
+    def tick(self, now: datetime) -> List[Tuple[int, str]]:
+        """
+        リースを取得・延長し、リーダーであれば当日の未実行の予定を処理する
+        戻り値: 処理した (時限, done / missed) のリスト
+        """
+        db = self.session_factory()
+        try:
+            self.is_leader = acquire_lease(db, LEASE_NAME, self.owner, self.lease_ttl, now)
+            db.commit()
+            if not self.is_leader or now.weekday() + 1 not in self.weekdays:
+                return []
+
+            processed = []
+            for period, check_at, end_at in scheduled_checks(db, now.date()):
+                if check_at > now:
+                    break
+                if now >= end_at:
+                    # 時限が終わってからでは入室状況で判定できないので実行しない
+                    if claim_job_run(db, JOB_NAME, check_at, self.owner, "missed", now):
+                        db.commit()
+                        logger.warning("コアタイムチェックを実行できませんでした: %s限 (%s)", period, check_at)
+                        processed.append((period, "missed"))
+                    else:
+                        db.rollback()
+                    continue
+                if not claim_job_run(db, JOB_NAME, check_at, self.owner, "done", now):
+                    db.rollback()
+                    continue
+                self._check(db, period, check_at, now)
+                processed.append((period, "done"))
+            return processed
+        finally:
+            db.close()
+
+    def _check(self, db: Session, period: int, check_at: datetime, now: datetime):
+        """ チェック本体。実行記録・アラート・通知を1トランザクションでコミットする """
+        try:
+            result = run_core_time_check(db, period, now)
+            enqueue_notifications(db, [
+                violation_message(student_id, name, now, period) for student_id, name in result.new_alerts
+            ])
+            db.query(JobRun).filter(
+                JobRun.job == JOB_NAME, JobRun.scheduled_at == check_at
+            ).update({JobRun.detail: json.dumps({
+                "period": period,
+                "violations": result.violations,
+                "new_alerts": [student_id for student_id, _ in result.new_alerts],
+            }, ensure_ascii=False)}, synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        logger.info("コアタイムチェック %s限: 不在 %d名, 新規違反 %d名", period, len(result.violations), len(result.new_alerts))
+        if self.on_run is not None:
+            self.on_run(period, result, now)
+    #}}}
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+データバージョンと ETag
+
+data_versions にはテーブルごとの変更回数があり、書き込みのたびにトリガーで加算されます
+（db/migrations.py の migration 8）。読み取りAPIは応答の元になるテーブルのバージョンと
+リクエストのパラメータから ETag を作り、If-None-Match が一致すれば本体のクエリも
+シリアライズも行わずに 304 を返します。
+
+バージョンは本体より先に読むこと。間に書き込みがあっても、古いバージョンに新しい内容が
+対応するだけなので、次のリクエストで取り直しになるだけで古い内容が返ることはありません。
+
+VersionWatcher は同じバージョンを定期的に読み、変わったテーブルを知らせます。ワーカーが複数ある場合に、
+他のワーカーの書き込みをプロセス内の状態（入室状況のインデックスなど）へ反映するために使います。
+LocalWrites を渡すと、このプロセスの書き込みだけで増えたテーブルは知らせません。
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from models.models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+
+def versions_statement(tables: Iterable[str]):
+    """ テーブルのバージョンを読む SELECT 文（同期・非同期どちらでも execute できる） """
+    return select(DataVersion.table_name, DataVersion.version).where(
+        DataVersion.table_name.in_(list(tables))
+    )
+
+
+def make_etag(versions: Dict[str, int], *parts) -> str:
+    """ バージョンとリクエストごとの値（パス・パラメータなど）から弱い ETag を作る """
+    key = "|".join(
+        [f"{table}={versions.get(table, 0)}" for table in sorted(versions)] + [str(part) for part in parts]
+    )
+    return 'W/"' + hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """ If-None-Match ヘッダーに etag が含まれるか（弱い比較） """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+class LocalWrites:
+    """
+    このプロセスの書き込みで増えたバージョンの範囲を記録する
+    接続ごとの TEMP トリガーでその接続が書き込んだ行数を数え、コミットの直前（書き込みのロックを持っている間）に
+    その時点のバージョンと合わせて記録する。SQLite の書き込みは直列なので、(バージョン - 行数, バージョン] は
+    このプロセスの変更だけになる
+    """
+
+    def __init__(self, tables: Iterable[str]):
+        self.tables = list(tables)
+        self._ranges: Dict[str, List[Tuple[int, int]]] = {table: [] for table in self.tables}  # (開始, 終了]
+        self._lock = threading.Lock()
+
+    def register(self, engine):
+        """ engine（非同期エンジンは sync_engine）の接続にトリガーを作り、コミット時に記録するイベントを登録する """
+
+        @event.listens_for(engine, "connect")
+        def _install(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS local_writes"
+                    " (table_name TEXT PRIMARY KEY, count INTEGER NOT NULL DEFAULT 0)"
+                )
+                for table in self.tables:
+                    cursor.execute("INSERT OR IGNORE INTO temp.local_writes (table_name) VALUES (?)", (table,))
+                    for operation in ("INSERT", "UPDATE", "DELETE"):
+                        cursor.execute(
+                            f"CREATE TEMP TRIGGER IF NOT EXISTS local_{table}_{operation.lower()}"
+                            f" AFTER {operation} ON main.{table} BEGIN"
+                            f" UPDATE local_writes SET count = count + 1 WHERE table_name = '{table}'; END"
+                        )
+            finally:
+                cursor.close()
+            dbapi_connection.commit()  # INSERT で暗黙に始まったトランザクションを閉じる
+
+        @event.listens_for(engine, "commit")
+        def _record(connection):
+            # クエリ数の計測に含めないよう DBAPI の接続で直接読む
+            cursor = connection.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(
+                    "SELECT l.table_name, d.version, l.count FROM temp.local_writes l"
+                    " JOIN main.data_versions d ON d.table_name = l.table_name WHERE l.count > 0"
+                )
+                rows = cursor.fetchall()
+                if rows:
+                    cursor.execute("UPDATE temp.local_writes SET count = 0 WHERE count > 0")
+            finally:
+                cursor.close()
+            with self._lock:
+                for table, version, count in rows:
+                    self._ranges[table].append((version - count, version))
+
+        return engine
+
+    def foreign(self, table: str, before: int, after: int) -> bool:
+        """ バージョンが before から after に増えた分に、このプロセス以外の書き込みが含まれるか """
+        with self._lock:
+            own = sum(end - start for start, end in self._ranges.get(table, []) if start >= before and end <= after)
+        return after - before > own
+
+    def forget(self, versions: Dict[str, int]):
+        """ versions まで確認済みの範囲の記録を捨てる """
+        with self._lock:
+            for table, ranges in self._ranges.items():
+                seen = versions.get(table) or 0
+                self._ranges[table] = [(start, end) for start, end in ranges if end > seen]
+
+
+class VersionWatcher:
+    """
+    interval 秒ごとに tables のバージョンを読み、変わったテーブルがあれば on_change(セッション, 変わったテーブル) を呼ぶ
+    on_change はスレッドで呼ばれる。例外を投げた場合は次の回に同じ変更をもう一度知らせる。
+    on_change が返したテーブル（取り込めなかったもの）も次の回にもう一度知らせる。
+    local（LocalWrites）を渡すと、このプロセスの書き込みだけで変わったテーブルは知らせない
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], tables: Iterable[str],
+                 on_change: Callable[[Session, Set[str]], Optional[Set[str]]], interval: float = 1.0,
+                 local: Optional[LocalWrites] = None):
+        self.session_factory = session_factory
+        self.tables = list(tables)
+        self.on_change = on_change
+        self.interval = interval
+        self.local = local
+        self._versions: Optional[Dict[str, int]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _changed(self, table: str, versions: Dict[str, int]) -> bool:
+        before, after = self._versions.get(table), versions.get(table)
+        if before == after:
+            return False
+        return self.local is None or self.local.foreign(table, before or 0, after or 0)
+
+    def poll(self) -> Set[str]:
+        """ バージョンを読み、変わったテーブルを on_change に渡して返す（初回は基準を記録するだけ） """
+        db = self.session_factory()
+        try:
+            versions = dict(db.execute(versions_statement(self.tables)).all())
+            changed = set()
+            if self._versions is None:
+                self._versions = versions
+            else:
+                changed = {table for table in self.tables if self._changed(table, versions)}
+                retry = (self.on_change(db, changed) or set()) if changed else set()
+                for table in retry:
+                    versions[table] = self._versions.get(table)
+                self._versions = versions
+            if self.local is not None:
+                self.local.forget(self._versions)
+            return changed
+        finally:
+            db.close()
+
+    async def start(self):
+        if self.interval <= 0:
+            return
+        await asyncio.to_thread(self.poll)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await asyncio.to_thread(self.poll)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("データバージョンの確認に失敗しました: %s", e)
@@ -7,6 +7,6 @@ service cron start
 touch /var/log/cron.log
 chmod 666 /var/log/cron.log
 
-# FastAPIアプリケーションを起動
+# FastAPIアプリケーションを起動（ワーカー数などは gunicorn.conf.py、開発時の自動再読み込みは run.py）
 cd /app/backend
-exec uvicorn main:app --host 0.0.0.0 --port 8000 --reload 
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py main:app
\ No newline at end of file
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+テスト共通のフィクスチャ
+
+- db_path: マイグレーションを適用した一時データベース
+- session_factory: db_path に接続する同期セッション
+- telegram_stub: sendMessage を受ける HTTP サーバー（応答は responses に積んだ順に返す）
+- client: アプリ（main.app）の TestClient。テストのセッションで1つの一時データベースを共有する
+  （クエリ数のヘッダーを返し、スケジューラ・ワーカー間の同期は止め、Telegram への送信は成功扱い）
+"""
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+from typing import List, Optional, Tuple
+
+import httpx
+import pytest
+
+# アプリ（db/database.py と main.py）は読み込み時に環境変数を読むので、何かを読み込む前に設定する
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = tempfile.mkdtemp(prefix="attendance-tests-")
+os.environ.update({
+    "ATTENDANCE_DB_PATH": os.path.join(APP_DIR, "app.db"),
+    "TELEGRAM_ID": "test",
+    "TELEGRAM_ALERT": "test",
+    "QUERY_DEBUG_HEADERS": "true",
+    "CORE_TIME_SCHEDULER": "false",
+    "WORKER_SYNC_INTERVAL": "0",
+    "REPORTING_MODE": "readonly",
+    "LOG_FORMAT": "text",
+    "SQLITE_BUSY_TIMEOUT_MS": "1000",  # ロック待ちのタイムアウト（503）のテストを短くする
+})
+
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from db.database import create_sqlite_engine  # noqa: E402
+from db.migrations import upgrade_database  # noqa: E402
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(APP_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    # 静的ファイルのパスは backend からの相対パス
+    cwd = os.getcwd()
+    os.chdir(BACKEND_DIR)
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    main.notifier.transport = httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True}))
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "attendance.db")
+    upgrade_database(path)
+    return path
+
+
+@pytest.fixture
+def session_factory(db_path):
+    engine = create_sqlite_engine(f"sqlite:///{db_path}")
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+class TelegramStub:
+    """
+    Telegram の sendMessage を真似る HTTP サーバー（テストと同じイベントループで動く）
+    responses が空のときは 200 {"ok": true} を返す。delay 秒だけ応答を遅らせられる
+    """
+
+    def __init__(self):
+        self.messages: List[str] = []
+        self.responses: List[Tuple[int, dict]] = []
+        self.delay = 0.0
+        self.port: Optional[int] = None
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in header.decode("latin-1").split("\r\n"):
+                    if line.lower().startswith("content-length:"):
+                        length = int(line.split(":", 1)[1])
+                body = json.loads(await reader.readexactly(length))
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                status, payload = self.responses.pop(0) if self.responses else (200, {"ok": True})
+                if status == 200:
+                    self.messages.append(body["text"])
+                data = json.dumps(payload).encode()
+                writer.write(
+                    b"HTTP/1.1 %d X\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s"
+                    % (status, len(data), data)
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+@pytest.fixture
+def telegram_stub():
+    return TelegramStub()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+年度のアーカイブ（db/archive.py）と、その読み出し（services/archive.py の history_source）のテスト
+"""
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import func
+
+from db.archive import archive_year
+from models.models import Alert, AttendanceLog, DailyPresence, Student
+from services.archive import history_source
+from services.core_time import run_core_time_check
+from services.reporting import ReportingDatabase
+
+TODAY = date(2026, 1, 1)  # 2024年度は締めている
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def history(db_path, session_factory):
+    """ 2024年度と2025年度の記録を入れ、本番とアーカイブを合わせた集計を返す関数を返す """
+    db = session_factory()
+    try:
+        db.add_all([Student(student_id=f"a{i}", name=f"学生{i}") for i in range(2)])
+        for day in range(10):
+            entered = datetime(2024, 5, 1, 10) + timedelta(days=day)
+            db.add(AttendanceLog(student_id=f"a{day % 2}", entry_time=entered, exit_time=entered + timedelta(hours=1)))
+            db.add(DailyPresence(student_id=f"a{day % 2}", date=entered.date(), seconds=3600))
+        for day in range(5):
+            db.add(Alert(student_id="a0", alert_date=date(2024, 6, 1) + timedelta(days=day), alert_period=1))
+        db.add(AttendanceLog(student_id="a1", entry_time=datetime(2025, 3, 31, 10)))  # 退室していない記録は残る
+        for day in range(3):
+            entered = datetime(2025, 5, 1, 10) + timedelta(days=day)
+            db.add(AttendanceLog(student_id="a0", entry_time=entered, exit_time=entered + timedelta(hours=2)))
+        db.commit()
+    finally:
+        db.close()
+
+    def totals():
+        reporting = ReportingDatabase(db_path)
+        db, _ = reporting.session()
+        try:
+            logs = history_source(db, AttendanceLog)
+            alerts = history_source(db, Alert)
+            presence = history_source(db, DailyPresence)
+            windowed = history_source(db, AttendanceLog, date(2024, 5, 5))
+            return {
+                "logs": db.query(func.count(logs.id)).scalar(),
+                "alerts": db.query(func.count(alerts.id)).scalar(),
+                "seconds": db.query(func.sum(presence.seconds)).scalar(),
+                "a0": db.query(func.count(windowed.id)).filter(
+                    windowed.student_id == "a0", windowed.entry_time >= datetime(2024, 5, 5)
+                ).scalar(),
+            }
+        finally:
+            db.close()
+            reporting.readonly_engine.dispose()
+
+    return totals
+
+
+def test_interrupted_purge_does_not_double_count(db_path, session_factory, history):
+    expected = history()
+    assert expected == {"logs": 14, "alerts": 5, "seconds": 36000, "a0": 6}
+
+    def interrupt(table, count):
+        if table == "attendance_logs (削除)":
+            raise Interrupted
+
+    # 出席記録の最初の削除のあとで止める（アーカイブは登録済みで、行の大半が本番とアーカイブの両方にある）
+    with pytest.raises(Interrupted):
+        archive_year(db_path, 2024, batch_size=2, pause=0, today=TODAY, progress=interrupt)
+    db = session_factory()
+    try:
+        assert db.query(AttendanceLog).count() == 12
+        assert db.query(Alert).count() == 5
+    finally:
+        db.close()
+    assert history() == expected
+
+    # もう一度実行すると続きから削除する
+    result = archive_year(db_path, 2024, batch_size=2, pause=0, today=TODAY)
+    assert result["copied"] is None
+    assert os.path.exists(result["path"])
+    db = session_factory()
+    try:
+        assert db.query(AttendanceLog).count() == 4  # 2025年度の3件と退室していない1件
+        assert db.query(Alert).count() == 0
+    finally:
+        db.close()
+    assert history() == expected
+
+
+def test_core_time_check_keeps_archived_violations(db_path, session_factory, history):
+    # a0 の 2024年度の違反5件をアーカイブした後も、コアタイムチェックで違反回数が通算のままになる
+    db = session_factory()
+    try:
+        db.query(Student).filter(Student.student_id == "a0").update(
+            {Student.core_time_1_day: 1, Student.core_time_1_period: 1, Student.core_time_violations: 5}
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    def interrupt(table, count):
+        if table == "alerts (削除)":
+            raise Interrupted
+
+    def check(now):
+        db = session_factory()
+        try:
+            result = run_core_time_check(db, 1, now)
+            db.commit()
+            return result.updated_students
+        finally:
+            db.close()
+
+    # アラートの削除の途中で止まっても、削除した分と本番に残っている分を合わせて数える
+    with pytest.raises(Interrupted):
+        archive_year(db_path, 2024, batch_size=2, pause=0, today=TODAY, progress=interrupt)
+    assert check(datetime(2026, 1, 5, 9, 20)) == [{"student_id": "a0", "core_time_violations": 6}]
+
+    # 続きから削除しても二重に数えない
+    archive_year(db_path, 2024, batch_size=2, pause=0, today=TODAY)
+    assert check(datetime(2026, 1, 12, 9, 20)) == [{"student_id": "a0", "core_time_violations": 7}]
+    db = session_factory()
+    try:
+        assert db.query(Alert).count() == 2
+        assert db.query(Student.archived_violations).order_by(Student.student_id).all() == [(5,), (0,)]
+    finally:
+        db.close()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+条件付きGET（ETag / If-None-Match）のテスト
+"""
+from datetime import datetime, timedelta
+
+import main
+
+
+class FrozenDatetime(datetime):
+    """ main.datetime.now() を固定する """
+    current = None
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.current
+
+
+def test_windowed_history_etag_follows_window_start(client, monkeypatch):
+    # user-017: days 指定の履歴は対象期間の開始が動くと ETag も変わる
+    monkeypatch.setattr(FrozenDatetime, "current", datetime(2026, 4, 10, 12, 0, 30))
+    monkeypatch.setattr(main, "datetime", FrozenDatetime)
+    response = client.post("/api/students/", json={"student_id": "etag01", "name": "学生etag01"})
+    assert response.status_code == 200, response.text
+    path = "/api/attendance/etag01?days=7"
+
+    etag = client.get(path).headers["etag"]
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    # 期間の長さが違えば別の ETag
+    assert client.get("/api/attendance/etag01?days=30").headers["etag"] != etag
+    assert client.get("/api/attendance/etag01").headers["etag"] != etag
+
+    # 同じ分のうちは同じ期間なので 304 のまま
+    FrozenDatetime.current += timedelta(seconds=20)
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+    # 分が変わると期間の開始も動くので、データが同じでも 200 を返す
+    FrozenDatetime.current += timedelta(minutes=1)
+    response = client.get(path, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+書き込みAPIからのイベント配信（/api/events）のテスト
+"""
+import pytest
+
+import main
+
+CORE_TIME = {"core_time_1_day": 2, "core_time_1_period": 3, "core_time_2_day": 4, "core_time_2_period": 1}
+
+
+@pytest.fixture
+def published(client, monkeypatch):
+    """ hub に配信したイベント [(イベント名, データ)] """
+    events = []
+    monkeypatch.setattr(main.hub, "publish", lambda event, data: events.append((event, data)))
+    return events
+
+
+def test_student_changes_publish_resync(client, published):
+    # user-016: 学生の登録とコアタイムの設定をダッシュボードに知らせる（EventSource の接続中はポーリングしない）
+    response = client.post("/api/students/", json={"student_id": "ev0001", "name": "イベント"})
+    assert response.status_code == 200
+    assert published == [("resync", {"reason": "student created"})]
+
+    published.clear()
+    response = client.post("/api/coretime/ev0001", json=CORE_TIME)
+    assert response.status_code == 200
+    assert published == [("resync", {"reason": "core time updated"})]
+
+    # 学生がいない（変更していない）場合は配信しない
+    published.clear()
+    assert client.post("/api/coretime/ev9999", json=CORE_TIME).status_code != 200
+    assert published == []
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+services/log_pipeline.py のテスト
+"""
+import io
+import json
+import logging
+
+import pytest
+
+from services.log_pipeline import setup_logging, stop_logging
+
+
+@pytest.fixture
+def log_output():
+    """ JSON 形式の出力を StringIO に書き、テスト後は text 形式の標準エラー出力に戻す """
+    stream = io.StringIO()
+    setup_logging(level="INFO", log_format="json", burst=3, interval=60.0, stream=stream)
+
+    def records():
+        stop_logging()  # キューに残っているレコードを書き出す
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield records
+    setup_logging(level="INFO", log_format="text")
+
+
+def test_sampling_groups_messages_by_format(log_output):
+    logger = logging.getLogger("tests.sampling")
+    for i in range(10):
+        logger.info("入室: %s", f"s{i:03d}")
+    logger.info("退室: %s", "s000")
+    logger.warning("入室: %s", "s999")  # WARNING 以上は間引かない
+
+    messages = [record["message"] for record in log_output() if record["logger"] == "tests.sampling"]
+    assert messages == ["入室: s000", "入室: s001", "入室: s002", "退室: s000", "入室: s999"]
+
+
+def test_httpx_request_urls_are_not_logged(log_output):
+    logging.getLogger("httpx").info('HTTP Request: POST https://api.telegram.org/botSECRET/sendMessage "HTTP/1.1 200 OK"')
+    logging.getLogger("httpx").warning("connection reset")
+
+    records = log_output()
+    assert not any("SECRET" in record["message"] for record in records)
+    assert [record["message"] for record in records if record["logger"] == "httpx"] == ["connection reset"]
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+services/notifier.py の送信ワーカーをローカルの Telegram スタブに対して動かすテスト
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from models.models import NotificationOutbox
+from services.notifier import TelegramNotifier, enqueue_notifications
+
+
+def make_notifier(session_factory, stub, **kwargs):
+    return TelegramNotifier(session_factory, token="TOKEN", chat_id="CHAT", api_base=stub.url, **kwargs)
+
+
+async def start_idle(notifier):
+    """ アウトボックスが空のうちに起動し、送信ループが poll_interval の待ちに入るのを待つ（以降は drain_once を直接呼べる） """
+    await notifier.start()
+    await asyncio.sleep(0.1)
+
+
+def enqueue(session_factory, messages):
+    db = session_factory()
+    try:
+        enqueue_notifications(db, messages)
+        db.commit()
+    finally:
+        db.close()
+
+
+def outbox(session_factory):
+    db = session_factory()
+    try:
+        return db.query(NotificationOutbox).order_by(NotificationOutbox.id).all()
+    finally:
+        db.close()
+
+
+def make_due(session_factory):
+    """ 再送待ちの通知を今すぐ送信対象にする """
+    db = session_factory()
+    try:
+        db.execute(update(NotificationOutbox).values(next_attempt_at=datetime.now()))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_retry_with_exponential_backoff(session_factory, telegram_stub):
+    async def scenario():
+        await telegram_stub.start()
+        telegram_stub.responses = [(500, {"ok": False}), (502, {"ok": False})]
+        notifier = make_notifier(session_factory, telegram_stub, base_delay=2.0)
+        await start_idle(notifier)
+        enqueue(session_factory, ["hello"])
+        delays = []
+        try:
+            for _ in range(3):
+                before = datetime.now()
+                await notifier.drain_once()
+                (row,) = outbox(session_factory)
+                delays.append((row.next_attempt_at - before).total_seconds())
+                make_due(session_factory)
+        finally:
+            await notifier.stop()
+            await telegram_stub.stop()
+        return delays
+
+    delays = asyncio.run(scenario())
+    (row,) = outbox(session_factory)
+    assert row.status == "sent"
+    assert row.attempts == 3
+    assert telegram_stub.messages == ["hello"]
+    # 1回目の失敗は base_delay、2回目はその2倍待つ
+    assert 2.0 <= delays[0] < 3.0
+    assert 4.0 <= delays[1] < 5.0
+
+
+def test_rate_limit_honours_retry_after(session_factory, telegram_stub):
+    async def scenario():
+        await telegram_stub.start()
+        telegram_stub.responses = [(429, {"ok": False, "parameters": {"retry_after": 30}})]
+        notifier = make_notifier(session_factory, telegram_stub, base_delay=1.0)
+        await start_idle(notifier)
+        enqueue(session_factory, ["hello"])
+        try:
+            before = datetime.now()
+            await notifier.drain_once()
+        finally:
+            await notifier.stop()
+            await telegram_stub.stop()
+        return before
+
+    before = asyncio.run(scenario())
+    (row,) = outbox(session_factory)
+    assert row.status == "pending"
+    assert row.attempts == 1
+    assert row.last_error.startswith("HTTP 429")
+    assert row.next_attempt_at >= before + timedelta(seconds=30)
+    assert telegram_stub.messages == []
+
+
+def test_two_workers_do_not_send_twice(session_factory, telegram_stub):
+    messages = [f"message {i}" for i in range(60)]
+
+    async def drain(notifier):
+        while await notifier.drain_once():
+            pass
+
+    async def scenario():
+        await telegram_stub.start()
+        telegram_stub.delay = 0.005
+        workers = [make_notifier(session_factory, telegram_stub, batch_size=7) for _ in range(2)]
+        for notifier in workers:
+            await start_idle(notifier)
+        enqueue(session_factory, messages)
+        try:
+            await asyncio.gather(*(drain(notifier) for notifier in workers))
+        finally:
+            for notifier in workers:
+                await notifier.stop()
+            await telegram_stub.stop()
+
+    asyncio.run(scenario())
+    assert sorted(telegram_stub.messages) == sorted(messages)
+    assert {row.status for row in outbox(session_factory)} == {"sent"}
+    assert {row.attempts for row in outbox(session_factory)} == {1}
+
+
+def test_stop_drains_due_notifications(session_factory, telegram_stub):
+    messages = [f"message {i}" for i in range(10)]
+
+    async def scenario():
+        await telegram_stub.start()
+        telegram_stub.delay = 0.01
+        notifier = make_notifier(session_factory, telegram_stub, batch_size=3)
+        await start_idle(notifier)
+        enqueue(session_factory, messages)  # wake しないまま停止する
+        try:
+            await notifier.stop(drain_timeout=5.0)
+        finally:
+            await telegram_stub.stop()
+
+    asyncio.run(scenario())
+    assert telegram_stub.messages == messages
+    assert {row.status for row in outbox(session_factory)} == {"sent"}
+
+
+def test_stop_without_drain_leaves_notifications_pending(session_factory, telegram_stub):
+    async def scenario():
+        await telegram_stub.start()
+        notifier = make_notifier(session_factory, telegram_stub)
+        await start_idle(notifier)
+        enqueue(session_factory, ["later"])
+        try:
+            await notifier.stop()
+        finally:
+            await telegram_stub.stop()
+
+    asyncio.run(scenario())
+    (row,) = outbox(session_factory)
+    assert row.status == "pending"
+    assert telegram_stub.messages == []
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+エンドポイントごとの SQL のクエリ数（main.QUERY_BUDGETS）の回帰テスト
+
+X-DB-Queries ヘッダー（QueryBudgetMiddleware）で数え、予算以内であることと、
+学生ごと・イベントごとに SQL を繰り返していない（件数を増やしてもクエリ数が変わらない）ことを確認します。
+"""
+import itertools
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import main
+
+_ids = itertools.count()
+
+
+def new_student(client, **fields):
+    student_id = f"t{next(_ids):05d}"
+    response = client.post("/api/students/", json={"student_id": student_id, "name": f"学生{student_id}", **fields})
+    assert response.status_code == 200, response.text
+    return student_id
+
+
+def queries(response) -> int:
+    assert response.status_code < 400, response.text
+    return int(response.headers["x-db-queries"])
+
+
+def call(client, key, path, **kwargs):
+    """ key（"メソッド パスのテンプレート"）のエンドポイントを呼び、クエリ数が予算以内であることを確認して返す """
+    method = key.split(" ", 1)[0]
+    count = queries(client.request(method, path, **kwargs))
+    assert count <= main.QUERY_BUDGETS[key], f"{key}: {count} queries (budget {main.QUERY_BUDGETS[key]})"
+    return count
+
+
+#{{{ 予算
+def test_every_budget_is_exercised():
+    # 予算を追加したらこのファイルにもテストを追加する
+    assert set(main.QUERY_BUDGETS) == set(BUDGET_CASES) | {
+        "POST /api/attendance-now/{student_id}",
+        "POST /api/attendance/",
+        "POST /api/attendance/batch",
+        "GET /api/core-time/check/{period}",
+        "DELETE /api/students/{student_id}",
+    }
+
+
+BUDGET_CASES = {
+    "GET /api/students/": lambda client, student_id: "/api/students/",
+    "GET /api/students/{student_id}": lambda client, student_id: f"/api/students/{student_id}",
+    "GET /api/attendance/{student_id}": lambda client, student_id: f"/api/attendance/{student_id}?days=7",
+    "GET /api/current-status/": lambda client, student_id: "/api/current-status/",
+    "GET /api/dashboard/summary": lambda client, student_id: "/api/dashboard/summary",
+    "GET /api/core-time/violations": lambda client, student_id: "/api/core-time/violations",
+    "GET /api/coretime/{student_id}": lambda client, student_id: f"/api/coretime/{student_id}",
+}
+
+
+@pytest.mark.parametrize("key", sorted(BUDGET_CASES))
+def test_read_endpoints_within_budget(client, key):
+    student_id = new_student(client)
+    client.post(f"/api/attendance-now/{student_id}")
+    call(client, key, BUDGET_CASES[key](client, student_id))
+
+
+def test_attendance_history_without_window_within_budget(client):
+    student_id = new_student(client)
+    call(client, "GET /api/attendance/{student_id}", f"/api/attendance/{student_id}")
+
+
+def test_attendance_now_within_budget(client):
+    student_id = new_student(client)
+    call(client, "POST /api/attendance-now/{student_id}", f"/api/attendance-now/{student_id}")  # 入室
+    call(client, "POST /api/attendance-now/{student_id}", f"/api/attendance-now/{student_id}")  # 退室
+
+
+def test_attendance_within_budget(client):
+    student_id = new_student(client)
+    entered = datetime.now() - timedelta(hours=1)
+    for at in (entered, entered + timedelta(minutes=30)):  # 入室・退室
+        call(client, "POST /api/attendance/", "/api/attendance/",
+             json={"student_id": student_id, "time": at.isoformat()})
+
+
+def test_delete_student_within_budget(client):
+    student_id = new_student(client)
+    client.post(f"/api/attendance-now/{student_id}")
+    call(client, "DELETE /api/students/{student_id}", f"/api/students/{student_id}")
+#}}}
+
+
+#{{{ 件数によらないクエリ数
+def batch_events(student_ids, started):
+    events = []
+    for student_id in student_ids:
+        events.append({"student_id": student_id, "time": started.isoformat()})
+        events.append({"student_id": student_id, "time": (started + timedelta(minutes=50)).isoformat()})
+    return events
+
+
+def test_batch_queries_do_not_grow_with_events(client):
+    started = datetime.now() - timedelta(hours=3)
+    few = [new_student(client) for _ in range(2)]
+    many = [new_student(client) for _ in range(20)]
+    small = call(client, "POST /api/attendance/batch", "/api/attendance/batch",
+                 json={"events": batch_events(few, started)})
+    large = call(client, "POST /api/attendance/batch", "/api/attendance/batch",
+                 json={"events": batch_events(many, started)})
+    assert small == large
+
+
+def test_dashboard_queries_do_not_grow_with_students(client):
+    # user-001: 学生ごとに出席記録を取得しない
+    for student_id in [new_student(client) for _ in range(3)]:
+        client.post(f"/api/attendance-now/{student_id}")
+    before = queries(client.get("/api/dashboard/summary"))
+    for student_id in [new_student(client) for _ in range(30)]:
+        client.post(f"/api/attendance-now/{student_id}")
+    after = queries(client.get("/api/dashboard/summary"))
+    assert before == after
+
+
+def test_core_time_check_queries_do_not_grow_with_students(client):
+    # user-002: 不在者の抽出・アラートの登録・違反回数の更新を学生ごとに繰り返さない
+    # 今日のコアタイムが 1限の学生を3人、2限の学生を30人にして、どちらも全員を新規の違反にする
+    day = date.today().isoweekday()
+    for _ in range(3):
+        new_student(client, core_time_1_day=day, core_time_1_period=1)
+    for _ in range(30):
+        new_student(client, core_time_1_day=day, core_time_1_period=2)
+    few = call(client, "GET /api/core-time/check/{period}", "/api/core-time/check/1")
+    many = call(client, "GET /api/core-time/check/{period}", "/api/core-time/check/2")
+    assert few == many
+    # 2回目は新規の違反がないので、アラートと通知の登録を行わない
+    assert call(client, "GET /api/core-time/check/{period}", "/api/core-time/check/2") <= many
+#}}}
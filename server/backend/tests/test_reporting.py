@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+services/reporting.py の snapshot モードのテスト
+"""
+import asyncio
+import os
+
+import pytest
+
+import main
+from services.reporting import ReportingDatabase
+
+
+@pytest.fixture
+def snapshot_reporting(monkeypatch, tmp_path):
+    """ アプリのデータベースを snapshot モードで読むように main.reporting を差し替える """
+    reporting = ReportingDatabase(main.DB_PATH, mode="snapshot", snapshot_path=os.fspath(tmp_path / "reporting.db"))
+    reporting.refresh()
+    monkeypatch.setattr(main, "reporting", reporting)
+    yield reporting
+    asyncio.run(reporting.stop())
+
+
+def test_live_reads_do_not_use_the_snapshot(client, snapshot_reporting):
+    # user-023: スナップショットの作成後の入室が、ダッシュボードと履歴にすぐ出る
+    response = client.post("/api/students/", json={"student_id": "snap01", "name": "学生snap01"})
+    assert response.status_code == 200, response.text
+    assert client.post("/api/attendance-now/snap01").json()["status"] == "入室"
+
+    response = client.get("/api/dashboard/summary")
+    assert response.headers["x-data-source"] == "readonly"
+    (row,) = [row for row in response.json()["students"] if row["student_id"] == "snap01"]
+    assert row["is_present"]
+
+    response = client.get("/api/attendance/snap01?days=1")
+    assert response.headers["x-data-source"] == "readonly"
+    assert len(response.json()) == 1
+
+    # レポート用の読み出しはスナップショットから
+    response = client.get("/api/core-time/violations")
+    assert response.headers["x-data-source"] == "snapshot"
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+services/versions.py の VersionWatcher と LocalWrites のテスト
+"""
+import asyncio
+from datetime import date
+
+import pytest
+from sqlalchemy import delete
+from sqlalchemy.orm import sessionmaker
+
+from db.database import create_async_sqlite_engine, create_sqlite_engine
+from models.models import Alert, Student
+from services.versions import LocalWrites, VersionWatcher
+
+TABLES = ["current_status", "students", "alerts"]
+
+
+@pytest.fixture
+def worker(db_path):
+    """ このプロセスのワーカー（同期・非同期のエンジンに LocalWrites を登録した watcher） """
+    local = LocalWrites(["students", "alerts"])
+    engine = local.register(create_sqlite_engine(f"sqlite:///{db_path}"))
+    async_engine = create_async_sqlite_engine(f"sqlite+aiosqlite:///{db_path}")
+    local.register(async_engine.sync_engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    calls = []
+    watcher = VersionWatcher(session_factory, TABLES, lambda db, tables: calls.append(tables), local=local)
+    watcher.poll()
+    yield session_factory, async_engine, watcher, calls
+    engine.dispose()
+    asyncio.run(async_engine.dispose())
+
+
+def add_student(session_factory, student_id):
+    db = session_factory()
+    try:
+        db.add(Student(student_id=student_id, name=f"学生{student_id}"))
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_own_writes_are_not_reported(worker):
+    # user-025: このワーカーの学生・違反の書き込みは resync にしない
+    session_factory, async_engine, watcher, calls = worker
+    add_student(session_factory, "w1")
+    db = session_factory()
+    try:
+        db.add_all([Alert(student_id="w1", alert_date=date(2026, 4, 10), alert_period=period) for period in (1, 2)])
+        db.query(Student).update({Student.core_time_violations: 2})
+        db.commit()
+    finally:
+        db.close()
+
+    async def delete_alerts():
+        async with async_engine.begin() as conn:
+            await conn.execute(delete(Alert))
+
+    asyncio.run(delete_alerts())
+    assert watcher.poll() == set()
+    assert calls == []
+
+
+def test_rolled_back_writes_are_not_recorded(worker, session_factory):
+    session_factory_a, _, watcher, calls = worker
+    db = session_factory_a()
+    try:
+        db.add(Student(student_id="w1", name="学生w1"))
+        db.flush()
+        db.rollback()
+    finally:
+        db.close()
+    # 取り消した分と同じバージョンを他のワーカーが使っても見落とさない
+    add_student(session_factory, "other")
+    assert watcher.poll() == {"students"}
+
+
+def test_other_workers_writes_are_reported(worker, session_factory):
+    session_factory_a, _, watcher, calls = worker
+    # 他のワーカーの書き込みが、このワーカーの書き込みの前後にあっても知らせる
+    add_student(session_factory, "other1")
+    add_student(session_factory_a, "w1")
+    assert watcher.poll() == {"students"}
+    add_student(session_factory_a, "w2")
+    add_student(session_factory, "other2")
+    add_student(session_factory_a, "w3")
+    assert watcher.poll() == {"students"}
+    assert calls == [{"students"}, {"students"}]
+    # 確認済みの範囲は次の回に持ち越さない
+    add_student(session_factory_a, "w4")
+    assert watcher.poll() == set()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+書き込み用のセッション（BEGIN IMMEDIATE）とロック待ちのタイムアウトのテスト
+"""
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+import main
+from db.database import WRITE_OPTIONS, create_sqlite_engine
+from models.models import Student
+
+
+@contextmanager
+def write_lock(path):
+    """ 別の接続で書き込みのロックを持つ """
+    conn = sqlite3.connect(path, timeout=0, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.close()
+
+
+def test_write_session_locks_before_reading(db_path):
+    # user-010: 読み取りの前に書き込みのロックを取るので、読み取りから書き込みへの切り替えでロックを取り合わない
+    engine = create_sqlite_engine(f"sqlite:///{db_path}")
+    read_session = sessionmaker(bind=engine)()
+    write_session = sessionmaker(bind=engine.execution_options(**WRITE_OPTIONS))()
+    try:
+        read_session.execute(select(Student)).all()
+        with write_lock(db_path):  # 通常のセッションは読み取りだけではロックを取らない
+            pass
+        read_session.rollback()
+
+        write_session.execute(select(Student)).all()
+        with pytest.raises(sqlite3.OperationalError, match="database is locked"):
+            with write_lock(db_path):
+                pass
+        write_session.rollback()
+    finally:
+        read_session.close()
+        write_session.close()
+        engine.dispose()
+
+
+CORE_TIME = {"core_time_1_day": 1, "core_time_1_period": 1, "core_time_2_day": 2, "core_time_2_period": 2}
+
+
+def test_lock_timeout_returns_503(client):
+    response = client.post("/api/students/", json={"student_id": "lock01", "name": "学生lock01"})
+    assert response.status_code == 200, response.text
+
+    with write_lock(main.DB_PATH):
+        for method, path in [("POST", "/api/attendance-now/lock01"), ("POST", "/api/coretime/lock01")]:
+            response = client.request(method, path, json=CORE_TIME if path.startswith("/api/coretime") else None)
+            assert response.status_code == 503, (path, response.text)
+            assert response.headers["retry-after"] == "1"
+
+    # ロックが外れれば記録できる（待っていた間の変更は残っていない）
+    assert client.post("/api/attendance-now/lock01").json()["status"] == "入室"
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 用の uvicorn ワーカー（gunicorn.conf.py の worker_class）
+
+gunicorn は停止時にワーカーへ SIGTERM を送り、graceful_timeout 秒後に SIGKILL します。
+uvicorn のワーカーは既定では処理中のリクエスト（切断されない SSE を含む）を無期限に待つため、
+SIGKILL までにライフスパンの停止処理（通知の送信・リースの解放）が動かないことがあります。
+このワーカーは処理中のリクエストを待つ時間を、graceful_timeout から停止処理の分を引いた時間に制限します。
+"""
+import os
+
+from uvicorn.workers import UvicornWorker
+
+# 停止処理に残す秒数（未送信の通知を送り切るまでの待ち + リースの解放などの余裕）
+SHUTDOWN_RESERVE = float(os.getenv("NOTIFIER_DRAIN_TIMEOUT", "5")) + 2.0
+
+
+class AttendanceWorker(UvicornWorker):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 時間を過ぎたリクエストは打ち切られる（ダッシュボードの EventSource は別のワーカーに再接続する）
+        self.config.timeout_graceful_shutdown = max(self.cfg.graceful_timeout - SHUTDOWN_RESERVE, 1.0)
@@ -10,8 +10,8 @@ const PERIODS = ['', '1限', '2限', '3限', '4限', '5限', '6限'];
 // ページ読み込み時に実行
 document.addEventListener('DOMContentLoaded', () => {
     loadStudentData();
-    // 1分ごとにデータを更新
-    setInterval(loadStudentData, 60000);
+    // 入退室・違反はサーバーからのイベントで該当行だけ更新する
+    subscribeEvents();
     
     // コアタイムチェックボタンのイベントリスナーを設定
     const checkButtons = document.querySelectorAll('.check-coretime-btn');
@@ -33,87 +33,37 @@ document.addEventListener('DOMContentLoaded', () => {
 // 学生データの読み込み
 async function loadStudentData() {
     try {
-        // 学生一覧の取得
-        const studentsResponse = await fetch(`${API_BASE_URL}/students/`);
-        if (!studentsResponse.ok) {
-            throw new Error(`学生データの取得に失敗: ${studentsResponse.status}`);
+        // 入室状況・今週の利用時間を含む学生一覧を1回のリクエストで取得
+        const summaryResponse = await fetch(`${API_BASE_URL}/dashboard/summary`);
+        if (!summaryResponse.ok) {
+            throw new Error(`学生データの取得に失敗: ${summaryResponse.status}`);
         }
-        const students = await studentsResponse.json();
-
-        // 現在の入室状況の取得
-        const currentStatusResponse = await fetch(`${API_BASE_URL}/current-status/`);
-        if (!currentStatusResponse.ok) {
-            throw new Error(`入室状況の取得に失敗: ${currentStatusResponse.status}`);
-        }
-        const currentStatus = await currentStatusResponse.json();
-
-        // 今週の日付範囲を計算
-        const today = new Date();
-        const startOfWeek = new Date(today);
-        startOfWeek.setDate(today.getDate() - today.getDay());
-        startOfWeek.setHours(0, 0, 0, 0);
+        const summary = await summaryResponse.json();
 
         // 学生データの表示
         const studentList = document.getElementById('studentList');
         studentList.innerHTML = '';
 
-        for (const student of students) {
-            try {
-                // 現在の入室状況を確認
-                const isPresent = currentStatus.some(status => status.student_id === student.student_id);
-                
-                // 今週の利用時間を取得
-                const attendanceResponse = await fetch(`${API_BASE_URL}/attendance/${student.student_id}?days=7`);
-                if (!attendanceResponse.ok) {
-                    throw new Error(`出席データの取得に失敗: ${attendanceResponse.status}`);
-                }
-                const attendanceLogs = await attendanceResponse.json();
-                
-                // 利用時間の計算
-                let totalHours = 0;
-                for (const log of attendanceLogs) {
-                    if (log.entry_time && log.exit_time) {
-                        const entryTime = new Date(log.entry_time);
-                        const exitTime = new Date(log.exit_time);
-                        // 今週のログのみを計算
-                        if (entryTime >= startOfWeek) {
-                            const duration = (exitTime - entryTime) / (1000 * 60 * 60);
-                            if (duration > 0) {  // 負の値は除外
-                                totalHours += duration;
-                            }
-                        }
-                    }
-                }
-
-                // コアタイムの表示形式を整形
-                const coreTime1 = formatCoreTime(student.core_time_1_day, student.core_time_1_period);
-                const coreTime2 = formatCoreTime(student.core_time_2_day, student.core_time_2_period);
-
-                // 違反回数の表示を強調
-                const violationClass = student.core_time_violations > 0 ? 'violation' : '';
-                const violationText = student.core_time_violations > 0 ? 
-                    `<span class="text-danger fw-bold">${student.core_time_violations}回</span>` : 
-                    '<span class="text-muted">0回</span>';
-
-                // テーブル行の作成
-                const row = document.createElement('tr');
-                row.innerHTML = `
-                    <td>${student.student_id}</td>
-                    <td>${student.name}</td>
-                    <td class="${isPresent ? 'status-present' : 'status-absent'}">
-                        <span>${isPresent ? '入室中 ✓' : '退室中 ×'}</span>
-                    </td>
-                    <td>${totalHours.toFixed(1)}時間</td>
-                    <td>${coreTime1}</td>
-                    <td>${coreTime2}</td>
-                    <td class="${violationClass}">${violationText}</td>
-                `;
-                studentList.appendChild(row);
-            } catch (error) {
-                console.error(`学生 ${student.student_id} のデータ取得に失敗:`, error);
-                // エラーが発生しても他の学生のデータは表示を続ける
-                continue;
-            }
+        for (const student of summary.students) {
+            // コアタイムの表示形式を整形
+            const coreTime1 = formatCoreTime(student.core_time_1_day, student.core_time_1_period);
+            const coreTime2 = formatCoreTime(student.core_time_2_day, student.core_time_2_period);
+
+            // テーブル行の作成
+            const row = document.createElement('tr');
+            row.dataset.studentId = student.student_id;
+            row.innerHTML = `
+                <td>${student.student_id}</td>
+                <td>${student.name}</td>
+                <td></td>
+                <td>${student.weekly_hours.toFixed(1)}時間</td>
+                <td>${coreTime1}</td>
+                <td>${coreTime2}</td>
+                <td></td>
+            `;
+            setPresence(row, student.is_present);
+            setViolations(row, student.core_time_violations);
+            studentList.appendChild(row);
         }
     } catch (error) {
         console.error('データの取得に失敗しました:', error);
@@ -130,6 +80,82 @@ async function loadStudentData() {
     }
 }
 
+// 学生の行を取得（表示されていなければ null）
+function findStudentRow(studentId) {
+    const studentList = document.getElementById('studentList');
+    for (const row of studentList.rows) {
+        if (row.dataset.studentId === studentId) return row;
+    }
+    return null;
+}
+
+// 入室状況のセルを更新
+function setPresence(row, isPresent) {
+    const cell = row.cells[2];
+    cell.className = isPresent ? 'status-present' : 'status-absent';
+    cell.innerHTML = `<span>${isPresent ? '入室中 ✓' : '退室中 ×'}</span>`;
+}
+
+// 違反回数のセルを更新（違反がある場合は強調）
+function setViolations(row, count) {
+    const cell = row.cells[6];
+    cell.className = count > 0 ? 'violation' : '';
+    cell.innerHTML = count > 0 ?
+        `<span class="text-danger fw-bold">${count}回</span>` :
+        '<span class="text-muted">0回</span>';
+}
+
+// サーバーからのイベント（/api/events）を購読する
+function subscribeEvents() {
+    if (!window.EventSource) {
+        // EventSource 非対応のブラウザでは従来どおり1分ごとに更新
+        setInterval(loadStudentData, 60000);
+        return;
+    }
+    const source = new EventSource(`${API_BASE_URL}/events`);
+    let connected = false;
+
+    // 再接続時は切断中のイベントを取りこぼしている可能性があるので一覧を読み直す
+    source.addEventListener('open', () => {
+        if (connected) loadStudentData();
+        connected = true;
+    });
+    source.addEventListener('resync', () => loadStudentData());
+
+    source.addEventListener('entry', (e) => {
+        const data = JSON.parse(e.data);
+        const row = findStudentRow(data.student_id);
+        if (!row) {
+            // 新しく登録された学生
+            loadStudentData();
+            return;
+        }
+        setPresence(row, true);
+    });
+
+    source.addEventListener('exit', (e) => {
+        const data = JSON.parse(e.data);
+        const row = findStudentRow(data.student_id);
+        if (!row) return;
+        setPresence(row, false);
+        row.cells[3].textContent = `${data.weekly_hours.toFixed(1)}時間`;
+    });
+
+    source.addEventListener('violation', (e) => {
+        const data = JSON.parse(e.data);
+        for (const student of data.updated_students) {
+            const row = findStudentRow(student.student_id);
+            if (row) setViolations(row, student.core_time_violations);
+        }
+    });
+
+    source.addEventListener('student_deleted', (e) => {
+        const data = JSON.parse(e.data);
+        const row = findStudentRow(data.student_id);
+        if (row) row.remove();
+    });
+}
+
 // コアタイムの表示形式を整形する関数
 function formatCoreTime(day, period) {
     if (!day || !period) return '-';
@@ -145,27 +171,11 @@ async function checkCoreTime(period) {
         }
         const result = await response.json();
         
-        // 更新された学生データを反映
+        // 更新された学生データを反映（イベントでも届くが、接続していない場合に備えて反映する）
         if (result.updated_students) {
-            const studentList = document.getElementById('studentList');
-            const rows = studentList.getElementsByTagName('tr');
-            
             for (const updatedStudent of result.updated_students) {
-                for (const row of rows) {
-                    const studentIdCell = row.cells[0];
-                    if (studentIdCell && studentIdCell.textContent === updatedStudent.student_id) {
-                        const violationCell = row.cells[6];
-                        if (violationCell) {
-                            const violationClass = updatedStudent.core_time_violations > 0 ? 'violation' : '';
-                            const violationText = updatedStudent.core_time_violations > 0 ? 
-                                `<span class="text-danger fw-bold">${updatedStudent.core_time_violations}回</span>` : 
-                                '<span class="text-muted">0回</span>';
-                            violationCell.className = violationClass;
-                            violationCell.innerHTML = violationText;
-                        }
-                        break;
-                    }
-                }
+                const row = findStudentRow(updatedStudent.student_id);
+                if (row) setViolations(row, updatedStudent.core_time_violations);
             }
         }
         